@@ -0,0 +1,140 @@
+# -*- coding:utf-8 -*-
+# Copyright (c) 2011 Renato de Pontes Pereira, renato.ppontes at gmail dot com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+Command line interface. Usage::
+
+    python -m aerolito batch config.yml [input] [-o output] [-w workers]
+    python -m aerolito compile config.yml knowledge.bin [--drop-shadowed]
+    python -m aerolito analyze config.yml
+    python -m aerolito replay old.yml new.yml transcript... [-w workers]
+"""
+
+import sys
+import codecs
+import argparse
+
+def batch(args):
+    from aerolito import batch
+
+    if args.input == '-':
+        lines = codecs.getreader(args.encoding)(sys.stdin)
+    else:
+        lines = codecs.open(args.input, 'rb', args.encoding)
+
+    if args.output == '-':
+        output = codecs.getwriter('utf-8')(sys.stdout)
+    else:
+        output = codecs.open(args.output, 'wb', 'utf-8')
+
+    results = batch.run(args.config, lines, encoding=args.encoding,
+                        format=args.format, workers=args.workers,
+                        window=args.window, max_users=args.max_users)
+    for result in results:
+        output.write(result)
+        output.write(u'\n')
+    output.flush()
+
+def compile(args):
+    from aerolito import storage
+    storage.save(args.config, args.output, encoding=args.encoding,
+                 drop_shadowed=args.drop_shadowed)
+
+def analyze(args):
+    from aerolito import analyzer
+    from aerolito.knowledge import KnowledgeBase
+
+    knowledge = KnowledgeBase(args.config, encoding=args.encoding, lazy=True)
+    findings = knowledge.analyze()
+    if findings:
+        output = codecs.getwriter('utf-8')(sys.stdout)
+        output.write(analyzer.report(findings))
+        output.write(u'\n')
+        output.flush()
+    return 1 if findings else 0
+
+def replay(args):
+    from aerolito import replay
+
+    records = replay.read_records(args.transcripts)
+    report = replay.run(args.old, args.new, records, encoding=args.encoding,
+                        workers=args.workers, window=args.window)
+
+    output = codecs.getwriter('utf-8')(sys.stdout)
+    output.write(report.text(limit=args.limit))
+    output.flush()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='aerolito')
+    commands = parser.add_subparsers()
+
+    command = commands.add_parser('batch',
+                    help='respond user inputs read from JSONL or TSV lines')
+    command.add_argument('config', help='configuration file')
+    command.add_argument('input', nargs='?', default='-',
+                         help='input file, default is stdin')
+    command.add_argument('-o', '--output', default='-',
+                         help='output file, default is stdout')
+    command.add_argument('-f', '--format', default='auto',
+                         choices=['auto', 'jsonl', 'tsv'])
+    command.add_argument('-w', '--workers', type=int, default=1,
+                         help='number of worker processes')
+    command.add_argument('--window', type=int, default=1024,
+                         help='maximum number of inputs in flight')
+    command.add_argument('--max-users', type=int, default=100000,
+                         help='maximum number of sessions kept by worker')
+    command.add_argument('-e', '--encoding', default='utf-8')
+    command.set_defaults(func=batch)
+
+    command = commands.add_parser('compile',
+                    help='write a compiled knowledge base file')
+    command.add_argument('config', help='configuration file')
+    command.add_argument('output', help='compiled knowledge base file')
+    command.add_argument('--drop-shadowed', action='store_true',
+                         help='do not write patterns that can never match')
+    command.add_argument('-e', '--encoding', default='utf-8')
+    command.set_defaults(func=compile)
+
+    command = commands.add_parser('analyze',
+                    help='report the patterns that can never match')
+    command.add_argument('config', help='configuration file')
+    command.add_argument('-e', '--encoding', default='utf-8')
+    command.set_defaults(func=analyze)
+
+    command = commands.add_parser('replay',
+                    help='compare the responses of two configurations to '
+                         'recorded transcripts')
+    command.add_argument('old', help='old configuration file')
+    command.add_argument('new', help='new configuration file')
+    command.add_argument('transcripts', nargs='+', help='transcript files')
+    command.add_argument('-w', '--workers', type=int, default=1,
+                         help='number of worker processes')
+    command.add_argument('--window', type=int, default=1024,
+                         help='maximum number of inputs in flight')
+    command.add_argument('-n', '--limit', type=int, default=20,
+                         help='maximum number of changed responses shown')
+    command.add_argument('-e', '--encoding', default='utf-8')
+    command.set_defaults(func=replay)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
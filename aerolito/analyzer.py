@@ -0,0 +1,162 @@
+# -*- coding:utf-8 -*-
+# Copyright (c) 2011 Renato de Pontes Pereira, renato.ppontes at gmail dot com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+Static analysis of conversation patterns.
+
+Patterns are tested in order and the first match wins, so a pattern can never
+match if an earlier pattern matches every input it matches. ``shadowed`` finds
+these patterns in a list, comparing the expanded ``Regex`` expressions: an 
+earlier pattern P shadows a pattern Q if
+
+- P has no ``when`` action with side effects, and its ``Condition``s are 
+  also conditions of Q;
+- P has no ``in`` tag or a catch-all ``in`` element ("\*"), or Q has an
+  ``in`` tag and all its elements are elements of P, with the same 
+  ``ignore`` characters;
+- the same holds for the ``after`` tag, where a catch-all element matches
+  any last response.
+
+Q is a *duplicate* of P if both have the same elements and conditions, 
+otherwise Q is *shadowed* by P. The analysis is conservative: patterns 
+shadowed by a combination of patterns, or by a broader expression (e.g. 
+"hello \*" and "hello there") are not found. Patterns of different topics
+do not shadow each other, as topics are not always active.
+"""
+
+from aerolito.pattern import Pattern
+from aerolito.profiler import pattern_label
+
+_catch_all = '^(.*)$'
+
+class _Signature(object):
+    u"""
+    The match conditions of a compiled pattern.
+    """
+    __slots__ = ('ignore', 'ins', 'after', 'conditions', 'pure', 
+                 'any_in', 'any_after')
+
+    def __init__(self, pattern):
+        if pattern._raw is not None:
+            # Compiles a copy, so lazy patterns are kept lazy
+            pattern = Pattern(pattern._raw, pattern._environ)
+
+        self.ignore = pattern._ignore
+        self.ins = self.__expressions(pattern._in)
+        self.after = self.__expressions(pattern._after)
+        self.conditions = frozenset(
+                (c._test, tuple([getattr(x, '_value', x) for x in c._params]))
+                for c in pattern._requires or ())
+        self.pure = not pattern._when
+        self.any_in = self.ins is None or _catch_all in self.ins
+        self.any_after = self.after is None or _catch_all in self.after
+
+    def __expressions(self, regexes):
+        if regexes is None:
+            return None
+        return frozenset(r._expression for r in regexes)
+
+    def covers(self, other):
+        u"""
+        Returns True if every input matching ``other`` matches this pattern.
+        """
+        if not self.pure or not self.conditions <= other.conditions:
+            return False
+
+        if not self.any_in:
+            if other.ins is None or other.ignore != self.ignore or \
+               not other.ins <= self.ins:
+                return False
+
+        if self.after is not None and other.after is None:
+            return False
+        if not self.any_after:
+            if other.ignore != self.ignore or not other.after <= self.after:
+                return False
+
+        return True
+
+    def same(self, other):
+        u"""
+        Returns True if both patterns have the same match conditions.
+        """
+        return self.pure and other.pure and self.ignore == other.ignore and \
+               self.ins == other.ins and self.after == other.after and \
+               self.conditions == other.conditions
+
+def shadowed(patterns):
+    u"""
+    Returns a list of ``(number, shadower, kind)`` of the ``patterns`` that
+    can never match, where ``shadower`` is the number of the first earlier 
+    pattern that matches all their inputs, and ``kind`` is *duplicate* or 
+    *shadowed*.
+    """
+    result = []
+    signatures = {}
+    by_expression = {}
+    anys = []
+
+    for number, pattern in enumerate(patterns):
+        signature = _Signature(pattern)
+
+        # Only patterns with the elements of this one can shadow it
+        candidates = list(anys)
+        if signature.ins is not None:
+            key = (signature.ignore, min(signature.ins))
+            candidates.extend(by_expression.get(key, ()))
+
+        shadower = None
+        for other in sorted(candidates):
+            if signatures[other].covers(signature):
+                shadower = other
+                break
+
+        if shadower is not None:
+            kind = 'duplicate' if signatures[shadower].same(signature) \
+                   else 'shadowed'
+            result.append((number, shadower, kind))
+            continue
+
+        # Patterns shadowed are not candidates, their shadower covers all 
+        # patterns they cover
+        if not signature.pure:
+            continue
+        signatures[number] = signature
+        if signature.any_in:
+            anys.append(number)
+        else:
+            for expression in signature.ins:
+                by_expression.setdefault((signature.ignore, expression), 
+                                         []).append(number)
+
+    return result
+
+def report(findings):
+    u"""
+    Returns the text of the ``findings`` of ``KnowledgeBase.analyze``.
+    """
+    lines = []
+    for group, number, pattern, shadower, kind in findings:
+        lines.append(u'%s #%d %s: %s %s'%(
+                u'topic %s'%group if group else u'conversations',
+                number, pattern_label(pattern), 
+                u'duplicate of' if kind == 'duplicate' else u'shadowed by',
+                pattern_label(shadower)))
+    return u'\n'.join(lines)
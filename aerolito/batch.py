@@ -0,0 +1,284 @@
+# -*- coding:utf-8 -*-
+# Copyright (c) 2011 Renato de Pontes Pereira, renato.ppontes at gmail dot com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+Batch processing of user inputs.
+
+Reads records of ``user_id, text`` (JSONL or TSV lines) and streams the
+kernel responses, in input order, to an output file. Used by the command
+``python -m aerolito batch config.yml``.
+
+Memory is bounded by the ``window`` of inputs in flight and by the number 
+of user sessions kept by each kernel, ``max_users``: the sessions of the 
+least recently seen users are removed, so users seen again after more than
+``max_users`` other users start a new conversation.
+"""
+
+import os
+import json
+import zlib
+import Queue
+import functools
+import traceback
+import multiprocessing
+from collections import OrderedDict
+from aerolito import exceptions
+from aerolito.kernel import Kernel
+from aerolito.knowledge import protect_shared_pages
+
+# Keys of the user history lists, trimmed after each response to keep the
+# memory of long batches bounded
+_history = ('inputs', 'responses', 'responses-normalized')
+
+def parse_line(line, format='auto'):
+    u"""
+    Parses an input ``line`` into a ``(user_id, text, format)`` tuple.
+
+    ``format`` may be *jsonl*, *tsv* or *auto*. In auto mode, lines starting
+    with "{" are read as JSON. Blank lines return None.
+    """
+    line = line.rstrip(u'\r\n')
+    if not line.strip():
+        return None
+
+    if format == 'auto':
+        format = 'jsonl' if line.lstrip().startswith(u'{') else 'tsv'
+
+    if format == 'jsonl':
+        try:
+            data = json.loads(line)
+            return data['user_id'], data['text'], format
+        except (ValueError, KeyError, TypeError):
+            raise exceptions.InvalidBatchLine(line.encode('utf-8'))
+    elif format == 'tsv':
+        if u'\t' not in line:
+            raise exceptions.InvalidBatchLine(line.encode('utf-8'))
+        user_id, text = line.split(u'\t', 1)
+        return user_id, text, format
+    else:
+        raise exceptions.InvalidBatchLine(line.encode('utf-8'))
+
+def _escape(value):
+    return value.replace(u'\\', u'\\\\')\
+                .replace(u'\t', u'\\t')\
+                .replace(u'\n', u'\\n')
+
+def format_result(user_id, text, response, format):
+    u"""
+    Formats a response in the same ``format`` of the input line. JSON lines
+    receive a "response" key and TSV lines a third column.
+    """
+    if format == 'jsonl':
+        return json.dumps({'user_id': user_id,
+                           'text': text,
+                           'response': response}, ensure_ascii=False)
+    else:
+        return u'\t'.join([_escape(unicode(user_id)),
+                           _escape(text),
+                           _escape(response or u'')])
+
+class UserLimit(object):
+    u"""
+    Keeps the sessions of at most ``size`` users in a ``kernel``, removing 
+    the session of the least recently seen user.
+    """
+
+    def __init__(self, kernel, size):
+        self.kernel = kernel
+        self.size = size
+        self._users = OrderedDict()
+
+    def __len__(self):
+        return len(self._users)
+
+    def seen(self, user_id):
+        u"""
+        Marks ``user_id`` as the most recently seen user.
+        """
+        users = self._users
+        users.pop(user_id, None)
+        users[user_id] = True
+        while len(users) > self.size:
+            old, value = users.popitem(last=False)
+            self.kernel.remove_user(old)
+
+def respond(kernel, user_id, text, match=False, users=None):
+    u"""
+    Responds ``text`` for ``user_id``, trimming the user history to the last
+    entry. If ``match`` is True, returns the response and the matched 
+    pattern (see ``Kernel.respond_match``). If ``users`` is informed, a 
+    ``UserLimit`` of ``kernel``, the user is marked as seen.
+    """
+    result = kernel.respond_match(text, user_id)
+
+    user = kernel._environ['session'][user_id]
+    for key in _history:
+        del user[key][:-1]
+    if users is not None:
+        users.seen(user_id)
+
+    if match:
+        return result
+    return result[0]
+
+def _respond_limited(state, user_id, text):
+    kernel, users = state
+    return respond(kernel, user_id, text, users=users)
+
+def shard(user_id, workers):
+    u"""
+    Returns the worker of a ``user_id``. All inputs of an user go to the same
+    worker, keeping the user's conversation order.
+    """
+    return zlib.crc32(unicode(user_id).encode('utf-8')) % workers
+
+def _worker(setup, state, handle, inputs, outputs):
+    if state is None:
+        state = setup()
+    else:
+        protect_shared_pages()
+
+    for seq, user_id, text in iter(inputs.get, None):
+        try:
+            result = handle(state, user_id, text)
+        except Exception:
+            # The sequence None reports the traceback to the parent
+            outputs.put((None, traceback.format_exc()))
+            return
+        outputs.put((seq, result))
+
+def _frozen_kernel(config_file, encoding, max_users):
+    kernel = Kernel(config_file, encoding=encoding)
+    kernel.freeze()
+    return kernel, UserLimit(kernel, max_users)
+
+def parallel(setup, handle, records, workers=1, window=1024):
+    u"""
+    Yields ``(record, result)`` for each ``(user_id, text, ...)`` record, in
+    input order, where ``result`` is ``handle(state, user_id, text)``.
+
+    ``state`` (e.g. a frozen kernel) is returned by ``setup``, called once 
+    and shared by the forked worker processes (on systems without fork, 
+    each worker calls ``setup``). All records of an user go to the same 
+    worker. At most ``window`` records are in flight. With one worker, 
+    records are handled in this process. If ``handle`` raises in a worker,
+    ``BatchWorkerFailed`` is raised with the worker traceback.
+    """
+    if workers <= 1:
+        state = setup()
+        for record in records:
+            yield record, handle(state, record[0], record[1])
+        return
+
+    state = setup() if hasattr(os, 'fork') else None
+
+    inputs = [multiprocessing.Queue(window) for i in xrange(workers)]
+    outputs = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_worker,
+                                         args=(setup, state, handle, 
+                                               inputs[i], outputs))
+                 for i in xrange(workers)]
+    for process in processes:
+        process.daemon = True
+        process.start()
+
+    pending = {}
+    done = {}
+    order = {'next': 0}
+
+    def collect():
+        u"""Waits for one result and returns the results ready to output."""
+        while True:
+            try:
+                seq, result = outputs.get(timeout=1)
+                break
+            except Queue.Empty:
+                if not all(p.is_alive() for p in processes):
+                    raise exceptions.BatchWorkerDied()
+        if seq is None:
+            raise exceptions.BatchWorkerFailed(result)
+        done[seq] = result
+
+        results = []
+        while order['next'] in done:
+            seq = order['next']
+            results.append((pending.pop(seq), done.pop(seq)))
+            order['next'] += 1
+        return results
+
+    seq = 0
+    try:
+        for record in records:
+            while seq - order['next'] >= window:
+                for result in collect():
+                    yield result
+
+            pending[seq] = record
+            inputs[shard(record[0], workers)].put((seq, record[0], record[1]))
+            seq += 1
+
+        for queue in inputs:
+            queue.put(None)
+
+        while order['next'] < seq:
+            for result in collect():
+                yield result
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+def _run_serial(config_file, records, encoding, max_users):
+    kernel = Kernel(config_file, encoding=encoding)
+    users = UserLimit(kernel, max_users)
+    for user_id, text, format in records:
+        yield format_result(user_id, text,
+                            respond(kernel, user_id, text, users=users), 
+                            format)
+
+def _run_parallel(config_file, records, encoding, workers, window, 
+                  max_users):
+    setup = functools.partial(_frozen_kernel, config_file, encoding, 
+                              max_users)
+    results = parallel(setup, _respond_limited, records, workers, window)
+    for (user_id, text, format), response in results:
+        yield format_result(user_id, text, response, format)
+
+def run(config_file, lines, encoding='utf-8', format='auto', workers=1,
+        window=1024, max_users=100000):
+    u"""
+    Responds a stream of input ``lines``, yielding the formatted results in
+    input order.
+
+    With more than one worker, the kernel is loaded and frozen once and
+    shared by the forked worker processes (on systems without fork, each 
+    worker loads its own kernel). Each worker receives the inputs of a fixed
+    set of users. At most ``window`` inputs are in flight and each kernel 
+    keeps at most ``max_users`` sessions (see ``UserLimit``), so memory 
+    depends neither on the input size nor on the number of users.
+    """
+    records = (parse_line(line, format) for line in lines)
+    records = (r for r in records if r is not None)
+
+    if workers > 1:
+        return _run_parallel(config_file, records, encoding, workers, window,
+                             max_users)
+    else:
+        return _run_serial(config_file, records, encoding, max_users)
@@ -19,18 +19,278 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE 
 # SOFTWARE.
 
+import time
+import weakref
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from aerolito import exceptions
+from aerolito.session import SessionOverlay, copy_session
+
 # Directive pool is used to stores user defined directives, registered by 
-# ``register_directive``
+# ``register_directive``, with their options (see ``configure``)
 _directive_pool = {}
 
-def register_directive(alias, directive):
-    _directive_pool[alias] = directive
+# Options of directives set by ``configure``, by directive. Directives that 
+# can not be weakly referenced, like builtin functions, are kept in 
+# ``_static_options``
+_options = weakref.WeakKeyDictionary()
+_static_options = {}
+
+# Maximum number of results kept by the ``ttl`` cache of an environment, 
+# expired results are removed when it is reached
+_cache_size = 4096
+
+# Threads of the executor used by directives with ``timeout`` when the kernel
+# have no executor, created on first use
+_executor_size = 4
+_executor = None
+_executor_lock = threading.Lock()
+
+# Returned by ``_call`` when a directive times out
+_timeout = object()
+
+# Held while counting the timed out calls still running in executors
+_running_lock = threading.Lock()
+
+def register_directive(alias, directive, **options):
+    u"""
+    Registers a ``directive``, a class (or function) receiving the environ 
+    and returning the callable directive, with name ``alias``.
+
+    The ``options`` override the attributes of the directive (see 
+    ``configure``).
+    """
+    _directive_pool[alias] = (directive, options)
+
+def configure(directive, pure=None, ttl=None, timeout=None, on_timeout=None):
+    u"""
+    Sets the ``pure``, ``ttl``, ``timeout`` and ``on_timeout`` options of a
+    ``directive`` object, if informed, and returns the directive. Options 
+    override the attributes of the directive (see ``Directive``) and are 
+    kept apart, so any callable can be configured, like bound methods.
+    """
+    options = dict((name, value) for name, value in (('pure', pure), 
+                        ('ttl', ttl), ('timeout', timeout), 
+                        ('on_timeout', on_timeout)) if value is not None)
+    if options:
+        try:
+            table = _options
+            options = dict(table.get(directive, {}), **options)
+        except TypeError:
+            table = _static_options
+            options = dict(table.get(directive, {}), **options)
+        table[directive] = options
+    return directive
+
+def get_option(directive, name, default=None):
+    u"""
+    Returns the option ``name`` of ``directive`` set by ``configure``, or 
+    its attribute ``name``, or ``default``.
+    """
+    try:
+        options = _options.get(directive)
+    except TypeError:
+        options = _static_options.get(directive)
+    if options is not None and name in options:
+        return options[name]
+    return getattr(directive, name, default)
+
+def default_executor():
+    u"""
+    Returns the thread pool shared by kernels without executor.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPool(_executor_size)
+    return _executor
+
+def _call(directive, params, environ, name):
+    u"""
+    Calls ``directive``, in the executor of ``environ`` if it have a 
+    ``timeout``, and records its latency in ``environ['stats']``. Returns 
+    ``_timeout`` if the directive times out.
+
+    Directives in the executor change a copy of the active user session 
+    (see ``session.copy_session``), copied back to the session only if they 
+    return in time.
+
+    The stats of a directive are ``[calls, total time, max time, timeouts, 
+    running]``, where ``running`` is the number of calls timed out that are
+    still running in the executor.
+    """
+    stats = environ.get('stats')
+    entry = None
+    if stats is not None:
+        key = name or getattr(directive, '__name__', type(directive).__name__)
+        entry = stats.get(key)
+        if entry is None:
+            entry = stats.setdefault(key, [0, 0.0, 0.0, 0, 0])
+
+    timeout = get_option(directive, 'timeout')
+    start = time.time()
+    if timeout is None:
+        result = directive(params)
+    else:
+        executor = environ.get('executor') or default_executor()
+        call = directive
+        session = copy = None
+        if hasattr(environ, 'bind'):
+            user_id = environ['user_id']
+            sessions = environ['session']
+            session = sessions.get(user_id)
+            if session is not None:
+                copy = copy_session(session)
+                sessions = SessionOverlay(sessions, user_id, copy)
+            call = environ.bind(directive, session=sessions)
+
+        state = {'done': False, 'late': False}
+        def run(params):
+            try:
+                return call(params)
+            finally:
+                with _running_lock:
+                    state['done'] = True
+                    if state['late'] and entry is not None:
+                        entry[4] -= 1
+
+        future = executor.apply_async(run, (params,))
+        try:
+            result = future.get(timeout)
+        except multiprocessing.TimeoutError:
+            result = _timeout
+            with _running_lock:
+                if not state['done']:
+                    state['late'] = True
+                    if entry is not None:
+                        entry[4] += 1
+        else:
+            if copy is not None:
+                session.update(copy)
+
+    if entry is not None:
+        elapsed = time.time() - start
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] = max(entry[2], elapsed)
+        if result is _timeout:
+            entry[3] += 1
+
+    return result
+
+def execute(directive, params, environ, name=None):
+    u"""
+    Calls ``directive`` with the rendered ``params``. 
+
+    Results of ``pure`` directives are kept during a request, in 
+    ``environ['request']``, and results of directives with a ``ttl`` are kept
+    for ``ttl`` seconds, in ``environ['cache']``, so a directive shared by 
+    many patterns runs once for the same parameters.
+
+    Directives with a ``timeout`` run in ``environ['executor']`` (or in 
+    ``default_executor``); if the result is not ready in ``timeout`` seconds
+    the directive ``on_timeout`` value is returned, and the directive keeps
+    running in the executor, with a copy of the user session that is 
+    discarded. Changes of other objects, like the history of the session or
+    resources, are not undone. Timeouts do not cancel directives: each 
+    timed out call holds an executor thread until it returns, and when all 
+    threads are held, later calls wait in the executor queue and time out 
+    without running in time. The calls holding threads are counted as 
+    ``running`` in the stats. Calls are counted in ``environ['stats']``, by 
+    directive ``name``, as ``[calls, total time, max time, timeouts]``, and 
+    cache hits in ``environ['metrics']`` (see ``metrics.Metrics``).
+    """
+    pure = get_option(directive, 'pure', False)
+    ttl = get_option(directive, 'ttl')
+    key = None
+    if pure or ttl is not None:
+        key = (directive, tuple(params))
+        try:
+            hash(key)
+        except TypeError:
+            key = None
+
+    cache = None
+    if key is not None:
+        metrics = environ.get('metrics')
+        if ttl is not None:
+            cache = environ.get('cache')
+            now = time.time()
+            entry = cache.get(key) if cache is not None else None
+            hit = entry is not None and entry[0] > now
+            if metrics is not None and cache is not None:
+                metrics.cache('ttl', hit)
+            if hit:
+                return entry[1]
+        else:
+            cache = environ.get('request')
+            if metrics is not None and cache is not None:
+                metrics.cache('request', key in cache)
+            if cache is not None and key in cache:
+                return cache[key]
+
+    result = _call(directive, params, environ, name)
+    if result is _timeout:
+        return get_option(directive, 'on_timeout', False)
+
+    if cache is not None:
+        if ttl is not None:
+            if len(cache) >= _cache_size:
+                for k, (expires, value) in cache.items():
+                    if expires <= now:
+                        cache.pop(k, None)
+                if len(cache) >= _cache_size:
+                    cache.clear()
+            cache[key] = (now + ttl, result)
+        else:
+            cache[key] = result
+
+    return result
+
+def load_directives(environ):
+    u"""
+    Returns a dict with the default directives and the directives of 
+    ``_directive_pool``, setted via ``register_directive`` by users, created 
+    for ``environ``.
+    """
+    result = {
+        'define': Define(environ),
+        'delete': Delete(environ),
+        'isdefined': IsDefined(environ),
+        'isnotdefined': IsNotDefined(environ),
+        'equal': Equal(environ),
+        'notequal': NotEqual(environ),
+        'greaterthan': GreaterThan(environ),
+        'lessthan': LessThan(environ),
+        'greaterequal': GreaterEqual(environ),
+        'lessequal': LessEqual(environ),
+        'activate': Activate(environ),
+        'deactivate': Deactivate(environ),
+    }
+
+    for k, (item, options) in _directive_pool.iteritems():
+        if k in result:
+            raise exceptions.DuplicatedDirective(k)
+
+        result[k] = configure(item(environ), **options)
+
+    return result
 
 class Directive(object):
     u"""
     Directive super class. Inherit this class and override run's method for new
     directives.
+
+    Directives without side effects, that only read the user session, can 
+    also define a static method ``test(session, *params)`` with the same 
+    result of ``run`` and a ``cost``. Patterns evaluate these directives in 
+    ``when`` tags as conditions, by order of cost, before matching the 
+    ``after`` and ``in`` tags (see ``pattern.Condition``).
     """
+    cost = None
+
     def __init__(self, environ):
         self.environ = environ
 
@@ -40,6 +300,18 @@ class Directive(object):
     def run(self, *params):
         raise Exception(u'Not Implemented')
 
+    def session(self):
+        u"""
+        Returns the session of the active user.
+        """
+        return self.environ['session'][self.environ['user_id']]
+
+    def resource(self, name):
+        u"""
+        Returns the kernel resource ``name`` (see ``aerolito.resources``).
+        """
+        return self.environ['resources'].get(name)
+
 #==============================================================================
 
 class Define(Directive):
@@ -48,7 +320,7 @@ class Define(Directive):
     variables.
     """
     def run(self, variable, value):
-        session = self.environ['session'][self.environ['userid']]
+        session = self.session()
         session['locals'][variable] = value
 
         return True
@@ -58,7 +330,7 @@ class Delete(Directive):
     Directive ``delete`` removes a ``variable`` of local variables.
     """
     def run(self, variable):
-        session = self.environ['session'][self.environ['userid']]
+        session = self.session()
         del session['locals'][variable]
 
         return True
@@ -67,59 +339,109 @@ class IsDefined(Directive):
     u"""
     Directive ``isdefined`` verifies if ``variable`` IS IN local vars.
     """
-    def run(self, variable):
-        session = self.environ['session'][self.environ['userid']]
+    cost = 0
+
+    @staticmethod
+    def test(session, variable):
         return variable in session['locals']
 
+    def run(self, variable):
+        return self.test(self.session(), variable)
+
 class IsNotDefined(Directive):
     u"""
     Directive ``isnotdefined`` verifies if ``variable IS NOT IN local vars.
     """
-    def run(self, variable):
-        session = self.environ['session'][self.environ['userid']]
+    cost = 0
+
+    @staticmethod
+    def test(session, variable):
         return variable not in session['locals']
 
-class Equal(Directive):
+    def run(self, variable):
+        return self.test(self.session(), variable)
+
+class Comparison(Directive):
     u"""
-    Directive ``equal`` compares two values, return True if both are the same.
+    Super class of the directives comparing two values.
     """
+    cost = 1
+
     def run(self, value1, value2):
+        return self.test(None, value1, value2)
+
+class Equal(Comparison):
+    u"""
+    Directive ``equal`` compares two values, return True if both are the same.
+    """
+    @staticmethod
+    def test(session, value1, value2):
         return value1 == value2
 
-class NotEqual(Directive):
+class NotEqual(Comparison):
     u"""
     Directive ``notequal`` compares two values, return True if both are not
     equals.
     """
-    def run(self, value1, value2):
+    @staticmethod
+    def test(session, value1, value2):
         return value1 != value2
 
-class GreaterThan(Directive):
+class GreaterThan(Comparison):
     u"""
     Directive ``greaterthan`` compares if a value1 is greater than value2.
     """
-    def run(self, value1, value2):
+    @staticmethod
+    def test(session, value1, value2):
         return value1 > value2
 
-class LessThan(Directive):
+class LessThan(Comparison):
     u"""
     Directive ``lessthan`` compares if a value1 is less than value2.
     """
-    def run(self, value1, value2):
+    @staticmethod
+    def test(session, value1, value2):
         return value1 < value2
 
-class GreaterEqual(Directive):
+class GreaterEqual(Comparison):
     u"""
     Directive ``greaterequal`` compares if a value1 is greater or equals to 
     value2.
     """
-    def run(self, value1, value2):
+    @staticmethod
+    def test(session, value1, value2):
         return value1 >= value2
 
-class LessEqual(Directive):
+class LessEqual(Comparison):
     u"""
     Directive ``lessequal`` compares if a value1 is less of equals to value2.
     """
-    def run(self, value1, value2):
+    @staticmethod
+    def test(session, value1, value2):
         return value1 <= value2
 
+class Activate(Directive):
+    u"""
+    Directive ``activate`` activates a ``topic`` in the user session. Patterns
+    of active topics are tested before the patterns of conversations files.
+    """
+    def run(self, topic):
+        if topic not in self.environ['topics']:
+            raise exceptions.TopicNotFound(topic)
+
+        session = self.session()
+        if topic not in session['topics']:
+            session['topics'].append(topic)
+
+        return True
+
+class Deactivate(Directive):
+    u"""
+    Directive ``deactivate`` deactivates a ``topic`` in the user session.
+    """
+    def run(self, topic):
+        session = self.session()
+        if topic in session['topics']:
+            session['topics'].remove(topic)
+
+        return True
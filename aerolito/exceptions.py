@@ -56,4 +56,43 @@ class DuplicatedSynonym(AerolitoException):
 class DuplicatedMeaning(AerolitoException):
     message = u'Duplicated meaning "%s" in "%s.'
 
-class InvalidMeaningKey(AerolitoException): pass
\ No newline at end of file
+class InvalidMeaningKey(AerolitoException): pass
+
+class InvalidBatchLine(AerolitoException):
+    message = u'Invalid batch line "%s".'
+
+class BatchWorkerDied(AerolitoException):
+    message = u'A batch worker process died unexpectedly.'
+
+class BatchWorkerFailed(AerolitoException):
+    message = u'A batch worker process failed:\n%s'
+
+class TopicNotFound(AerolitoException):
+    message = u'Topic "%s" not found.'
+
+class KnowledgeBaseFrozen(AerolitoException):
+    message = u'Knowledge base is frozen and can not be changed.'
+
+class InvalidKnowledgeFile(AerolitoException):
+    message = u'File ("%s") is not a compiled knowledge base of this version.'
+
+class UserNotInSession(AerolitoException):
+    message = u'User "%s" not in session.'
+
+class InvalidSessionData(AerolitoException):
+    message = u'Invalid session data: %s.'
+
+class ResourceNotFound(AerolitoException):
+    message = u'Resource "%s" not found.'
+
+class DuplicatedResource(AerolitoException):
+    message = u'Duplicated resource name "%s".'
+
+class ResourceClosed(AerolitoException):
+    message = u'Resource is closed.'
+
+class PatternNotFound(AerolitoException):
+    message = u'Pattern "%s" not found.'
+
+class TranscriptClosed(AerolitoException):
+    message = u'Transcript "%s" is closed.'
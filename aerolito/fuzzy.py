@@ -0,0 +1,294 @@
+# -*- coding:utf-8 -*-
+# Copyright (c) 2011 Renato de Pontes Pereira, renato.ppontes at gmail dot com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+Typo tolerant matching.
+
+Inputs with typos match no pattern. A kernel created with ``fuzzy`` corrects
+the words of inputs that match no pattern and matches the corrected input
+again. Words are corrected to the closest word of the ``in`` elements of the
+patterns (the vocabulary), within an edit distance that grows with the word 
+length::
+
+    kernel = Kernel('config.yml', fuzzy=True)
+    kernel.respond(u'helo')          # matches "hello"
+
+The correction is also tried when the input only matches a catch-all 
+pattern (``in: '*'``), which is kept if the corrected input matches no other
+pattern before it. The vocabulary is kept in a ``BKTree``, so the words 
+within a distance are found testing a small part of the vocabulary.
+"""
+
+import re
+from aerolito.utils import get_meanings
+from aerolito.normalize import get_normalizer
+
+_word = re.compile(r'\w+', re.U)
+_tokens = re.compile(r'(\w+)', re.U)
+
+MIN_LENGTH = 3
+
+def distance(a, b, limit=None):
+    u"""
+    Returns the Damerau-Levenshtein distance between ``a`` and ``b``: the 
+    number of insertions, deletions, substitutions and transpositions of 
+    adjacent letters. Unlike the restricted variant, it is a metric, as 
+    required by ``BKTree``. If ``limit`` is informed, distances greater than 
+    ``limit`` are returned as ``limit + 1``.
+    """
+    if limit is not None and abs(len(a) - len(b)) > limit:
+        return limit + 1
+
+    infinite = len(a) + len(b)
+    d = [[infinite]*(len(b) + 2)]
+    for i in xrange(len(a) + 1):
+        d.append([infinite, i] + [0]*len(b))
+    for j in xrange(len(b) + 1):
+        d[1][j + 1] = j
+
+    last = {}
+    for i in xrange(1, len(a) + 1):
+        x = a[i - 1]
+        column = 0
+        for j in xrange(1, len(b) + 1):
+            y = b[j - 1]
+            k = last.get(y, 0)
+            l = column
+            if x == y:
+                cost = 0
+                column = j
+            else:
+                cost = 1
+            d[i + 1][j + 1] = min(d[i][j] + cost, d[i + 1][j] + 1, 
+                                  d[i][j + 1] + 1, 
+                                  d[k][l] + (i - k - 1) + 1 + (j - l - 1))
+        last[x] = i
+
+    result = d[len(a) + 1][len(b) + 1]
+    if limit is not None:
+        return min(result, limit + 1)
+    return result
+
+def max_distance(word, limit=2):
+    u"""
+    Returns the maximum edit distance of corrections of ``word``: one edit 
+    by 3 letters, at most ``limit``.
+    """
+    return min(limit, len(word)//MIN_LENGTH)
+
+def pattern_words(pattern):
+    u"""
+    Returns the set of words, in lower case, of the ``in`` elements of a
+    ``pattern``, compiled or lazy.
+    """
+    if pattern._raw is not None:
+        p = pattern._raw
+        environ = pattern._environ
+        values = p.get('in')
+        if values is None:
+            return set()
+        if not isinstance(values, (tuple, list)):
+            values = [values]
+
+        texts = []
+        normalize = get_normalizer(environ)
+        for x in values:
+            x = normalize(unicode(x))
+            texts.extend(get_meanings(x, environ['meanings'], p.get('mean')))
+    else:
+        texts = [regex._expression for regex in pattern._in or ()]
+
+    words = set()
+    for text in texts:
+        words.update(_word.findall(text.lower()))
+    return words
+
+def catch_all(pattern):
+    u"""
+    Returns True if the ``in`` elements of a ``pattern``, compiled or lazy, 
+    are only stars.
+    """
+    if pattern._raw is not None:
+        values = pattern._raw.get('in')
+        if not isinstance(values, (tuple, list)):
+            values = [values]
+        return all(isinstance(x, basestring) and x.strip() == u'*'
+                   for x in values)
+
+    return bool(pattern._in) and \
+           all(regex._expression == '^(.*)$' for regex in pattern._in)
+
+class BKTree(object):
+    u"""
+    Burkhard-Keller tree of words, by ``distance``. Each child of a 
+    node is at a different distance of the node word, so a search for the 
+    words within ``limit`` of a word only visits the children at distance
+    ``d - limit`` to ``d + limit``, where ``d`` is the distance to the node.
+    """
+
+    def __init__(self, words=()):
+        self._root = None
+        self._size = 0
+        for word in words:
+            self.add(word)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, word):
+        u"""
+        Adds a ``word`` to the tree, if not added yet.
+        """
+        if self._root is None:
+            self._root = (word, {})
+            self._size += 1
+            return
+
+        node = self._root
+        while True:
+            d = distance(word, node[0])
+            if d == 0:
+                return
+
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = (word, {})
+                self._size += 1
+                return
+            node = child
+
+    def search(self, word, limit):
+        u"""
+        Returns the list of ``(distance, word)`` of the words within ``limit``
+        of ``word``, sorted.
+        """
+        result = []
+        if self._root is None:
+            return result
+
+        nodes = [self._root]
+        while nodes:
+            text, children = nodes.pop()
+            d = distance(word, text)
+            if d <= limit:
+                result.append((d, text))
+
+            for i in xrange(max(d - limit, 1), d + limit + 1):
+                child = children.get(i)
+                if child is not None:
+                    nodes.append(child)
+
+        result.sort()
+        return result
+
+class Vocabulary(object):
+    u"""
+    The words of a list of patterns, see ``pattern_words``. Patterns can be
+    added, and removed if the vocabulary is ``removable``, updating the 
+    vocabulary by their words only.
+
+    Words are counted by the number of patterns using them. Words of removed
+    patterns are kept in the tree but not returned by ``search``, the tree is
+    rebuilt when they are more than the words in use.
+    """
+
+    def __init__(self, patterns=(), removable=False):
+        self._counts = {}
+        self._patterns = {} if removable else None
+        self._removed = 0
+        words = set()
+        for pattern in patterns:
+            words.update(self.__count(pattern))
+        self._tree = BKTree(sorted(words))
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __contains__(self, word):
+        return word in self._counts
+
+    def __count(self, pattern):
+        words = pattern_words(pattern)
+        if self._patterns is not None:
+            self._patterns[id(pattern)] = words
+        counts = self._counts
+        for word in words:
+            counts[word] = counts.get(word, 0) + 1
+        return words
+
+    def add(self, pattern):
+        u"""
+        Adds the words of ``pattern``.
+        """
+        for word in self.__count(pattern):
+            self._tree.add(word)
+
+    def remove(self, pattern):
+        u"""
+        Removes the words of ``pattern`` not used by other patterns, added to
+        a ``removable`` vocabulary.
+        """
+        counts = self._counts
+        for word in self._patterns.pop(id(pattern), ()):
+            if counts[word] > 1:
+                counts[word] -= 1
+            else:
+                del counts[word]
+                self._removed += 1
+
+        if self._removed > len(counts):
+            self._tree = BKTree(sorted(counts))
+            self._removed = 0
+
+    def search(self, word, limit):
+        u"""
+        Returns the sorted list of ``(distance, word)`` of the words within 
+        ``limit`` of ``word``.
+        """
+        counts = self._counts
+        return [x for x in self._tree.search(word, limit) if x[1] in counts]
+
+def correct(value, vocabularies, limit=2):
+    u"""
+    Replaces the words of ``value`` not found in ``vocabularies`` by the 
+    closest word of them, within ``max_distance``. Returns the corrected 
+    value, or None if no word was corrected.
+    """
+    parts = _tokens.split(value)
+    changed = False
+    for i in xrange(1, len(parts), 2):
+        word = parts[i].lower()
+        if len(word) < MIN_LENGTH or \
+           any(word in vocabulary for vocabulary in vocabularies):
+            continue
+
+        best = None
+        for vocabulary in vocabularies:
+            found = vocabulary.search(word, max_distance(word, limit))
+            if found and (best is None or found[0] < best):
+                best = found[0]
+
+        if best is not None:
+            parts[i] = best[1]
+            changed = True
+
+    if changed:
+        return u''.join(parts)
+    return None
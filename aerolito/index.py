@@ -0,0 +1,218 @@
+# -*- coding:utf-8 -*-
+# Copyright (c) 2011 Renato de Pontes Pereira, renato.ppontes at gmail dot com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+Pattern index, used to select the patterns that can match an input.
+
+Patterns are indexed by the first word of their ``in`` elements. A word
+followed by a space and more text (e.g. "hello there") can only match inputs
+starting with the same word, while a word followed by a star (e.g. "hello \*",
+which also matches "hellothere") can match inputs starting with the word as a
+prefix. Patterns that can not be indexed (without ``in``, starting with star)
+are candidates for every input.
+
+Patterns with ``ignore`` are indexed by their words without the ignored 
+characters, in a group by ignore set: the input is stripped once for each 
+group (see ``utils.strip_ignored``) and its first word is searched in the 
+group tables.
+
+Each pattern have an order key and candidates are returned by order. Keys 
+are spaced by ``PatternIndex.step``, so patterns can be inserted between 
+others. Removals and insertions replace the lists of the pattern words by new
+lists instead of changing them, so threads iterating the candidates of an 
+input are not affected.
+"""
+
+import re
+import heapq
+import bisect
+from aerolito.utils import strip_ignored
+
+_token = re.compile(r'[^\s\*\\]*')
+_space = re.compile(r'\s*')
+
+def first_token(value):
+    u"""
+    Returns the first word of an input ``value``, in lower case.
+    """
+    return _token.match(value).group().lower()
+
+def index_key(text):
+    u"""
+    Returns the index key of a normalized ``in`` element, a tuple
+    ``(word, exact)``, or None if the text can not be indexed.
+    """
+    token = _token.match(text).group()
+    if not token:
+        return None
+
+    end = len(token)
+    if end == len(text):
+        return (token.lower(), True)
+
+    if text[end] == '\\':
+        return None
+
+    # Spaces before a star are not part of the expression
+    end = _space.match(text, end).end()
+    if end == len(text) or text[end] != '*':
+        return (token.lower(), True)
+    else:
+        return (token.lower(), False)
+
+def index_keys(texts):
+    u"""
+    Returns the list of index keys of the normalized ``in`` elements
+    ``texts``, or None if any of them can not be indexed.
+    """
+    if not texts:
+        return None
+
+    keys = set()
+    for text in texts:
+        key = index_key(text)
+        if key is None:
+            return None
+        keys.add(key)
+
+    return sorted(keys)
+
+class PatternIndex(object):
+    u"""
+    Index of patterns by the first word of their ``in`` tag. Candidates are
+    returned by order key, by default the order patterns were added.
+    """
+    step = 1 << 32
+
+    def __init__(self):
+        self._exact = {}
+        self._prefix = {}
+        self._groups = {}
+        self._others = []
+        self._size = 0
+        self._next = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, pattern, order=None):
+        u"""
+        Adds a ``pattern`` with the ``order`` key, by default after all 
+        patterns in the index, and returns the order key. Keys must be 
+        unique.
+        """
+        append = order is None or order >= self._next
+        if order is None:
+            order = self._next
+        if append:
+            self._next = order + self.step
+
+        entry = (order, pattern)
+        self._size += 1
+
+        for table, word in self.__buckets(pattern):
+            if append:
+                if table is None:
+                    self._others.append(entry)
+                else:
+                    table.setdefault(word, []).append(entry)
+            else:
+                entries = self.__get(table, word) or []
+                i = bisect.bisect_left(entries, (order,))
+                self.__set(table, word, entries[:i] + [entry] + entries[i:])
+
+        return order
+
+    def remove(self, pattern, order):
+        u"""
+        Removes a ``pattern`` added with the ``order`` key.
+        """
+        for table, word in self.__buckets(pattern):
+            entries = self.__get(table, word) or ()
+            self.__set(table, word, [e for e in entries if e[0] != order])
+
+        self._size -= 1
+
+    def __buckets(self, pattern):
+        if pattern._keys is None:
+            return [(None, None)]
+
+        if pattern._ignore:
+            tables = self._groups.get(pattern._ignore)
+            if tables is None:
+                # Replaced, not changed, as candidates iterates the groups
+                tables = ({}, {})
+                groups = dict(self._groups)
+                groups[pattern._ignore] = tables
+                self._groups = groups
+            exact, prefix = tables
+        else:
+            exact, prefix = self._exact, self._prefix
+
+        return [(exact if is_exact else prefix, word)
+                for word, is_exact in pattern._keys]
+
+    def __get(self, table, word):
+        if table is None:
+            return self._others
+        return table.get(word)
+
+    def __set(self, table, word, entries):
+        if table is None:
+            self._others = entries
+        elif entries:
+            table[word] = entries
+        else:
+            table.pop(word, None)
+
+    def candidates(self, value, cache=None):
+        u"""
+        Yields the patterns that can match the input ``value``, in order. The
+        ``cache`` is used to strip ``value`` for the groups of patterns with 
+        ``ignore`` (see ``utils.strip_ignored``).
+        """
+        entries = [self._others]
+        self.__search(first_token(value), self._exact, self._prefix, entries)
+        for key, (exact, prefix) in self._groups.iteritems():
+            word = first_token(strip_ignored(value, key, cache))
+            self.__search(word, exact, prefix, entries)
+
+        entries = [e for e in entries if e]
+        if len(entries) == 1:
+            merged = entries[0]
+        else:
+            merged = heapq.merge(*entries)
+
+        last = None
+        for order, pattern in merged:
+            if order != last:
+                last = order
+                yield pattern
+
+    def __search(self, word, exact, prefix, entries):
+        u"""
+        Appends to ``entries`` the lists of patterns of ``word`` in the 
+        ``exact`` and ``prefix`` tables.
+        """
+        if word in exact:
+            entries.append(exact[word])
+        for i in xrange(1, len(word) + 1):
+            if word[:i] in prefix:
+                entries.append(prefix[word[:i]])
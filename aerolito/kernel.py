@@ -20,13 +20,24 @@
 # SOFTWARE.
 
 import re
-import yaml
-import codecs
+import time
+import bisect
+import threading
 from aerolito import exceptions
 from aerolito import directives
-from aerolito.pattern import Pattern
-from aerolito.pattern import remove_accents
-from aerolito.pattern import normalize_input
+from aerolito import fuzzy
+from aerolito.index import PatternIndex
+from aerolito.knowledge import KnowledgeBase
+from aerolito.resources import Resources
+from aerolito.metrics import Metrics
+from aerolito.profiler import Profiler
+from aerolito.normalize import StageStats
+from aerolito.transcript import TranscriptWriter
+from aerolito.pattern import Pattern, replace
+from aerolito.session import Environ, Snapshot, SessionMap, SessionOverlay
+from aerolito.session import make_session, copy_session, compact_response
+from aerolito.session import dump_session, dump_sessions, snapshot_session
+from aerolito.session import load_session, load_sessions
 
 class Kernel(object):
     u"""
@@ -38,12 +49,32 @@ class Kernel(object):
     *stars* for pattern stars ``*``, *locals* for user-related informations, 
     and *globals*.
 
+    The synonyms, meanings and patterns of the configuration file are kept in
+    a ``KnowledgeBase``, which can be shared by many kernels: ::
+
+        knowledge = KnowledgeBase('config.yml')
+        kernel1 = Kernel(knowledge=knowledge, globals={'botname': 'chapolin'})
+        kernel2 = Kernel(knowledge=knowledge, globals={'botname': 'chaves'})
+
     By default kernel sets the first users as "default" key. It session can be 
-    acessed via ``_environ['session']['default']``. A kernel object have 4 
+    acessed via ``_environ['session']['default']``. A kernel object have 10 
     instance variables:
 
+    _knowledge
+        The ``KnowledgeBase`` used by the kernel, kept with the values that 
+        depend on it in the ``session.Snapshot`` of ``_environ['snapshot']``.
+
     _patterns
-        A list of all patterns that kernel is handling.
+        A list of the patterns of conversation files loaded only by this 
+        kernel, via ``load_conversation`` or ``add_pattern``. They are tested
+        before the patterns of the knowledge base conversation files.
+
+    _index
+        The ``PatternIndex`` of ``_patterns``.
+
+    _ids
+        A dict of pattern id to the order key and pattern of ``_patterns``,
+        used by ``remove_pattern``.
     
     _synonyms
         A list of all *synonyms*.
@@ -53,16 +84,113 @@ class Kernel(object):
 
     _environ
         The environment variable.
+
+    _executor
+        The thread pool of directives with ``timeout``, or None to use the 
+        pool shared by all kernels.
+
+    _resources
+        The ``Resources`` of the **resources** tag of the configuration file,
+        used by directives. They are closed by ``close``.
+
+    _metrics
+        The ``metrics.Metrics`` of the kernel responses, or None.
+
+    _profiler
+        The ``profiler.Profiler`` of the sampled responses, or None.
+
+    _normalize_stats
+        The ``normalize.StageStats`` of the normalization of inputs and 
+        responses, or None if the kernel has no metrics nor profiler.
+
+    _fuzzy
+        The maximum edit distance of the words corrected in inputs that match
+        no pattern (see ``aerolito.fuzzy``), 0 if disabled.
+
+    _vocabulary
+        The ``fuzzy.Vocabulary`` of ``_patterns``, built on first use and 
+        updated by ``add_pattern`` and ``remove_pattern``.
+
+    _transcript
+        The ``transcript.TranscriptWriter`` of the responses, or None.
     """
 
-    def __init__(self, config_file, encoding='utf-8'):
-        u"""Initializes a kernel object, creating the user "default". """
+    def __init__(self, config_file=None, encoding='utf-8', lazy=False, 
+                 knowledge=None, globals=None, executor=None, metrics=False,
+                 profile_sample_rate=0, profile_sink=None, fuzzy=False,
+                 transcript=None):
+        u"""
+        Initializes a kernel object, creating the user "default".
+
+        The kernel loads the knowledge base of ``config_file``, or uses a 
+        loaded ``knowledge`` base. Values in ``globals`` override the global
+        variables of the configuration file for this kernel only.
+
+        If ``lazy`` is True, patterns are validated when loaded but only 
+        compiled when first tested against an input (see ``warmup``).
+
+        Directives with a ``timeout`` run in the ``executor``, an object with
+        the ``apply_async`` method of ``multiprocessing.pool.ThreadPool``, or
+        in a thread pool shared by all kernels.
+
+        If ``metrics`` is True, or a ``metrics.Metrics`` object shared by 
+        kernels, the kernel records the metrics of its responses (see 
+        ``metrics_text``).
+
+        A fraction ``profile_sample_rate`` of the responses (e.g. 0.001) runs
+        under a profiler, see ``profile_stacks``. Each profile is also sent 
+        to ``profile_sink``, if informed (see ``profiler.Profiler``).
+
+        If ``fuzzy`` is True, or the maximum edit distance of a corrected 
+        word, inputs that match no pattern (or only a catch-all pattern) are 
+        matched again with their typos corrected (see ``aerolito.fuzzy``).
+
+        Inputs and responses recorded in the sessions are also appended to 
+        ``transcript``, a file name or a ``transcript.TranscriptWriter`` 
+        shared by kernels (see ``aerolito.transcript``). A writer created by
+        the kernel is closed by ``close``.
+        """
+        if metrics is True:
+            metrics = Metrics()
+        self._metrics = metrics or None
+        self._profiler = None
+        if profile_sample_rate > 0:
+            self._profiler = Profiler(profile_sample_rate, profile_sink)
+        self._normalize_stats = None
+        if self._metrics is not None or self._profiler is not None:
+            self._normalize_stats = StageStats()
+        if fuzzy is True:
+            fuzzy = 2
+        self._fuzzy = fuzzy or 0
+        self._vocabulary = None
+        # Created once, shared by the sessions (see session.make_session)
+        self._normalize_response = self.__normalize_response
+        self._transcript = transcript
+        self._own_transcript = False
+        if isinstance(transcript, basestring):
+            self._transcript = TranscriptWriter(transcript)
+            self._transcript.start()
+            self._own_transcript = True
+        self._executor = executor
+        self._globals = None
+        self._resources = None
         self._patterns = None
+        self._orders = None
+        self._index = None
+        self._ids = None
+        self._next_id = 0
+        self._lock = threading.Lock()
         self._synonyms = None
         self._meanings = None
         self._environ = None
+        self._lazy = lazy
 
-        self.load_config(config_file, encoding=encoding)
+        if knowledge is not None:
+            self.use_knowledge(knowledge, globals)
+        elif config_file is not None:
+            self.load_config(config_file, encoding=encoding, globals=globals)
+        else:
+            raise exceptions.InitializationRequired('configuration')
 
         self.add_user('default')
         self.set_user('default')
@@ -72,34 +200,44 @@ class Kernel(object):
         Add a new user in session of environ variable, initializing the 
         following user-dependet variables:
 
+        - **history**: The ``session.History`` of the user, keeping the 
+          responses as references to the pattern literals.
         - **inputs**: List with all inputs of an user.
-        - **responses**: List with all outputs for an user, without 
-          normalizing.
-        - **responses-normalized**: List with all outputs normalized.
+        - **responses**: Read-only list with all outputs for an user, without
+          normalizing, rebuilt from the history when read.
+        - **responses-normalized**: Read-only list with all outputs 
+          normalized.
         - **stars**: Pattern-related variables, is a list of stars that matches 
           with recognized pattern (i.e., words in the place of "\*"). Is filled 
           by ``after`` and ``in`` tags.
         - **locals**: Dictionary of local variables, setted via patterns in 
           ``when`` or ``post`` tags.
+        - **topics**: List of active topics, setted via ``activate`` and 
+          ``deactivate`` directives.
 
         If ``user_id`` is already in session, an exception 
-        ``UserAlreadyInSession`` is rised.
+        ``UserAlreadyInSession`` is rised. ``respond`` creates the session of 
+        new users, so calling this method is optional.
         """
-        if user_id in self._environ['session']:
+        session = self.__new_session()
+        if self._environ['session'].setdefault(user_id, session) is not session:
             raise exceptions.UserAlreadyInSession(user_id)
 
-        self._environ['session'][user_id] = {}
-        session = self._environ['session'][user_id]
-        session['inputs'] = []
-        session['responses'] = []
-        session['responses-normalized'] = []
-        session['stars'] = []
-        session['locals'] = {}
+    def __new_session(self):
+        return make_session(self._normalize_response)
+
+    def __normalize_response(self, response):
+        u"""
+        Normalizes a ``response`` of the session history with the current
+        knowledge base.
+        """
+        return self._environ['normalize'](response)
     
     def set_user(self, user_id):
         u"""
-        Defines who is the active user in session. Functions and objects uses
-        ``_environ['user_id']`` variable to select the correct session.
+        Defines who is the active user in session, for the current thread. 
+        Functions and objects uses ``_environ['user_id']`` variable to select
+        the correct session.
         """
         self._environ['user_id'] = user_id
 
@@ -107,177 +245,449 @@ class Kernel(object):
         u"""
         Removes an user from session.
         """
-        if user_id in self._environ['session']:
+        try:
             del self._environ['session'][user_id]
+        except KeyError:
+            pass
+
+    def export_session(self, user_id):
+        u"""
+        Returns a binary snapshot of the session of ``user_id``, to be loaded
+        by ``import_session`` in other kernel (see ``aerolito.session``). Only
+        the last entry of the history lists is kept. The session is copied 
+        with the lock of the user, so it is not changed by ``respond`` while
+        written.
+        """
+        return dump_session(user_id, self.__snapshot(user_id))
+
+    def export_sessions(self, user_ids=None):
+        u"""
+        Returns a binary snapshot of the sessions of ``user_ids``, or of all
+        users if ``user_ids`` is None. Each session is copied with the lock 
+        of its user, as in ``export_session``.
+        """
+        if user_ids is None:
+            user_ids = self._environ['session'].keys()
 
-    def add_directive(self, name, directive):
+        return dump_sessions([(u, self.__snapshot(u)) for u in user_ids])
+
+    def __snapshot(self, user_id):
+        u"""
+        Returns a copy of the session of ``user_id`` taken with the user lock
+        (see ``session.snapshot_session``). Raises ``UserNotInSession`` if 
+        the user has no session.
+        """
+        sessions = self._environ['session']
+        if user_id not in sessions:
+            raise exceptions.UserNotInSession(user_id)
+
+        with sessions.lock(user_id):
+            session = sessions.get(user_id)
+            if session is None:
+                raise exceptions.UserNotInSession(user_id)
+            return snapshot_session(session)
+
+    def import_session(self, data):
         u"""
-        Add a new directive in environment var.
+        Loads a snapshot written by ``export_session``, replacing the session
+        of the user if it exists, and returns the user id.
+        """
+        return self.__import([load_session(data)])[0]
+
+    def import_sessions(self, data):
+        u"""
+        Loads a snapshot written by ``export_sessions``, returning the list of
+        user ids.
+        """
+        return self.__import(load_sessions(data))
+
+    def __import(self, sessions):
+        for user_id, user_session in sessions:
+            for topic in user_session['topics']:
+                if topic not in self._environ['topics']:
+                    raise exceptions.TopicNotFound(topic)
+
+        for user_id, user_session in sessions:
+            session = self.__new_session()
+            for key in ('topics', 'locals', 'stars'):
+                session[key] = user_session[key]
+            session['inputs'].extend(user_session['inputs'])
+            for response, normalized in zip(
+                                    user_session['responses'],
+                                    user_session['responses-normalized']):
+                session['history'].add(response, normalized)
+            self._environ['session'][user_id] = session
+
+        return [user_id for user_id, user_session in sessions]
+
+    def add_directive(self, name, directive, **options):
+        u"""
+        Add a new directive in environment var. The ``options`` override the
+        attributes of the directive (see ``directives.configure``).
         """
         if self._environ['directives'].has_key(name):
-            raise DuplicatedDirective(name)
+            raise exceptions.DuplicatedDirective(name)
         
-        self._environ['directives'][name] = directive(self._environ)
+        self._environ['directives'][name] = directives.configure(
+                                    directive(self._environ), **options)
+
+    def add_resource(self, name, factory):
+        u"""
+        Adds a resource for the directives of this kernel, created on first 
+        use by calling ``factory`` (see ``resources.Resources``).
+        """
+        self._resources.add(name, factory)
 
-    def __load_directives(self):
+    def close(self):
         u"""
-        Loads default directives and directives of 
-        ``directives._directive_pool``, setted via 
-        ``directives.register_directive`` by users.
+        Closes the resources of the kernel and the transcript it created,
+        writing the queued entries. Can be used with ``with``::
+
+            with Kernel('config.yml') as kernel:
+                kernel.respond(u'Hello')
         """
-        env_directives = self._environ['directives']
-        env_directives['define'] = directives.Define(self._environ)
-        env_directives['delete'] = directives.Delete(self._environ)
-        env_directives['isdefined'] = directives.IsDefined(self._environ)
-        env_directives['isnotdefined'] = directives.IsNotDefined(self._environ)
-        env_directives['equal'] = directives.Equal(self._environ)
-        env_directives['notequal'] = directives.NotEqual(self._environ)
-        env_directives['greaterthan'] = directives.GreaterThan(self._environ)
-        env_directives['lessthan'] = directives.LessThan(self._environ)
-        env_directives['greaterequal'] = directives.GreaterEqual(self._environ)
-        env_directives['lessequal'] = directives.LessEqual(self._environ)
+        if self._resources is not None:
+            self._resources.close()
+        if self._own_transcript:
+            self._transcript.close()
+
+    def __enter__(self):
+        return self
 
-        for k, item in directives._directive_pool.iteritems():
-            self.add_directive(k, item)
+    def __exit__(self, *exc_info):
+        self.close()
 
-    def load_config(self, config_file, encoding='utf-8'):
+    def metrics_text(self):
         u"""
-        Loads the configuration file.
+        Returns the kernel metrics in the Prometheus text format (see 
+        ``metrics.render``).
+        """
+        from aerolito import metrics
+        return metrics.render(self)
 
-        Receive as parameters a name (with relative or full path) of 
-        configuration file, and its encoding. Default encoding is utf-8.
+    def profile_stacks(self):
+        u"""
+        Returns the stacks of the profiled responses in the collapsed format
+        of flame graph tools, or None if the kernel has no profiler.
+        """
+        if self._profiler is None:
+            return None
+        return self._profiler.collapsed()
+
+    def profile_stats(self, n=10):
+        u"""
+        Returns the ``n`` patterns and the ``n`` directives with the largest 
+        time in the profiled responses, as a dict with the lists 
+        ``patterns`` and ``directives`` of ``(label, calls, seconds)``.
+        """
+        profiler = self._profiler
+        if profiler is None:
+            return {'patterns': [], 'directives': []}
+        return {'patterns': profiler.top(profiler.patterns, n),
+                'directives': profiler.top(profiler.directives, n)}
 
-        The configuration file have a mandatory tag **conversations**, that 
-        specify the conversation files. Is a list with the names (with relative 
-        or full path) of the files.
+    def normalize_stats(self):
+        u"""
+        Returns the time spent normalizing the inputs and responses of this
+        kernel by each stage of the knowledge base pipeline, a dict of stage 
+        name to a dict with the number of ``calls`` and the ``total`` time in
+        seconds (see ``normalize.StageStats``). Stages are only timed if the 
+        kernel has metrics or profiling, otherwise the dict is empty.
+        """
+        if self._normalize_stats is None:
+            return {}
+        return self._normalize_stats.stats()
+
+    def directive_stats(self):
+        u"""
+        Returns the latency of the directives run by this kernel, a dict of
+        directive name to a dict with the number of ``calls``, the ``total``
+        and ``max`` time in seconds, the number of ``timeouts`` and the 
+        number of timed out calls still ``running``. Directives that do not 
+        return hold executor threads: when ``running`` reaches the number of
+        threads of the executor, the other directives with a ``timeout`` 
+        time out without running (see ``directives.execute``).
+        """
+        result = {}
+        for name, (calls, total, longest, timeouts, running) in \
+                                        self._environ['stats'].items():
+            result[name] = {'calls': calls, 'total': total, 'max': longest,
+                            'timeouts': timeouts, 'running': running}
+        return result
+
+    def load_config(self, config_file, encoding='utf-8', globals=None):
+        u"""
+        Loads the configuration file in a new ``KnowledgeBase`` (see 
+        ``KnowledgeBase.load_config``) used by this kernel.
 
         Each kernel can load only one of configuration files, if this method is
         called two times, the second call will override the previous 
         informations (by environ variable).
         """
-        try:
-            plain_text = codecs.open(config_file, 'rb', encoding).read()
-            config = yaml.load(plain_text)
-        except IOError:
-            raise exceptions.FileNotFound(config_file)
+        knowledge = KnowledgeBase(config_file, encoding=encoding, 
+                                  lazy=self._lazy)
+        self.use_knowledge(knowledge, globals)
+
+    def use_knowledge(self, knowledge, globals=None):
+        u"""
+        Uses a loaded ``knowledge`` base, initializing the environment 
+        variable. Values in ``globals`` override the global variables of the
+        configuration file.
+        """
+        config = dict(knowledge._config)
+        if globals:
+            config.update(globals)
+
+        if self._resources is not None:
+            self._resources.close()
+        self._globals = globals
+        self._resources = Resources(config.get('resources'))
+        self._synonyms = knowledge._synonyms
+        self._meanings = knowledge._meanings
+        self._patterns = []
+        self._orders = []
+        self._index = PatternIndex()
+        self._ids = {}
+        self._vocabulary = None
 
         # Initialize environment dict
-        self._environ = {
+        self._environ = Environ({
             'user_id': None,
-            'meanings': None,
-            'synonyms': None,
+            'snapshot': Snapshot(knowledge, config),
             'directives': {},
-            'globals': config,
-            'session': {},
-        }
-
-        self.__load_directives()
+            'session': SessionMap(),
+            'request': None,
+            'cache': {},
+            'executor': self._executor,
+            'stats': {},
+            'resources': self._resources,
+            'metrics': self._metrics,
+        })
+        self._environ['directives'] = directives.load_directives(self._environ)
+
+    def swap_knowledge(self, knowledge):
+        u"""
+        Replaces the knowledge base of the kernel by ``knowledge``, keeping 
+        the sessions, the kernel patterns, directives and resources. Returns 
+        the previous knowledge base.
+
+        The knowledge base, the global variables, meanings, synonyms, 
+        normalizer and topics are published at once, by a single assignment 
+        of a ``session.Snapshot``: requests being responded by other threads 
+        finish with the previous snapshot, read when they started, which is 
+        released when the last of them returns.
+        """
+        config = dict(knowledge._config)
+        if self._globals:
+            config.update(self._globals)
+        snapshot = Snapshot(knowledge, config)
 
-        if 'conversations' not in config:
-            raise exceptions.MissingTag('conversations', 'config')
+        with self._lock:
+            previous = self._knowledge
+            self._environ.publish('snapshot', snapshot)
+            self._synonyms = knowledge._synonyms
+            self._meanings = knowledge._meanings
 
-        self._synonyms = {}
-        self._meanings = {}
-        self._patterns = []
-        
-        self._environ['synonyms'] = self._synonyms
-        self._environ['meanings'] = self._meanings
+        return previous
 
-        for synonym_file in config.get('synonyms', []):
-            self.load_sysnonym(synonym_file, encoding)
+    def reload(self, background=False):
+        u"""
+        Loads the knowledge base again from its files (see 
+        ``KnowledgeBase.reload``) and swaps it (see ``swap_knowledge``). If 
+        the files are invalid, an exception is raised and the kernel keeps the
+        current knowledge base.
 
-        for meaning_file in config.get('meanings', []):
-            self.load_meaning(meaning_file, encoding)
+        If ``background`` is True, the knowledge base is loaded by a daemon 
+        thread, which is returned.
+        """
+        if background:
+            thread = threading.Thread(target=self.reload)
+            thread.daemon = True
+            thread.start()
+            return thread
 
-        for conversation_file in config['conversations']:
-            self.load_conversation(conversation_file, encoding)
+        self.swap_knowledge(self._knowledge.reload())
 
+    def watch(self, interval=1.0):
+        u"""
+        Starts a ``watcher.Watcher`` thread, that reloads the knowledge base 
+        when its files change, and returns it.
+        """
+        from aerolito.watcher import Watcher
+        watcher = Watcher(self, interval)
+        watcher.start()
+        return watcher
 
-    def load_sysnonym(self, synonym_file, encoding='utf-8'):
+    def load_conversation(self, conversation_file, encoding='utf-8'):
         u"""
-        Load a synonym file.
+        Load a conversation file for this kernel only (see 
+        ``KnowledgeBase.load_conversation``).
 
-        Receive as parameters a name (with relative or full path) of a
-        synonym file, and their encoding. Default encoding is utf-8.
+        The patterns are loaded in ``_patterns``, returns the list of their
+        ids (see ``remove_pattern``).
+        """
+        if self._knowledge._frozen:
+            raise exceptions.KnowledgeBaseFrozen()
+
+        patterns = self._knowledge.read_conversation(conversation_file, 
+                                                     encoding, self._environ)
+        with self._lock:
+            return [self.__insert(pattern, None) for pattern in patterns]
 
-        Synonym file must have at least one element. Contains a list of lists.
+    def add_pattern(self, p, position=None):
+        u"""
+        Adds a pattern, a dict with the tags of a conversation file pattern, 
+        for this kernel only and returns its id. 
         
-        The patterns are loaded in ``_synonyms``
+        The pattern is tested after the kernel patterns, or before the pattern
+        at ``position`` in ``_patterns``. Can be called while other threads 
+        are responding, the indexes are updated without being rebuilt: the 
+        ``PatternIndex`` and the vocabulary by the words of the pattern, and 
+        ``_patterns`` in place, shifting the patterns after ``position``, 
+        which is linear in the number of kernel patterns.
         """
-        try:
-            plain_text = codecs.open(synonym_file, 'rb', encoding).read()
-            data = yaml.load(plain_text)
-        except IOError:
-            raise exceptions.FileNotFound(synonym_file)
-            
-        for synonyms in data:
-            if len(synonyms) < 2:
-                raise exceptions.InvalidTagValue(
-                        u'Synonym list must have more than one element.')
-
-            key = remove_accents(synonyms[0]).lower()
-            vals = [remove_accents(value).lower() for value in synonyms[1:]]
+        if self._knowledge._frozen:
+            raise exceptions.KnowledgeBaseFrozen()
 
-            if key in self._synonyms:
-                raise exceptions.DuplicatedSynonym(key, synonym_file)
-            
-            self._synonyms[key] = vals
+        pattern = Pattern(p, self._environ, lazy=self._knowledge._lazy)
+        with self._lock:
+            return self.__insert(pattern, position)
 
-    def load_meaning(self, meaning_file, encoding='utf-8'):
+    def remove_pattern(self, pattern_id):
         u"""
-        Load a meaning file.
+        Removes a pattern added by ``add_pattern`` or ``load_conversation``.
+        Raises ``PatternNotFound`` if there is no pattern with ``pattern_id``.
+        The indexes are updated as in ``add_pattern``.
+        """
+        with self._lock:
+            if pattern_id not in self._ids:
+                raise exceptions.PatternNotFound(pattern_id)
 
-        Receive as parameters a name (with relative or full path) of a
-        meaning file, and their encoding. Default encoding is utf-8.
+            order, pattern = self._ids.pop(pattern_id)
+            self._index.remove(pattern, order)
 
-        Meaning file must have at least one element. Contains a list of lists.
+            i = bisect.bisect_left(self._orders, order)
+            del self._patterns[i]
+            del self._orders[i]
+            if self._vocabulary is not None:
+                self._vocabulary.remove(pattern)
 
-        The patterns are loaded in ``_meanings``
+    def __insert(self, pattern, position):
+        u"""
+        Inserts ``pattern`` in ``_patterns`` and ``_index``. Must be called 
+        with ``_lock``.
         """
-        try:
-            plain_text = codecs.open(meaning_file, 'rb', encoding).read()
-            data = yaml.load(plain_text)
-        except IOError:
-            raise exceptions.FileNotFound(meaning_file)
-            
-        for meanings, values in data.items():
-            if len(values) == 0:
-                raise exceptions.InvalidTagValue(
-                        u'Meaning list must have one or more element.')
+        size = len(self._patterns)
+        if position is not None and position < 0:
+            position = max(size + position, 0)
+
+        if position is None or position >= size:
+            order = self._index.add(pattern)
+            self._patterns.append(pattern)
+            self._orders.append(order)
+        else:
+            if position == 0:
+                before = self._orders[0] - 2*PatternIndex.step
+            else:
+                before = self._orders[position - 1]
 
-            key = remove_accents(meanings).lower()
-            vals = [normalize_input(v, self._environ['synonyms']).lower() for v in values]
+            if self._orders[position] - before < 2:
+                self.__reindex()
+                return self.__insert(pattern, position)
 
-            if key in self._meanings:
-                raise exceptions.DuplicatedMeaning(key, meaning_file)
-            
-            self._meanings[key] = vals
+            order = (before + self._orders[position])//2
+            self._index.add(pattern, order)
+            self._patterns.insert(position, pattern)
+            self._orders.insert(position, order)
 
-    def load_conversation(self, conversation_file, encoding='utf-8'):
+        if self._vocabulary is not None:
+            self._vocabulary.add(pattern)
+        pattern_id = self._next_id
+        self._next_id += 1
+        self._ids[pattern_id] = (order, pattern)
+        return pattern_id
+
+    def __reindex(self):
         u"""
-        Load a conversation file.
+        Rebuilds ``_index`` with evenly spaced order keys, when there is no key
+        left between two patterns.
+        """
+        index = PatternIndex()
+        orders = dict((id(pattern), index.add(pattern)) 
+                      for pattern in self._patterns)
+        for pattern_id, (order, pattern) in self._ids.items():
+            self._ids[pattern_id] = (orders[id(pattern)], pattern)
 
-        Receive as parameters a name (with relative or full path) of a
-        conversation file, and their encoding. Default encoding is utf-8.
+        self._orders = [orders[id(pattern)] for pattern in self._patterns]
+        self._index = index
 
-        The conversations file have a obrigatory tag **patterns**, that specify 
-        the conversation patterns. Is a list of dictonaries.
+    def warmup(self, background=False):
+        u"""
+        Compiles all patterns not compiled yet, used with ``lazy`` kernels.
 
-        The patterns are loaded in ``_patterns``
+        If ``background`` is True, patterns are compiled by a daemon thread, 
+        which is returned.
         """
-        try:
-            plain_text = codecs.open(conversation_file, 'rb', encoding).read()
-            data = yaml.load(plain_text)
-        except IOError:
-            raise exceptions.FileNotFound(conversation_file)
+        if background:
+            thread = threading.Thread(target=self.warmup)
+            thread.daemon = True
+            thread.start()
+            return thread
 
-        if 'patterns' not in data:
-            raise exceptions.MissingTag('patterns', conversation_file)
+        self._knowledge.warmup()
+        for pattern in list(self._patterns):
+            pattern.compile()
 
-        for p in data['patterns']:
-            pattern = Pattern(p, self._environ)
-            self._patterns.append(pattern)
+    def freeze(self):
+        u"""
+        Prepares the kernel to be built once and shared by forked worker
+        processes. Compiles the kernel patterns and freezes the knowledge base
+        (see ``KnowledgeBase.freeze``); after this, ``load_conversation`` 
+        raises ``KnowledgeBaseFrozen``. Only sessions change while responding.
+        """
+        for pattern in list(self._patterns):
+            pattern.compile(regexes=True)
 
+        self._knowledge.freeze()
+
+    def __candidates(self, value, session, knowledge):
+        u"""
+        Yields the patterns that can match ``value``: the patterns of the 
+        user's active topics, in activation order, the patterns of the kernel
+        and the patterns of the ``knowledge`` base conversation files. Topics
+        not in the knowledge base (e.g., removed by ``reload``) are ignored.
+        """
+        cache = self._environ['request']
+        for name in list(session['topics']):
+            if name in knowledge._topics:
+                topic = knowledge.load_topic(name)
+                for pattern in topic['index'].candidates(value, cache):
+                    yield pattern
+
+        for pattern in self._index.candidates(value, cache):
+            yield pattern
+
+        for pattern in knowledge._index.candidates(value, cache):
+            yield pattern
+
+    def __vocabularies(self, session, knowledge):
+        u"""
+        Returns the ``fuzzy.Vocabulary``s of the patterns tested for the user
+        ``session`` (see ``__candidates``).
+        """
+        result = [knowledge.vocabulary(name) for name in list(session['topics'])
+                  if name in knowledge._topics]
+
+        vocabulary = self._vocabulary
+        if vocabulary is None:
+            with self._lock:
+                if self._vocabulary is None:
+                    self._vocabulary = fuzzy.Vocabulary(self._patterns, 
+                                                         True)
+                vocabulary = self._vocabulary
+        result.append(vocabulary)
+        result.append(knowledge.vocabulary())
+        return result
 
     def respond(self, value, user_id=None, registry=True):
         u"""
@@ -289,35 +699,219 @@ class Kernel(object):
         if parameter is null, kernel keeps the active user. If user is not 
         informed and no user is active, kernel try to use the *'default'* user,
         if default is not avaliable (out of session pool) an exception is 
-        raised.
+        raised. Sessions of new users are created on first contact.
+
+        Threads can respond different users at the same time: the active user
+        is kept per thread and requests of an user are handled one at a time
+        (see ``session.SessionMap``).
         
         This method just can be used after environment initialization.
+
+        Results of ``pure`` directives are kept in ``_environ['request']`` 
+        until the response, including recursive responses, is returned. The
+        whole response uses the knowledge base of the kernel when it started,
+        even if other thread calls ``reload``.
         """
+        return self.respond_match(value, user_id, registry)[0]
 
-        # Verify initialization
+    def respond_match(self, value, user_id=None, registry=True):
+        u"""
+        Responds as ``respond``, returning the response and the pattern 
+        matched by the input, or None if no pattern matched.
+        """
         if not self._environ :
             raise exceptions.InitializationRequired('configuration')
-        elif not self._patterns:
-            raise exceptions.InitializationRequired('conversation')
 
         # Verify user's session
         if user_id is not None:
             self.set_user(user_id)
-        elif self._environ['user_id'] is None:
-            if 'default' in self._environ['session']:
-                self.set_user('default')
-            else:
-                raise exceptions.NoUserActiveInSession()
+        else:
+            user_id = self._environ['user_id']
+            if user_id is None:
+                if 'default' not in self._environ['session']:
+                    raise exceptions.NoUserActiveInSession()
+                user_id = 'default'
+                self.set_user(user_id)
+
+        sessions = self._environ['session']
+        session = sessions.get(user_id)
+        if session is None:
+            session = sessions.setdefault(user_id, self.__new_session())
+
+        snapshot = self._environ['snapshot']
+        knowledge = snapshot.knowledge
+        with sessions.lock(user_id):
+            if self._environ['request'] is not None:
+                return self.__respond(value, session, registry, knowledge, 
+                                      None, 0)
+
+            metrics = self._metrics
+            trace = None
+            if metrics is not None:
+                trace = metrics.trace()
+                start = time.time()
+
+            self._environ['request'] = {}
+            self._environ['snapshot'] = snapshot
+            try:
+                profiler = self._profiler
+                if profiler is not None and profiler.sample():
+                    result = profiler.run(self.__respond, value, session, 
+                                          registry, knowledge, trace, 0)
+                else:
+                    result = self.__respond(value, session, registry, 
+                                            knowledge, trace, 0)
+            finally:
+                self._environ['request'] = None
+                self._environ.reset('snapshot')
+
+            if trace is not None:
+                metrics.observe(trace, time.time() - start)
+            if registry and self._transcript is not None:
+                self._transcript.write(user_id, value, result[0])
+            return result
+
+    @property
+    def _knowledge(self):
+        u"""
+        The knowledge base of the snapshot read by the current request, or of
+        the last published snapshot.
+        """
+        if self._environ is None:
+            return None
+        return self._environ['snapshot'].knowledge
+
+    def match_all(self, value, user_id=None, limit=None):
+        u"""
+        Returns the patterns that match the input ``value`` for a user, in 
+        the order ``respond`` tests them, as a list of ``(pattern, stars)``.
+        At most ``limit`` patterns are returned, if informed.
+
+        The candidates are read once from the indexes and the user session is
+        not changed: patterns are tested with a copy of the session, made 
+        again after each pattern with **when** actions, so actions changing 
+        the session do not affect the next patterns. The copy is only seen 
+        by the calling thread, through a ``session.SessionOverlay`` set as 
+        its ``_environ['session']``. Effects out of the session, e.g. on 
+        resources, are not undone. Users not in session are not added.
+        """
+        if not self._environ :
+            raise exceptions.InitializationRequired('configuration')
+
+        if user_id is None:
+            user_id = self._environ['user_id']
+            if user_id is None:
+                user_id = 'default'
+
+        sessions = self._environ['session']
+        session = sessions.get(user_id)
+        if session is None:
+            return self.__match_all(value, user_id, self.__new_session(), 
+                                    limit)
+
+        with sessions.lock(user_id):
+            return self.__match_all(value, user_id, session, limit)
+
+    def __match_all(self, value, user_id, session, limit):
+        environ = self._environ
+        snapshot = environ['snapshot']
+        knowledge = snapshot.knowledge
+        value = knowledge._normalize(value)
+        overlay = SessionOverlay(environ['session'], user_id, 
+                                 copy_session(session))
+
+        result = []
+        previous = [(key, environ[key]) 
+                    for key in ('user_id', 'request', 'session')]
+        environ['user_id'] = user_id
+        environ['session'] = overlay
+        pinned = environ['request'] is None
+        if pinned:
+            environ['request'] = {}
+            environ['snapshot'] = snapshot
+        changed = False
+        try:
+            for pattern in self.__candidates(value, overlay.session, 
+                                             knowledge):
+                if limit is not None and len(result) >= limit:
+                    break
+
+                if pattern._raw is not None:
+                    pattern.compile()
+                if changed:
+                    overlay.session = copy_session(session)
+                changed = bool(pattern._when)
+
+                if pattern.match(value, environ):
+                    result.append((pattern, overlay.session['stars']))
+        finally:
+            for key, item in previous:
+                environ[key] = item
+            if pinned:
+                environ.reset('snapshot')
+
+        return result
+
+    def __respond(self, value, session, registry, knowledge, trace, depth):
+        u"""
+        Responds ``value`` for the user ``session``, returning the output and
+        the pattern matched by the input, or None. If ``trace`` is not None, 
+        the time of each phase and the number of tested patterns are added to
+        it (see ``metrics.Metrics.trace``).
+        """
+        # Verify initialization
+        if not knowledge._patterns and not self._patterns:
+            raise exceptions.InitializationRequired('conversation')
+
+        if trace is not None:
+            start = time.time()
+            trace['depth'] = max(trace['depth'], depth)
 
         output = None
-        value = normalize_input(value, self._synonyms)
-        for pattern in self._patterns:
+        value = knowledge._normalize(value, self._normalize_stats)
+
+        if trace is not None:
+            now = time.time()
+            trace['normalize'] += now - start
+            start = now
+
+        matched = None
+        tested = 0
+        for pattern in self.__candidates(value, session, knowledge):
+            tested += 1
             if pattern.match(value, self._environ):
-                output = pattern.choice_output(self._environ)
-                pattern.execute_post(self._environ)
+                matched = pattern
                 break
+
+        if self._fuzzy and (matched is None or fuzzy.catch_all(matched)):
+            stars = session['stars']
+            corrected = fuzzy.correct(value, 
+                                      self.__vocabularies(session, knowledge),
+                                      self._fuzzy)
+            if corrected is not None:
+                for pattern in self.__candidates(corrected, session, 
+                                                 knowledge):
+                    if matched is not None and fuzzy.catch_all(pattern):
+                        break
+                    tested += 1
+                    if pattern.match(corrected, self._environ):
+                        matched = pattern
+                        stars = session['stars']
+                        break
+                session['stars'] = stars
+
+        if trace is not None:
+            now = time.time()
+            trace['match'] += now - start
+            trace['tested'] += tested
+            start = now
+
+        literal = None
+        if matched is not None:
+            literal = matched.choice_literal()
+            output = replace(literal, self._environ)
+            matched.execute_post(self._environ)
             
-        session = self._environ['session'][self._environ['user_id']]
         if registry:
             session['inputs'].append(value)
         
@@ -325,11 +919,20 @@ class Kernel(object):
             recursive = re.findall('\(rec\|([^\)]*)\)', output)
             for r in recursive:
                 toreplace = u'(rec|%s)'%r
-                resp = self.respond(r, registry=False) or ''
+                if trace is not None:
+                    trace['render'] += time.time() - start
+                resp = self.__respond(r, session, False, knowledge, trace, 
+                                      depth + 1)[0] or ''
+                if trace is not None:
+                    start = time.time()
                 output = output.replace(toreplace, resp)
 
             if registry:
-                session['responses'].append(output)
-                session['responses-normalized'].append(normalize_input(output, self._synonyms))
+                stats = self._normalize_stats
+                session['history'].add(compact_response(literal, output), 
+                                       knowledge._normalize(output, stats))
+
+        if trace is not None:
+            trace['render'] += time.time() - start
 
-        return output
+        return output, matched
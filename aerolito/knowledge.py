@@ -0,0 +1,463 @@
+# -*- coding:utf-8 -*-
+# Copyright (c) 2011 Renato de Pontes Pereira, renato.ppontes at gmail dot com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import gc
+import os
+import yaml
+import codecs
+import threading
+from aerolito import exceptions
+from aerolito import directives
+from aerolito import analyzer
+from aerolito.index import PatternIndex
+from aerolito.fuzzy import Vocabulary
+from aerolito.normalize import Pipeline
+from aerolito.pattern import Pattern
+from aerolito.utils import remove_accents
+
+# Uses the libyaml parser when available, it is much faster
+Loader = getattr(yaml, 'CLoader', yaml.Loader)
+
+def load_yaml(filename, encoding='utf-8'):
+    u"""
+    Reads a YAML file. Raises ``FileNotFound`` if the file can not be read.
+    """
+    try:
+        plain_text = codecs.open(filename, 'rb', encoding).read()
+        return yaml.load(plain_text, Loader=Loader)
+    except IOError:
+        raise exceptions.FileNotFound(filename)
+
+# Largest collector threshold, a C int
+_max_threshold = 2**31 - 1
+
+def protect_shared_pages():
+    u"""
+    Keeps the memory pages of frozen knowledge bases shared by a process 
+    forked after ``KnowledgeBase.freeze``. 
+
+    Python 2 has no ``gc.freeze``, and a full collection writes to the 
+    header of every object of the oldest generation, copying the pages 
+    shared with the parent. The children only collect the young 
+    generations, which still release the cycles created by requests; 
+    cycles that survive to the oldest generation are not released.
+    """
+    threshold0, threshold1, threshold2 = gc.get_threshold()
+    gc.set_threshold(threshold0, threshold1, _max_threshold)
+
+class KnowledgeBase(object):
+    u"""
+    The compiled knowledge of a configuration file: synonyms, meanings,
+    conversation patterns and topics.
+
+    A knowledge base is not changed by ``Kernel.respond`` and holds no user
+    information, so a single knowledge base can be shared by many kernels in
+    a process. A knowledge base object have the instance variables:
+
+    _config
+        The configuration file content, used as kernel globals.
+
+    _patterns
+        A list of all patterns of the conversation files.
+
+    _index
+        The ``PatternIndex`` used to select the patterns tested for an input.
+
+    _topics
+        A dict of topics by name. Each topic have a list of conversation files,
+        loaded in the first activation of the topic.
+
+    _synonyms
+        A list of all *synonyms*.
+
+    _meanings
+        A list of all *meanings*.
+
+    _normalize
+        The ``normalize.Pipeline`` of the **normalize** tag, used for the 
+        patterns, meanings and user inputs.
+
+    _environ
+        The environment variable used to compile patterns. It have no
+        session, directives are only used to validate the patterns.
+
+    _frozen
+        True after ``freeze``, when the knowledge base can not be changed.
+
+    _config_file
+        The configuration file name, used by ``reload``.
+
+    _vocabularies
+        A dict of ``fuzzy.Vocabulary`` by topic name, "" for the conversation
+        files, built on first use by ``vocabulary``, or by ``freeze``.
+    """
+
+    def __init__(self, config_file, encoding='utf-8', lazy=False):
+        u"""
+        Loads the knowledge base of ``config_file``.
+
+        If ``lazy`` is True, patterns are validated when loaded but only
+        compiled when first tested against an input (see ``warmup``).
+        """
+        self._config = None
+        self._patterns = None
+        self._index = None
+        self._topics = None
+        self._topics_lock = threading.Lock()
+        self._synonyms = None
+        self._meanings = None
+        self._normalize = None
+        self._environ = None
+        self._encoding = encoding
+        self._lazy = lazy
+        self._frozen = False
+        self._config_file = config_file
+        self._vocabularies = {}
+
+        self.load_config(config_file, encoding=encoding)
+
+    def __check_frozen(self):
+        if self._frozen:
+            raise exceptions.KnowledgeBaseFrozen()
+
+    def load_config(self, config_file, encoding='utf-8'):
+        u"""
+        Loads the configuration file.
+
+        Receive as parameters a name (with relative or full path) of
+        configuration file, and its encoding. Default encoding is utf-8.
+
+        The configuration file have a mandatory tag **conversations**, that
+        specify the conversation files. Is a list with the names (with relative
+        or full path) of the files.
+
+        The optional tag **topics** groups conversation files by topic name,
+        e.g.::
+
+            topics:
+                weather:
+                    - conversations/weather.yml
+
+        Topic files are loaded when the topic is first activated by an user.
+
+        The optional tag **resources** configures the resources of the 
+        kernels directives (see ``aerolito.resources``), and the optional tag
+        **normalize** the normalization of texts (see ``aerolito.normalize``).
+        """
+        self.__check_frozen()
+        config = load_yaml(config_file, encoding)
+
+        if 'conversations' not in config:
+            raise exceptions.MissingTag('conversations', 'config')
+
+        self._config = config
+        self._config_file = config_file
+        self._synonyms = {}
+        self._meanings = {}
+        self._patterns = []
+        self._index = PatternIndex()
+        self._topics = {}
+        self._vocabularies = {}
+        self._encoding = encoding
+        self._normalize = Pipeline(config.get('normalize'), self._synonyms,
+                                   lambda name: load_yaml(name, encoding))
+
+        self._environ = self._make_environ()
+
+        for synonym_file in config.get('synonyms', []):
+            self.load_sysnonym(synonym_file, encoding)
+
+        for meaning_file in config.get('meanings', []):
+            self.load_meaning(meaning_file, encoding)
+
+        for conversation_file in config['conversations']:
+            self.load_conversation(conversation_file, encoding)
+
+        for name, topic_files in (config.get('topics') or {}).iteritems():
+            if not isinstance(topic_files, (tuple, list)):
+                topic_files = [topic_files]
+
+            for topic_file in topic_files:
+                if not os.path.isfile(topic_file):
+                    raise exceptions.FileNotFound(topic_file)
+
+            self._topics[name] = {
+                'files': topic_files,
+                'patterns': None,
+                'index': None,
+            }
+
+    def _make_environ(self):
+        u"""
+        Returns the environment variable used to compile patterns.
+        """
+        environ = {
+            'user_id': None,
+            'meanings': self._meanings,
+            'synonyms': self._synonyms,
+            'normalize': self._normalize,
+            'directives': None,
+            'globals': self._config,
+            'session': {},
+            'topics': self._topics,
+        }
+        environ['directives'] = directives.load_directives(environ)
+        return environ
+
+    def load_sysnonym(self, synonym_file, encoding='utf-8'):
+        u"""
+        Load a synonym file.
+
+        Receive as parameters a name (with relative or full path) of a
+        synonym file, and their encoding. Default encoding is utf-8.
+
+        Synonym file must have at least one element. Contains a list of lists.
+
+        The patterns are loaded in ``_synonyms``
+        """
+        self.__check_frozen()
+        data = load_yaml(synonym_file, encoding)
+
+        for synonyms in data:
+            if len(synonyms) < 2:
+                raise exceptions.InvalidTagValue(
+                        u'Synonym list must have more than one element.')
+
+            key = remove_accents(synonyms[0]).lower()
+            vals = [remove_accents(value).lower() for value in synonyms[1:]]
+
+            if key in self._synonyms:
+                raise exceptions.DuplicatedSynonym(key, synonym_file)
+
+            self._synonyms[key] = vals
+
+        self._normalize.reset()
+
+    def load_meaning(self, meaning_file, encoding='utf-8'):
+        u"""
+        Load a meaning file.
+
+        Receive as parameters a name (with relative or full path) of a
+        meaning file, and their encoding. Default encoding is utf-8.
+
+        Meaning file must have at least one element. Contains a list of lists.
+
+        The patterns are loaded in ``_meanings``
+        """
+        self.__check_frozen()
+        data = load_yaml(meaning_file, encoding)
+
+        for meanings, values in data.items():
+            if len(values) == 0:
+                raise exceptions.InvalidTagValue(
+                        u'Meaning list must have one or more element.')
+
+            key = remove_accents(meanings).lower()
+            vals = [self._normalize(v).lower() for v in values]
+
+            if key in self._meanings:
+                raise exceptions.DuplicatedMeaning(key, meaning_file)
+
+            self._meanings[key] = vals
+
+    def load_conversation(self, conversation_file, encoding='utf-8'):
+        u"""
+        Load a conversation file.
+
+        Receive as parameters a name (with relative or full path) of a
+        conversation file, and their encoding. Default encoding is utf-8.
+
+        The conversations file have a obrigatory tag **patterns**, that specify
+        the conversation patterns. Is a list of dictonaries.
+
+        The patterns are loaded in ``_patterns``
+        """
+        self.__check_frozen()
+        for pattern in self.read_conversation(conversation_file, encoding):
+            self._patterns.append(pattern)
+            self._index.add(pattern)
+        self._vocabularies.pop('', None)
+
+    def read_conversation(self, conversation_file, encoding='utf-8', 
+                          environ=None):
+        u"""
+        Reads a conversation file, returning its patterns compiled with this
+        knowledge base, or with a kernel ``environ``.
+        """
+        if environ is None:
+            environ = self._environ
+
+        data = load_yaml(conversation_file, encoding)
+
+        if 'patterns' not in data:
+            raise exceptions.MissingTag('patterns', conversation_file)
+
+        return [Pattern(p, environ, lazy=self._lazy)
+                for p in data['patterns']]
+
+    def load_topic(self, name):
+        u"""
+        Loads the conversation files of the topic ``name``, if not loaded yet,
+        and returns the topic. Is called by ``Kernel.respond`` when the topic
+        is active for the user.
+        """
+        if name not in self._topics:
+            raise exceptions.TopicNotFound(name)
+
+        topic = self._topics[name]
+        if topic['index'] is None:
+            with self._topics_lock:
+                if topic['index'] is None:
+                    patterns = []
+                    index = PatternIndex()
+                    for topic_file in topic['files']:
+                        for pattern in self.read_conversation(topic_file,
+                                                              self._encoding):
+                            patterns.append(pattern)
+                            index.add(pattern)
+
+                    topic['patterns'] = patterns
+                    topic['index'] = index
+
+        return topic
+
+    def vocabulary(self, name=''):
+        u"""
+        Returns the ``fuzzy.Vocabulary`` of the topic ``name``, or of the 
+        conversation files if ``name`` is "", loading the topic if needed.
+        """
+        vocabulary = self._vocabularies.get(name)
+        if vocabulary is None:
+            if name:
+                patterns = self.load_topic(name)['patterns']
+            else:
+                patterns = self._patterns
+            vocabulary = Vocabulary(patterns)
+            self._vocabularies[name] = vocabulary
+
+        return vocabulary
+
+    def analyze(self, drop=False):
+        u"""
+        Finds the patterns of the conversation files and of the topics that
+        can never match, shadowed by earlier patterns (see 
+        ``aerolito.analyzer``), loading all topics. Returns a list of 
+        ``(topic name, number, pattern, shadower, kind)``, the topic name is
+        "" for the conversation files.
+
+        If ``drop`` is True, the patterns found are removed from the 
+        knowledge base and the indexes rebuilt, so they are neither kept in 
+        memory nor tested. Raises ``KnowledgeBaseFrozen`` if frozen.
+        """
+        if drop:
+            self.__check_frozen()
+
+        groups = [('', self._patterns, None)]
+        for name in sorted(self._topics):
+            groups.append((name, self.load_topic(name)['patterns'], 
+                           self._topics[name]))
+
+        result = []
+        for name, patterns, topic in groups:
+            found = analyzer.shadowed(patterns)
+            for number, shadower, kind in found:
+                result.append((name, number, patterns[number], 
+                               patterns[shadower], kind))
+            if not drop or not found:
+                continue
+
+            numbers = set(x[0] for x in found)
+            patterns = [x for i, x in enumerate(patterns) if i not in numbers]
+            index = PatternIndex()
+            for pattern in patterns:
+                index.add(pattern)
+
+            if topic is None:
+                self._patterns, self._index = patterns, index
+            else:
+                topic['patterns'], topic['index'] = patterns, index
+            self._vocabularies.pop(name, None)
+
+        return result
+
+    def reload(self):
+        u"""
+        Returns a new knowledge base loaded from the same configuration file,
+        frozen if this one is frozen. This knowledge base is not changed.
+        """
+        knowledge = KnowledgeBase(self._config_file, encoding=self._encoding,
+                                  lazy=self._lazy)
+        if self._frozen:
+            knowledge.freeze()
+        return knowledge
+
+    def files(self):
+        u"""
+        Returns the names of the files loaded by the knowledge base, including
+        topic files not loaded yet.
+        """
+        config = self._config
+        result = [self._config_file]
+        for tag in ('synonyms', 'meanings', 'conversations'):
+            result.extend(config.get(tag) or [])
+        for topic in self._topics.values():
+            result.extend(topic['files'])
+        return result
+
+    def warmup(self):
+        u"""
+        Compiles all loaded patterns not compiled yet, used with ``lazy``
+        knowledge bases.
+        """
+        for pattern in self._patterns:
+            pattern.compile()
+
+        for topic in self._topics.values():
+            for pattern in topic['patterns'] or ():
+                pattern.compile()
+
+    def freeze(self):
+        u"""
+        Prepares the knowledge base to be shared by forked processes.
+
+        Loads all topics, compiles all patterns and regular expressions and 
+        builds the vocabularies, so nothing in the knowledge base is changed 
+        by ``Kernel.respond`` anymore, and marks the knowledge base as frozen:
+        loading files raises ``KnowledgeBaseFrozen``. Objects are moved to the
+        oldest collector generation, which forked children should not collect
+        (see ``protect_shared_pages``).
+        """
+        for name in self._topics:
+            self.load_topic(name)
+
+        for pattern in self._patterns:
+            pattern.compile(regexes=True)
+
+        for topic in self._topics.values():
+            for pattern in topic['patterns']:
+                pattern.compile(regexes=True)
+
+        self.vocabulary()
+        for name in self._topics:
+            self.vocabulary(name)
+
+        self._frozen = True
+        gc.collect()
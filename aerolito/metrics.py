@@ -0,0 +1,268 @@
+# -*- coding:utf-8 -*-
+# Copyright (c) 2011 Renato de Pontes Pereira, renato.ppontes at gmail dot com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+Kernel metrics in the Prometheus text format.
+
+A kernel created with ``metrics=True`` records, for each ``respond``:
+
+- the time spent normalizing the input, matching the patterns and rendering
+  the output (including ``post`` actions), and the total time;
+- the number of patterns tested;
+- the depth of ``(rec|...)`` recursive responses;
+
+and the hits and misses of the directive result caches. ``render`` returns 
+these metrics with the number of sessions, an estimate of their memory and 
+the directive latencies, and ``serve`` exposes them over HTTP::
+
+    kernel = Kernel('config.yml', metrics=True)
+    server = metrics.serve(kernel, port=9100)
+"""
+
+import bisect
+import random
+import threading
+import BaseHTTPServer
+from aerolito.utils import deep_sizeof
+
+# Upper bounds of the histogram buckets
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+DEPTH_BUCKETS = (0, 1, 2, 3, 5, 10)
+
+PHASES = ('normalize', 'match', 'render', 'total')
+
+# Number of sessions measured to estimate the session memory
+_memory_sample = 100
+
+class Histogram(object):
+    u"""
+    A histogram of observed values, by bucket upper bound.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0]*(len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels=''):
+        u"""
+        Returns the exposition lines of the histogram.
+        """
+        prefix = labels + ',' if labels else ''
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append('%s_bucket{%sle="%s"} %d'%(name, prefix, 
+                                                     _number(bound), total))
+        result.append('%s_bucket{%sle="+Inf"} %d'%(name, prefix, self.count))
+        labels = '{%s}'%labels if labels else ''
+        result.append('%s_sum%s %s'%(name, labels, _number(self.sum)))
+        result.append('%s_count%s %d'%(name, labels, self.count))
+        return result
+
+class Metrics(object):
+    u"""
+    The metrics of one or more kernels. Updates are protected by a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.phases = dict((phase, Histogram(TIME_BUCKETS)) 
+                           for phase in PHASES)
+        self.tested = Histogram(COUNT_BUCKETS)
+        self.depth = Histogram(DEPTH_BUCKETS)
+        self.caches = {}
+
+    @staticmethod
+    def trace():
+        u"""
+        Returns the dict filled by ``Kernel.respond`` for a request.
+        """
+        return {'normalize': 0.0, 'match': 0.0, 'render': 0.0, 
+                'tested': 0, 'depth': 0}
+
+    def observe(self, trace, total):
+        u"""
+        Records a request ``trace`` that took ``total`` seconds.
+        """
+        with self._lock:
+            for phase in ('normalize', 'match', 'render'):
+                self.phases[phase].observe(trace[phase])
+            self.phases['total'].observe(total)
+            self.tested.observe(trace['tested'])
+            self.depth.observe(trace['depth'])
+
+    def cache(self, kind, hit):
+        u"""
+        Records a hit (or a miss) of the directive cache ``kind``, *request* 
+        or *ttl*.
+        """
+        key = (kind, 'hit' if hit else 'miss')
+        with self._lock:
+            self.caches[key] = self.caches.get(key, 0) + 1
+
+    def lines(self):
+        u"""
+        Returns the exposition lines of the recorded metrics.
+        """
+        with self._lock:
+            result = [
+                '# HELP aerolito_respond_seconds Time spent by respond, '
+                'by phase.',
+                '# TYPE aerolito_respond_seconds histogram',
+            ]
+            for phase in PHASES:
+                result.extend(self.phases[phase].lines(
+                        'aerolito_respond_seconds', 'phase="%s"'%phase))
+
+            result.extend([
+                '# HELP aerolito_patterns_tested Patterns tested by request.',
+                '# TYPE aerolito_patterns_tested histogram',
+            ])
+            result.extend(self.tested.lines('aerolito_patterns_tested'))
+
+            result.extend([
+                '# HELP aerolito_recursion_depth Depth of recursive '
+                'responses by request.',
+                '# TYPE aerolito_recursion_depth histogram',
+            ])
+            result.extend(self.depth.lines('aerolito_recursion_depth'))
+
+            result.extend([
+                '# HELP aerolito_directive_cache_total Lookups of directive '
+                'results caches.',
+                '# TYPE aerolito_directive_cache_total counter',
+            ])
+            for (kind, status), count in sorted(self.caches.items()):
+                result.append('aerolito_directive_cache_total'
+                              '{cache="%s",result="%s"} %d'%(kind, status, 
+                                                             count))
+        return result
+
+def _number(value):
+    return repr(float(value))
+
+def _escape(value):
+    return unicode(value).replace(u'\\', u'\\\\').replace(u'"', u'\\"')\
+                         .replace(u'\n', u'\\n').encode('utf-8')
+
+def session_memory(sessions):
+    u"""
+    Estimates the memory, in bytes, of the ``sessions`` of a 
+    ``session.SessionMap``, measuring a sample of the sessions.
+    """
+    items = sessions.items()
+    if not items:
+        return 0
+
+    sample = items
+    if len(items) > _memory_sample:
+        sample = random.sample(items, _memory_sample)
+
+    size = sum(deep_sizeof(item) for item in sample)
+    return size*len(items)//len(sample)
+
+def render(kernel):
+    u"""
+    Returns the metrics of ``kernel`` in the Prometheus text format. Kernels
+    without metrics only have the session and directive metrics.
+    """
+    result = []
+    if kernel._metrics is not None:
+        result.extend(kernel._metrics.lines())
+
+    sessions = kernel._environ['session']
+    result.extend([
+        '# HELP aerolito_sessions Number of user sessions.',
+        '# TYPE aerolito_sessions gauge',
+        'aerolito_sessions %d'%len(sessions),
+        '# HELP aerolito_session_memory_bytes Estimated memory of the user '
+        'sessions.',
+        '# TYPE aerolito_session_memory_bytes gauge',
+        'aerolito_session_memory_bytes %d'%session_memory(sessions),
+    ])
+
+    stats = sorted(kernel.normalize_stats().items())
+    for name, kind, key, help in (
+            ('calls_total', 'counter', 'calls', 'Texts normalized by stage.'),
+            ('seconds_total', 'counter', 'total', 
+             'Time spent normalizing texts by stage.')):
+        result.append('# HELP aerolito_normalize_%s %s'%(name, help))
+        result.append('# TYPE aerolito_normalize_%s %s'%(name, kind))
+        for stage, values in stats:
+            value = values[key]
+            value = _number(value) if isinstance(value, float) else value
+            result.append('aerolito_normalize_%s{stage="%s"} %s'%(
+                                        name, _escape(stage), value))
+
+    stats = sorted(kernel.directive_stats().items())
+    for name, kind, key, help in (
+            ('calls_total', 'counter', 'calls', 'Calls of directives.'),
+            ('seconds_total', 'counter', 'total', 'Time spent by directives.'),
+            ('timeouts_total', 'counter', 'timeouts', 
+             'Directive calls timed out.'),
+            ('running', 'gauge', 'running', 
+             'Directive calls timed out still holding executor threads.')):
+        result.append('# HELP aerolito_directive_%s %s'%(name, help))
+        result.append('# TYPE aerolito_directive_%s %s'%(name, kind))
+        for directive, values in stats:
+            value = values[key]
+            value = _number(value) if isinstance(value, float) else value
+            result.append('aerolito_directive_%s{directive="%s"} %s'%(
+                                        name, _escape(directive), value))
+
+    return '\n'.join(result) + '\n'
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = render(self.server.kernel)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(kernel, host='127.0.0.1', port=9100):
+    u"""
+    Serves the metrics of ``kernel`` at ``http://host:port/metrics`` in a 
+    daemon thread. Returns the server, stopped by its ``shutdown`` method.
+    """
+    server = BaseHTTPServer.HTTPServer((host, port), _Handler)
+    server.kernel = kernel
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
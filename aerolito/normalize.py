@@ -0,0 +1,385 @@
+# -*- coding:utf-8 -*-
+# Copyright (c) 2011 Renato de Pontes Pereira, renato.ppontes at gmail dot com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+Input normalization pipeline.
+
+User inputs, and the texts of patterns and meanings when loaded, are 
+normalized by the same ``Pipeline``, configured by the **normalize** tag of
+the configuration file. The default pipeline removes accents and replaces 
+synonyms::
+
+    normalize:
+        - accents
+        - {contractions: {"don't": do not, "i'm": i am}}
+        - punctuation
+        - synonyms
+        - {replace: [['\\bvc\\b', voce]]}
+
+Steps are:
+
+accents
+    Replaces accented letters (see ``utils.remove_accents``).
+
+lower
+    Converts the text to lower case.
+
+punctuation
+    Removes punctuation, by default ``!"#$%&',-./:;<=>?@[]^_`{}~``, or the
+    characters informed. Stars, parentheses and pipes are kept for patterns.
+
+chars
+    Replaces characters, a dict of character to text.
+
+contractions
+    Replaces words or phrases, a dict or the name of a YAML file with a dict.
+
+synonyms
+    Replaces synonyms by their key, converting the text to lower case, if 
+    there are synonyms.
+
+replace
+    Replaces regular expressions, a list of ``[expression, replacement]``.
+
+Adjacent character steps (accents, lower, punctuation, chars) are fused in a
+single pass over the text, and word steps (contractions, synonyms) do a 
+single pass whatever their number of entries. New steps are added by 
+``register_step``.
+
+Stages are only timed for kernels with metrics or profiling, in their own 
+``StageStats``; pipelines keep no state while normalizing, so they can be 
+shared by threads and forked processes.
+"""
+
+import re
+import time
+import threading
+from aerolito import exceptions
+from aerolito.utils import substitute, normalize_input
+
+DEFAULT = ['accents', 'synonyms']
+PUNCTUATION = u'!"#$%&\',-./:;<=>?@[]^_`{}~'
+
+# Step factories, by name, used in the configuration file
+_steps = {}
+
+def register_step(name, factory):
+    u"""
+    Registers a step ``name``. The ``factory`` receives the value of the 
+    step in the configuration file (None if only the name is informed) and 
+    the ``Pipeline``, and returns a ``CharStep``, a ``WordStep`` or any 
+    callable receiving and returning the text.
+    """
+    _steps[name] = factory
+
+class CharStep(object):
+    u"""
+    A step replacing characters, by a ``table`` of ``unicode.translate``. If 
+    ``lower`` is True, the text is converted to lower case before. Adjacent 
+    character steps are fused in a single step.
+    """
+
+    def __init__(self, name, table, lower=False):
+        self.name = name
+        self.table = table
+        self.lower = lower
+
+    def __call__(self, text):
+        if self.lower:
+            text = text.lower()
+        return text.translate(self.table)
+
+    def fuse(self, step):
+        u"""
+        Returns a ``CharStep`` doing this step and then ``step``, or None if
+        they can not be done in a single pass.
+        """
+        lower = self.lower
+        table = self.table
+        if step.lower:
+            if table:
+                table = _lower_first(table)
+                if table is None:
+                    return None
+            lower = True
+
+        fused = dict((k, v.translate(step.table) if v else v) 
+                     for k, v in table.iteritems())
+        for k, v in step.table.iteritems():
+            fused.setdefault(k, v)
+
+        return CharStep('%s+%s'%(self.name, step.name), fused, lower)
+
+def _lower_first(table):
+    u"""
+    Returns a table ``t`` where ``lower(text).translate(t)`` is equal to 
+    ``text.translate(table).lower()``, or None if there is no such table.
+    """
+    lowered = {}
+    for k, v in table.iteritems():
+        key = unichr(k).lower()
+        if len(key) != 1:
+            return None
+        value = v.lower() if v else v
+        if lowered.setdefault(ord(key), value) != value:
+            return None
+
+    for k in table:
+        for c in (unichr(k), unichr(k).lower(), unichr(k).upper()):
+            expected = c.translate(table).lower()
+            if c.lower().translate(lowered) != expected:
+                return None
+
+    return lowered
+
+def _table(mapping):
+    return dict((ord(k), v or None) for k, v in mapping.iteritems())
+
+def accents(value, pipeline):
+    mapping = {}
+    for t, f in substitute:
+        mapping[t] = f
+        mapping[t.upper()] = f.upper()
+    return CharStep('accents', _table(mapping))
+
+def lower(value, pipeline):
+    return CharStep('lower', {}, lower=True)
+
+def punctuation(value, pipeline):
+    chars = unicode(PUNCTUATION if value is None else value)
+    return CharStep('punctuation', _table(dict.fromkeys(chars)))
+
+def chars(value, pipeline):
+    return CharStep('chars', _table(dict((unicode(k), unicode(v or u''))
+                                         for k, v in value.iteritems())))
+
+class WordStep(object):
+    u"""
+    A step replacing words or phrases in a single pass. The ``mapping`` is a
+    dict of text to replacement, or a callable returning it, called when the 
+    step is first used and after ``Pipeline.reset``. Texts are matched as 
+    whole words, the longest first, ignoring case. If ``lower`` is True, the 
+    text is converted to lower case before, if there are replacements.
+    """
+
+    def __init__(self, name, mapping, lower=False):
+        self.name = name
+        self.mapping = mapping
+        self.lower = lower
+        self._regex = None
+        self._replacements = None
+
+    def reset(self):
+        self._regex = None
+
+    def __compile(self):
+        mapping = self.mapping
+        if callable(mapping):
+            mapping = mapping()
+        replacements = dict((k.lower(), v) for k, v in mapping.iteritems())
+        if replacements:
+            texts = sorted(replacements, key=lambda x: (-len(x), x))
+            self._regex = re.compile(ur'(?<!\w)(?:%s)(?!\w)'%
+                            u'|'.join(re.escape(x) for x in texts), 
+                            re.U | re.I)
+        else:
+            self._regex = False
+        self._replacements = replacements
+
+    def __call__(self, text):
+        if self._regex is None:
+            self.__compile()
+
+        regex = self._regex
+        if not regex:
+            return text
+
+        if self.lower:
+            text = text.lower()
+        replacements = self._replacements
+        return regex.sub(lambda m: replacements[m.group().lower()], text)
+
+def contractions(value, pipeline):
+    if isinstance(value, basestring):
+        value = pipeline.load(value)
+    if not isinstance(value, dict):
+        raise exceptions.InvalidTagValue(
+                        u'Contractions must be a dict or a file name.')
+    return WordStep('contractions', dict((unicode(k), unicode(v)) 
+                                         for k, v in value.iteritems()))
+
+def synonyms(value, pipeline):
+    def mapping():
+        result = {}
+        for key, values in pipeline.synonyms.iteritems():
+            for expression in values:
+                result[expression] = key
+        return result
+    return WordStep('synonyms', mapping, lower=True)
+
+def replace(value, pipeline):
+    rules = [(re.compile(unicode(expression), re.U), unicode(replacement))
+             for expression, replacement in value]
+    def step(text):
+        for regex, replacement in rules:
+            text = regex.sub(replacement, text)
+        return text
+    step.name = 'replace'
+    return step
+
+register_step('accents', accents)
+register_step('lower', lower)
+register_step('punctuation', punctuation)
+register_step('chars', chars)
+register_step('contractions', contractions)
+register_step('synonyms', synonyms)
+register_step('replace', replace)
+
+class StageStats(object):
+    u"""
+    The number of calls and the time of the stages of pipelines, counted 
+    per thread so threads do not lose updates. ``stats`` sums the counters 
+    of all threads.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._counters = []
+        self._lock = threading.Lock()
+
+    def counters(self):
+        u"""
+        Returns the dict of stage name to ``[calls, total]`` of the current
+        thread.
+        """
+        counters = getattr(self._local, 'counters', None)
+        if counters is None:
+            counters = self._local.counters = {}
+            with self._lock:
+                self._counters.append(counters)
+        return counters
+
+    def stats(self):
+        u"""
+        Returns a dict of stage name to a dict with the number of ``calls`` 
+        and the ``total`` time in seconds.
+        """
+        result = {}
+        with self._lock:
+            counters = list(self._counters)
+        for thread in counters:
+            for name, (calls, total) in thread.items():
+                entry = result.setdefault(name, {'calls': 0, 'total': 0.0})
+                entry['calls'] += calls
+                entry['total'] += total
+        return result
+
+class Pipeline(object):
+    u"""
+    Normalizes texts by the ``steps`` of the **normalize** tag. The 
+    ``synonyms`` dict is used by the synonyms step, and ``load`` reads the 
+    files of steps. Calls are timed by stage if a ``StageStats`` is informed.
+    """
+
+    def __init__(self, steps=None, synonyms=None, load=None):
+        if steps is None:
+            steps = DEFAULT
+        if not isinstance(steps, (tuple, list)):
+            raise exceptions.InvalidTagValue(u'Invalid value for tag normalize.')
+
+        self.synonyms = synonyms if synonyms is not None else {}
+        self.load = load
+        self._steps = [self.__make_step(step) for step in steps]
+        self._stages = None
+
+    def __make_step(self, step):
+        if isinstance(step, dict) and len(step) == 1:
+            name, value = step.items()[0]
+        else:
+            name, value = step, None
+
+        if name not in _steps:
+            raise exceptions.InvalidTagValue(
+                                    u'Invalid normalize step "%s".'%name)
+        return _steps[name](value, self)
+
+    def reset(self):
+        u"""
+        Rebuilds the stages on next use, called when the synonyms change.
+        """
+        for step in self._steps:
+            if isinstance(step, WordStep):
+                step.reset()
+        self._stages = None
+
+    def stages(self):
+        u"""
+        Returns the list of ``(name, function)`` of the stages, the steps 
+        after fusion.
+        """
+        stages = self._stages
+        if stages is None:
+            steps = []
+            for step in self._steps:
+                if steps and isinstance(step, CharStep) and \
+                   isinstance(steps[-1], CharStep):
+                    fused = steps[-1].fuse(step)
+                    if fused is not None:
+                        steps[-1] = fused
+                        continue
+                steps.append(step)
+
+            stages = self._stages = [(step.name, step) for step in steps]
+        return stages
+
+    def __call__(self, text, stats=None):
+        # YAML scalars and byte string inputs are str, steps need unicode
+        if isinstance(text, str):
+            text = text.decode('utf-8')
+        elif not isinstance(text, unicode):
+            text = unicode(text)
+
+        stages = self._stages or self.stages()
+        if stats is None:
+            for name, step in stages:
+                text = step(text)
+            return text
+
+        counters = stats.counters()
+        for name, step in stages:
+            start = time.time()
+            text = step(text)
+            entry = counters.get(name)
+            if entry is None:
+                entry = counters[name] = [0, 0.0]
+            entry[0] += 1
+            entry[1] += time.time() - start
+        return text
+
+def get_normalizer(environ):
+    u"""
+    Returns the ``Pipeline`` of an ``environ``, or the default normalization
+    (see ``utils.normalize_input``) if it has no pipeline.
+    """
+    pipeline = environ.get('normalize')
+    if pipeline is None:
+        synonyms = environ['synonyms']
+        return lambda text: normalize_input(text, synonyms)
+    return pipeline
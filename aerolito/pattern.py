@@ -21,10 +21,71 @@
 
 import re
 import random
+import weakref
+import threading
 from aerolito import exceptions
+from aerolito.directives import execute
 from aerolito.utils import remove_accents
-from aerolito.utils import normalize_input
+from aerolito.utils import ignore_key, strip_ignored
+from aerolito.normalize import get_normalizer
 from aerolito.utils import get_meanings
+from aerolito.index import index_keys
+
+# Expression texts, compiled expressions and literals shared by all patterns,
+# so identical expressions and outputs (very common after meanings expansion)
+# are stored only once. Entries are released when no pattern uses them.
+_regexes = weakref.WeakValueDictionary()
+_literals = weakref.WeakValueDictionary()
+_expressions = weakref.WeakValueDictionary()
+
+# Held while a lazy pattern is compiled, so concurrent requests and 
+# ``warmup`` threads compile each pattern once
+_compile_lock = threading.Lock()
+
+def compile_expression(expression, flags=0):
+    u"""
+    Returns the compiled regular ``expression``, reusing the compiled object 
+    of an identical expression if there is one.
+    """
+    key = (expression, flags)
+    regex = _regexes.get(key)
+    if regex is None:
+        regex = _regexes.setdefault(key, re.compile(expression, flags))
+    return regex
+
+class Expression(unicode):
+    u"""
+    A regular expression text, ``unicode`` that can be weakly referenced.
+    """
+    __slots__ = ('__weakref__',)
+
+def intern_expression(expression):
+    u"""
+    Returns an ``Expression`` equal to ``expression``, reusing the object of
+    an identical expression if there is one.
+    """
+    result = _expressions.get(expression)
+    if result is None:
+        result = _expressions.setdefault(expression, Expression(expression))
+    return result
+
+def make_literal(value):
+    u"""
+    Returns a ``Literal`` for ``value``, reusing the literal of an identical
+    value if there is one.
+    """
+    try:
+        key = (type(value), value)
+        literal = _literals.get(key)
+    except TypeError:
+        return Literal(value)
+
+    if literal is None:
+        literal = _literals.setdefault(key, Literal(value))
+    return literal
+
+# Variables of literals, e.g. "<name>" or "<star 1>"
+_variables = re.compile(r'\<([\d|\s|\w]*)\>', re.I)
 
 def replace(literal, environ):
     """
@@ -39,8 +100,7 @@ def replace(literal, environ):
     """
 
     session = environ['session'][environ['user_id']]
-    p = r'\<([\d|\s|\w]*)\>'
-    _vars = re.findall(p, unicode(literal._value), re.I)
+    _vars = _variables.findall(unicode(literal._value))
 
     result = literal._value
     for var in _vars:
@@ -66,6 +126,7 @@ class Literal(object):
     """
     A Literal object represents an element of ``pattern:out`` tag.
     """
+    __slots__ = ('_value', '__weakref__')
 
     def __init__(self, value):
         self._value = value
@@ -79,13 +140,19 @@ class Action(object):
     The Actions are representations of the elements of ``pattern:when`` tag and
     ``pattern:post``. They are the link of Aerolito and python functions.
     """
+    __slots__ = ('_directive', '_params', '_name')
 
-    def __init__(self, directive, params):
+    def __init__(self, directive, params, name=None):
         """
-        Receives a directive and a parameters list.
+        Receives a directive and a parameters list. 
+
+        If the directive ``name`` is informed, the action runs the directive 
+        with this name in the ``environ`` received by ``run``, so patterns can
+        be shared by kernels with different environments.
         """
         self._directive = directive
         self._params = params
+        self._name = name
 
     def run(self, environ):
         """
@@ -95,8 +162,63 @@ class Action(object):
         params = []
         if self._params:
             params = [replace(x, environ) for x in self._params]
+
+        directive = self._directive
+        if self._name is not None:
+            directive = environ['directives'].get(self._name, directive)
             
-        return self._directive(params)
+        return execute(directive, params, environ, self._name)
+
+
+class Condition(object):
+    """
+    A Condition is an ``Action`` of ``pattern:when`` tag compiled from a 
+    directive without side effects (a directive with a ``test`` method, see
+    ``directives.Directive``). Conditions only depend on the user session, so
+    the conditions before any other action of the tag are checked before the
+    ``after`` and ``in`` regexes, cheapest first.
+    """
+    __slots__ = ('_test', '_params', '_static', '_cost')
+
+    def __init__(self, directive, params):
+        self._test = type(directive).test
+        self._static = not any(_variables.search(unicode(x._value)) 
+                               for x in params)
+        if self._static:
+            self._params = tuple([x._value for x in params])
+            self._cost = directive.cost
+        else:
+            self._params = params
+            self._cost = directive.cost + 10
+
+    @classmethod
+    def compile(cls, action):
+        """
+        Returns the ``Condition`` of ``action``, or None if the directive of
+        the action can not be a condition, or if its parameters use the 
+        ``<star>`` variables, only known after the regexes match.
+        """
+        directive = action._directive
+        if 'test' not in vars(type(directive)) or directive.cost is None:
+            return None
+
+        for x in action._params:
+            for var in _variables.findall(unicode(x._value)):
+                if var.split()[:1] == ['star']:
+                    return None
+
+        return cls(directive, action._params)
+
+    def check(self, environ, session):
+        """
+        Returns the result of the directive for the ``session`` of the active
+        user.
+        """
+        if self._static:
+            return self._test(session, *self._params)
+
+        params = [replace(x, environ) for x in self._params]
+        return self._test(session, *params)
 
 
 class Regex(object):
@@ -109,44 +231,69 @@ class Regex(object):
     After matchs some tag. A Regex object stores the values grouped by special
     expression "\*".
     """
+    __slots__ = ('_expression', '_regex', '_ignore', '_stars')
 
     def __init__(self, text, ignore=None):
         """
-        Receive a text and converts it into a regular expression.
+        Receive a text and converts it into a regular expression. The 
+        characters of ``ignore`` (a string or a list of strings) are removed 
+        from the text and from the values matched.
         """
         # self._expression = remove_accents(text)
         if ignore:
-            ignore = '|'.join([re.escape(i) for i in ignore])
-            self._ignore = re.compile('[%s]'%ignore)
-            self._expression = re.sub(self._ignore, '', text)
+            self._ignore = ignore_key(ignore)
+            expression = strip_ignored(text, self._ignore)
         else:
             self._ignore = None
-            self._expression = text
-
-        self._expression = re.escape(self._expression)
-        self._expression = self._expression.replace('\\*', '(.*)')
-        self._expression = self._expression.replace('\\\\(.*)', '\*')
-        self._expression = re.sub('(\\\ )+\(\.\*\)', '(.*)', self._expression)
-        self._expression = re.sub('\(\.\*\)(\\\ )+', '(.*)', self._expression)
-        self._expression = '^%s$'%self._expression 
-        
+            expression = text
+
+        expression = re.escape(expression)
+        expression = expression.replace('\\*', '(.*)')
+        expression = expression.replace('\\\\(.*)', '\*')
+        expression = re.sub('(\\\ )+\(\.\*\)', '(.*)', expression)
+        expression = re.sub('\(\.\*\)(\\\ )+', '(.*)', expression)
+        self._expression = intern_expression('^%s$'%expression)
+
+        # Compiled on first match, most regexes are never tested
+        self._regex = None
         self._stars = None
     
-    def match(self, value):
+    def compile(self):
         """
-        Try to match the ``value`` with the ``_expression``. If matched, it 
-        extract the ``<star>`` values.
+        Compiles the regular expression, if not compiled yet.
+        """
+        if self._regex is None:
+            self._regex = compile_expression(self._expression, re.I)
+            self._expression = self._regex.pattern
+
+    def search(self, value, stripped=False):
         """
-        if self._ignore:
-            value = re.sub(self._ignore, '', value)
+        Try to match the ``value`` with the ``_expression``. Returns the list
+        of ``<star>`` values if matched, or None. Unlike ``match``, the regex
+        object is not changed, so it can be used by concurrent requests.
 
-        m = re.match(self._expression, value, re.I)
+        If ``stripped`` is True, the ignored characters were already removed
+        from ``value``.
+        """
+        if self._regex is None:
+            self.compile()
+
+        if self._ignore and not stripped:
+            value = strip_ignored(value, self._ignore)
+
+        m = self._regex.match(value)
         if m:
-            self._stars = [x.strip() for x in m.groups()]
-            return True
+            return [x.strip() for x in m.groups()]
         else:
-            self._stars = None
-            return False
+            return None
+
+    def match(self, value):
+        """
+        Try to match the ``value`` with the ``_expression``. If matched, it 
+        extract the ``<star>`` values.
+        """
+        self._stars = self.search(value)
+        return self._stars is not None
 
     def __repr__(self):
         return '<Regex %s>' % self._expression
@@ -167,28 +314,77 @@ class Pattern(object):
     4. **in**: condition to select the pattern. The value of the tag is 
        compared with the user input.
     5. **when**: condition to select the pattern. Is a set of actions that must
-       return True to validated the pattern.
+       return True to validated the pattern. The leading actions of 
+       directives without side effects are compiled into ``Condition``s, 
+       checked before **after** and **in**.
     6. **out**: return values, they are the user response.
     7. **post**: set of actions that are executed after a pattern is accepted 
        and a response selected.
     """
+    __slots__ = ('_mean', '_ignore', '_after', '_in', '_out', '_requires',
+                 '_when', '_post', '_keys', '_raw', '_environ')
 
-    def __init__(self, p, environ):
+    def __init__(self, p, environ, lazy=False):
         u"""
         Receive a dict ``p`` with the tags (that comes from conversation file)
         and the ``_environ`` variable.
+
+        If ``lazy`` is True, the tags are validated but only ``p`` and the 
+        index keys are kept; the pattern is compiled on first match.
         """
+        self._raw = None
+        self._environ = None
+        self.__load(p, environ, lazy)
+
+        if lazy:
+            self._raw = p
+            self._environ = environ
+            self._mean = self._after = self._in = None
+            self._out = self._requires = self._when = self._post = None
+
+    def __load(self, p, environ, lazy=False):
         self._mean = self.__convert_mean(p, environ)
         self._ignore = self.__convert_ignore(p, environ)
-        self._after = self.__convert_regex(p, 'after', environ)
-        self._in = self.__convert_regex(p, 'in', environ)
+        after = self.__expand_regex(p, 'after', environ)
+        texts = self.__expand_regex(p, 'in', environ)
         self._out = self.__convert_literal(p, 'out', environ)
-        self._when = self.__convert_action(p, 'when', environ)
+        self._requires, self._when = self.__split_conditions(
+                                self.__convert_action(p, 'when', environ))
         self._post = self.__convert_action(p, 'post', environ)
 
+        # Ignored characters are removed from the texts and, before the 
+        # match, from the input, so the index compares the stripped words
+        if self._ignore and texts:
+            texts = [strip_ignored(x, self._ignore) for x in texts]
+        self._keys = index_keys(texts)
+
+        if not lazy:
+            self._after = self.__convert_regex(after)
+            self._in = self.__convert_regex(texts)
+
+    def compile(self, regexes=False):
+        u"""
+        Compiles a pattern created with ``lazy``. Does nothing if the pattern 
+        is already compiled.
+
+        If ``regexes`` is True, also compiles the regular expressions of 
+        ``after`` and ``in`` tags, which are otherwise compiled on first match.
+        """
+        if self._raw is not None:
+            with _compile_lock:
+                p = self._raw
+                if p is not None:
+                    self.__load(p, self._environ)
+                    self._raw = None
+                    self._environ = None
+
+        if regexes:
+            for regex in (self._after or ()) + (self._in or ()):
+                regex.compile()
+
     def __convert_mean(self, p, environ=None):
         meanings = {}
-        synonyms = environ['synonyms']
+        normalize = get_normalizer(environ)
         if p.has_key('mean'):
             tagValues = p['mean']
             if tagValues is None:
@@ -196,30 +392,28 @@ class Pattern(object):
 
             for k in tagValues:
                 key = remove_accents(k)
-                meanings[key] = [normalize_input(v, synonyms) for v in tagValues[k]]
+                meanings[key] = [normalize(v) for v in tagValues[k]]
                 
             return meanings
         else:
             return None
 
     def __convert_ignore(self, p, environ=None):
+        u"""
+        Returns the ignore key of the tag (see ``utils.ignore_key``), or None.
+        """
         if p.has_key('ignore'):
-            if  isinstance(p['ignore'], (tuple, list)):
-                tag_values = p['ignore']
-            else:
-                tag_values = list(str(p['ignore']))
+            return ignore_key(p['ignore']) or None
         else:
-            tag_values = None
-        
-        return tag_values
+            return None
                 
 
-    def __convert_regex(self, p, tag, environ=None):
+    def __expand_regex(self, p, tag, environ=None):
         u"""
-        Converts the values of ``tag`` to ``Regex``s. Accepts a list of string 
-        or just a string.
+        Normalizes the values of ``tag`` and replaces their meanings. Accepts 
+        a list of string or just a string.
         """
-        synonyms = environ['synonyms']
+        normalize = get_normalizer(environ)
         meanings = environ['meanings']
         if p.has_key(tag):
             tagValues = p[tag]
@@ -232,15 +426,24 @@ class Pattern(object):
             else:
                 values = [tagValues]
 
-            normalized = [normalize_input(unicode(x), synonyms) for x in values]
+            normalized = [normalize(unicode(x)) for x in values]
             patterns = []
             for x in normalized:
                 patterns.extend(get_meanings(x, meanings, self._mean))
 
-            return [Regex(x, self._ignore) for x in patterns]
+            return patterns
         else:
             return None
 
+    def __convert_regex(self, texts):
+        u"""
+        Converts the expanded values of a tag to ``Regex``s.
+        """
+        if texts is None:
+            return None
+
+        return tuple([Regex(x, self._ignore) for x in texts])
+
     def __convert_literal(self, p, tag, environ=None):
         u"""
         Converts the values of ``tag`` to ``Literal``s. Accepts a list of 
@@ -262,7 +465,7 @@ class Pattern(object):
             for x in values:
                 patterns.extend(get_meanings(x, meanings, self._mean))
 
-            return [Literal(unicode(x)) for x in patterns]
+            return tuple([make_literal(unicode(x)) for x in patterns])
         else:
             return None
 
@@ -287,24 +490,45 @@ class Pattern(object):
                 for d in tagValues:
                     for k, p in d.iteritems():
                         if isinstance(p, (tuple, list)):
-                            params = [Literal(x) for x in p]
+                            params = tuple([make_literal(x) for x in p])
                         else:
-                            params = [Literal(p)]
+                            params = (make_literal(p),)
                         
                         if k not in environ['directives']:
                             raise exceptions.InvalidTagValue(
                                     u'Directive "%s" not found'%str(k))
 
-                        action = Action(environ['directives'][k], params)
+                        action = Action(environ['directives'][k], params, k)
                         actions.append(action)
             else:
                 raise exceptions.InvalidTagValue(
                                     u'Invalid value for tag %s.'%tag)
             
-            return actions
+            return tuple(actions)
         else:
             return None
 
+    def __split_conditions(self, actions):
+        u"""
+        Splits the ``when`` actions in a tuple of ``Condition``s, sorted by 
+        cost, and a tuple of the other actions. Only the conditions before the
+        first other action are split, the actions after it may depend on its
+        side effects and are kept in order. Empty tuples are None.
+        """
+        if actions is None:
+            return None, None
+
+        conditions = []
+        for action in actions:
+            condition = Condition.compile(action)
+            if condition is None:
+                break
+            conditions.append(condition)
+        others = actions[len(conditions):]
+
+        conditions.sort(key=lambda c: c._cost)
+        return tuple(conditions) or None, tuple(others) or None
+
     def match(self, value, environ):
         u"""
         Verify if ``value`` is associated with the pattern. The verification
@@ -316,24 +540,50 @@ class Pattern(object):
            ``value``.
         3. Tag When: all actions of this tag must return True.
 
-        A pattern just can match if all three conditions are accepted.
+        A pattern just can match if all three conditions are accepted. The 
+        ``Condition``s of tag When are checked first, so patterns that can not
+        match the user session are discarded before any regex is tested.
         """
-        self._stars = None
+        if self._raw is not None:
+            self.compile()
+
         session = environ['session'][environ['user_id']]
 
+        if self._requires:
+            for condition in self._requires:
+                if not condition.check(environ, session):
+                    return False
+
+        # Inputs are stripped once by ignore set in a request
+        ignore = self._ignore
+        if ignore:
+            cache = environ.get('request')
+
         if self._after:
+            last = None
+            if session['responses-normalized']:
+                last = session['responses-normalized'][-1]
+                if ignore:
+                    last = strip_ignored(last, ignore, cache)
+
             for regex in self._after:
-                if session['responses-normalized'] and \
-                   regex.match(session['responses-normalized'][-1]):
-                    session['stars'] = regex._stars
+                stars = None
+                if last is not None:
+                    stars = regex.search(last, True)
+                if stars is not None:
+                    session['stars'] = stars
                     break
             else:
                 return False
 
         if self._in:
+            if ignore:
+                value = strip_ignored(value, ignore, cache)
+
             for regex in self._in:
-                if regex.match(value):
-                    session['stars'] = regex._stars
+                stars = regex.search(value, True)
+                if stars is not None:
+                    session['stars'] = stars
                     break
             else:
                 return False
@@ -345,11 +595,17 @@ class Pattern(object):
         
         return True
 
+    def choice_literal(self):
+        u"""
+        Choices one random ``Literal`` of the out tag.
+        """
+        return random.choice(self._out)
+
     def choice_output(self, environ):
         u"""
         Choices one random response, replacing the veriables
         """
-        return replace(random.choice(self._out), environ)
+        return replace(self.choice_literal(), environ)
     
     def execute_post(self, environ):
         u"""
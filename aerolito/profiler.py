@@ -0,0 +1,206 @@
+# -*- coding:utf-8 -*-
+# Copyright (c) 2011 Renato de Pontes Pereira, renato.ppontes at gmail dot com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+Sampling profiler of kernel responses.
+
+A kernel created with ``profile_sample_rate`` runs that fraction of its 
+responses under a deterministic profiler (``sys.setprofile``), only in the
+responding thread. Time is aggregated by call stack, where pattern matches 
+are named by their pattern and directive actions by their directive, and by
+pattern and directive::
+
+    kernel = Kernel('config.yml', profile_sample_rate=0.001)
+    ...
+    open('respond.folded', 'w').write(kernel.profile_stacks())
+
+The collapsed stacks (one ``frame;frame;frame microseconds`` line by stack) 
+are the input of flame graph tools, e.g. ``flamegraph.pl``.
+"""
+
+import os
+import sys
+import time
+import random
+import threading
+from aerolito.pattern import Pattern, Action
+
+_match_code = Pattern.match.im_func.func_code
+_action_code = Action.run.im_func.func_code
+
+def pattern_label(pattern):
+    u"""
+    Returns the name of a pattern in the profile, made of its ``in`` (or 
+    ``after``) elements.
+    """
+    if pattern._raw is not None:
+        texts = pattern._raw.get('in', pattern._raw.get('after'))
+        if not isinstance(texts, (tuple, list)):
+            texts = [texts]
+        texts = [unicode(x) for x in texts]
+    else:
+        texts = [r._expression.strip('^$').replace('\\', '')
+                 for r in pattern._in or pattern._after or ()]
+
+    label = u'|'.join(texts)
+    if len(label) > 60:
+        label = label[:57] + u'...'
+    return u'pattern %s'%label
+
+def _frame_label(frame):
+    code = frame.f_code
+    if code is _match_code:
+        return pattern_label(frame.f_locals['self'])
+    elif code is _action_code:
+        return u'directive %s'%frame.f_locals['self']._name
+    else:
+        return u'%s:%s'%(os.path.basename(code.co_filename), code.co_name)
+
+class Profile(object):
+    u"""
+    The profile of a single response, built by the ``sys.setprofile`` hook.
+    """
+
+    def __init__(self):
+        self.stacks = {}
+        self.patterns = {}
+        self.directives = {}
+        self._stack = []
+
+    def __call__(self, frame, event, arg):
+        if event == 'call':
+            self.__push(_frame_label(frame), frame.f_code)
+        elif event == 'c_call':
+            if arg is sys.setprofile:
+                return
+            self.__push(u'builtin %s'%getattr(arg, '__name__', '?'), None)
+        elif event in ('return', 'c_return', 'c_exception'):
+            self.__pop()
+
+    def __push(self, label, code):
+        path = self._stack[-1][0] + (label,) if self._stack else (label,)
+        self._stack.append([path, code, time.time(), 0.0])
+
+    def __pop(self):
+        if not self._stack:
+            return
+
+        path, code, start, children = self._stack.pop()
+        elapsed = time.time() - start
+        self.stacks[path] = self.stacks.get(path, 0.0) + elapsed - children
+        if self._stack:
+            self._stack[-1][3] += elapsed
+
+        if code is _match_code:
+            table = self.patterns
+        elif code is _action_code:
+            table = self.directives
+        else:
+            return
+
+        entry = table.setdefault(path[-1], [0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+
+    def finish(self):
+        u"""
+        Closes the frames still open when the profiler is removed.
+        """
+        while self._stack:
+            self.__pop()
+
+class Profiler(object):
+    u"""
+    Runs a fraction ``sample_rate`` of the responses under a ``Profile``, 
+    and aggregates the profiles. The optional ``sink`` is called with each 
+    ``Profile``.
+    """
+
+    def __init__(self, sample_rate, sink=None):
+        self.sample_rate = sample_rate
+        self.sink = sink
+        self.samples = 0
+        self.stacks = {}
+        self.patterns = {}
+        self.directives = {}
+        self._lock = threading.Lock()
+
+    def sample(self):
+        u"""
+        Returns True if the next response must be profiled.
+        """
+        return random.random() < self.sample_rate
+
+    def run(self, function, *args):
+        u"""
+        Calls ``function`` under a ``Profile`` and returns its result.
+        """
+        profile = Profile()
+        previous = sys.getprofile()
+        sys.setprofile(profile)
+        try:
+            return function(*args)
+        finally:
+            sys.setprofile(previous)
+            profile.finish()
+            self.add(profile)
+
+    def add(self, profile):
+        u"""
+        Aggregates a ``profile`` and sends it to the sink.
+        """
+        with self._lock:
+            self.samples += 1
+            for path, elapsed in profile.stacks.iteritems():
+                self.stacks[path] = self.stacks.get(path, 0.0) + elapsed
+            for table, values in ((self.patterns, profile.patterns),
+                                  (self.directives, profile.directives)):
+                for label, (calls, elapsed) in values.iteritems():
+                    entry = table.setdefault(label, [0, 0.0])
+                    entry[0] += calls
+                    entry[1] += elapsed
+
+        if self.sink is not None:
+            self.sink(profile)
+
+    def collapsed(self):
+        u"""
+        Returns the aggregated stacks in the collapsed format, one 
+        ``frame;frame microseconds`` line by stack, utf-8 encoded.
+        """
+        with self._lock:
+            stacks = self.stacks.items()
+
+        lines = []
+        for path, elapsed in sorted(stacks):
+            frames = [x.replace(u';', u':') for x in path]
+            lines.append(u'%s %d'%(u';'.join(frames), int(elapsed*1e6)))
+        return (u'\n'.join(lines) + u'\n').encode('utf-8')
+
+    def top(self, table, n=10):
+        u"""
+        Returns the ``n`` entries of ``patterns`` or ``directives`` with the 
+        largest time, as ``(label, calls, seconds)``.
+        """
+        with self._lock:
+            entries = [(label, calls, elapsed) 
+                       for label, (calls, elapsed) in table.items()]
+        entries.sort(key=lambda x: -x[2])
+        return entries[:n]
@@ -0,0 +1,222 @@
+# -*- coding:utf-8 -*-
+# Copyright (c) 2011 Renato de Pontes Pereira, renato.ppontes at gmail dot com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+Replay of recorded conversations against a changed knowledge base.
+
+The inputs of transcript files (see ``aerolito.transcript``) are responded
+by a kernel of the old and of the new configuration file, and ``run`` 
+returns a ``Report`` of the responses that changed, of the changes in the 
+number of inputs matched by each pattern, and of the throughput. Used by the
+command ``python -m aerolito replay old.yml new.yml transcript.jsonl``.
+
+Inputs are sharded by user across worker processes as in ``batch``, so the
+``after`` tag and local variables behave as in the recorded conversations.
+The random state is seeded by the user and the input before each response, 
+so patterns with many ``out`` elements only change their responses if 
+changed, and reports do not depend on the number of workers.
+
+Hits are counted by pattern identity: the topic and the tags of the pattern
+that select inputs (all but ``out`` and ``post``), and the number of earlier
+patterns with the same tags. So a pattern keeps its identity when other 
+patterns are added or its responses change, and patterns with the same 
+``in`` but different ``when`` tags are counted apart. Reports show them by 
+label, with their file and number.
+"""
+
+import os
+import json
+import time
+import zlib
+import random
+import functools
+from aerolito import batch
+from aerolito.kernel import Kernel
+from aerolito.knowledge import load_yaml
+from aerolito.profiler import pattern_label
+from aerolito.transcript import read_transcript
+
+# Tags of patterns not used to select inputs, ignored by pattern identities
+_response_tags = ('out', 'post')
+
+def identities(knowledge, encoding='utf-8'):
+    u"""
+    Returns a dict of ``id(pattern)`` to the ``(key, label)`` of each 
+    pattern of a frozen ``knowledge`` base, read again from its files.
+    """
+    groups = [('', knowledge._config['conversations'], knowledge._patterns)]
+    for name, topic in sorted(knowledge._topics.items()):
+        groups.append((name, topic['files'], topic['patterns']))
+
+    result = {}
+    for name, files, patterns in groups:
+        sources = []
+        for filename in files:
+            data = load_yaml(filename, encoding)
+            sources.extend((filename, i + 1, p) 
+                           for i, p in enumerate(data['patterns']))
+
+        seen = {}
+        for pattern, (filename, number, p) in zip(patterns, sources):
+            tags = json.dumps(dict((k, v) for k, v in p.iteritems() 
+                                   if k not in _response_tags), 
+                              sort_keys=True, default=unicode)
+            seen[tags] = seen.get(tags, 0) + 1
+            label = u'%s (%s:%d)'%(pattern_label(pattern), 
+                                   os.path.basename(filename), number)
+            result[id(pattern)] = ((name, tags, seen[tags]), label)
+    return result
+
+def _kernels(old_config, new_config, encoding):
+    result = []
+    for config_file in (old_config, new_config):
+        kernel = Kernel(config_file, encoding=encoding)
+        kernel.freeze()
+        result.append((kernel, identities(kernel._knowledge, encoding)))
+    return result
+
+def _replay(kernels, user_id, text):
+    u"""
+    Responds ``text`` by both ``kernels``, returning the response and the 
+    matched pattern identity of each (see ``identities``).
+    """
+    seed = zlib.crc32((u'%s\t%s'%(user_id, text)).encode('utf-8'))
+    result = []
+    for kernel, patterns in kernels:
+        random.seed(seed)
+        response, pattern = batch.respond(kernel, user_id, text, True)
+        key = label = None
+        if pattern is not None:
+            key, label = patterns[id(pattern)]
+        result.append((response, key, label))
+    return result
+
+class Report(object):
+    u"""
+    The result of a replay:
+
+    inputs
+        The number of replayed inputs.
+
+    seconds
+        The replay time.
+
+    changed
+        A list of ``(user_id, text, old response, new response)`` of the
+        inputs responded differently.
+
+    hits
+        A dict of ``[old, new]`` numbers of matched inputs by pattern 
+        identity (see ``identities``), None for the inputs matching no 
+        pattern.
+
+    labels
+        A dict of pattern identity to the label of the pattern, in the new 
+        configuration if it matched inputs there.
+    """
+
+    def __init__(self):
+        self.inputs = 0
+        self.seconds = 0.0
+        self.changed = []
+        self.hits = {}
+        self.labels = {None: None}
+
+    def add(self, user_id, text, old, new):
+        self.inputs += 1
+        if old[0] != new[0]:
+            self.changed.append((user_id, text, old[0], new[0]))
+
+        for i, (response, key, label) in enumerate((old, new)):
+            self.hits.setdefault(key, [0, 0])[i] += 1
+            if i or key not in self.labels:
+                self.labels[key] = label
+
+    def throughput(self):
+        u"""
+        Returns the number of inputs replayed by second.
+        """
+        if not self.seconds:
+            return 0.0
+        return self.inputs/self.seconds
+
+    def hit_changes(self):
+        u"""
+        Returns a list of ``(label, old, new)`` of the patterns whose number
+        of matched inputs changed, largest changes first.
+        """
+        changes = [(self.labels[key], old, new) 
+                   for key, (old, new) in self.hits.iteritems()
+                   if old != new]
+        changes.sort(key=lambda x: (-abs(x[2] - x[1]), x[0]))
+        return changes
+
+    def text(self, limit=20):
+        u"""
+        Returns the report as text, with at most ``limit`` changed 
+        responses.
+        """
+        lines = [u'%d inputs in %.3f s (%.1f inputs/s)'%(
+                        self.inputs, self.seconds, self.throughput()),
+                 u'%d responses changed'%len(self.changed)]
+
+        for user_id, text, old, new in self.changed[:limit]:
+            lines.append(u'')
+            lines.append(u'[%s] %s'%(user_id, text))
+            lines.append(u'  - %s'%old)
+            lines.append(u'  + %s'%new)
+        if len(self.changed) > limit:
+            lines.append(u'')
+            lines.append(u'... %d more'%(len(self.changed) - limit))
+
+        changes = self.hit_changes()
+        if changes:
+            lines.append(u'')
+            lines.append(u'pattern hits changed:')
+            for label, old, new in changes:
+                lines.append(u'  %+d\t%d -> %d\t%s'%(
+                        new - old, old, new, label or u'(no match)'))
+
+        return u'\n'.join(lines) + u'\n'
+
+def read_records(filenames):
+    u"""
+    Yields the ``(user_id, text)`` records of transcript files.
+    """
+    for filename in filenames:
+        for entry in read_transcript(filename):
+            yield entry['user_id'], entry['input']
+
+def run(old_config, new_config, records, encoding='utf-8', workers=1,
+        window=1024):
+    u"""
+    Replays ``(user_id, text)`` records with kernels of ``old_config`` and
+    ``new_config``, returning a ``Report``.
+    """
+    report = Report()
+    setup = functools.partial(_kernels, old_config, new_config, encoding)
+
+    start = time.time()
+    results = batch.parallel(setup, _replay, records, workers, window)
+    for (user_id, text), (old, new) in results:
+        report.add(user_id, text, old, new)
+    report.seconds = time.time() - start
+
+    return report
@@ -0,0 +1,296 @@
+# -*- coding:utf-8 -*-
+# Copyright (c) 2011 Renato de Pontes Pereira, renato.ppontes at gmail dot com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+Resources shared by the directives of a kernel.
+
+A kernel creates a ``Resources`` registry from the **resources** tag of the
+configuration file::
+
+    resources:
+        db: {type: sqlite, database: data/bot.db, size: 4}
+        names: {type: lines, file: data/names.txt}
+        memo: {type: cache, size: 1000}
+
+Each resource is created on first use, reused by all requests and threads,
+and closed by ``Kernel.close``. Directives get resources by name::
+
+    class IsUser(Directive):
+        def run(self, name):
+            return self.resource('db').query_one(
+                        'SELECT 1 FROM users WHERE name = ?', (name,)) is not None
+
+New resource types are added by ``register_resource_type``.
+"""
+
+import Queue
+import sqlite3
+import codecs
+import threading
+import contextlib
+from collections import OrderedDict
+from aerolito import exceptions
+
+# Resource types, by name, used in the configuration file
+_resource_types = {}
+
+def register_resource_type(name, factory):
+    u"""
+    Registers a resource type ``name``. The ``factory`` receives the options
+    of the resource in the configuration file (without ``type``) as keyword
+    arguments and returns the resource object. If the object have a ``close``
+    method, it is called when the kernel is closed.
+    """
+    _resource_types[name] = factory
+
+class Resources(object):
+    u"""
+    A registry of resources, created on first use.
+    """
+
+    def __init__(self, config=None):
+        u"""
+        Registers the resources of ``config``, a dict of resource name to 
+        options with a ``type`` key.
+        """
+        self._factories = {}
+        self._resources = {}
+        self._lock = threading.Lock()
+
+        for name, options in (config or {}).iteritems():
+            if not isinstance(options, dict) or 'type' not in options:
+                raise exceptions.MissingTag('type', 'resource "%s"'%name)
+
+            options = dict((str(k), v) for k, v in options.iteritems())
+            kind = options.pop('type')
+            if kind not in _resource_types:
+                raise exceptions.InvalidTagValue(
+                                u'Invalid resource type "%s".'%kind)
+
+            self.add(name, _make_factory(_resource_types[kind], options))
+
+    def __contains__(self, name):
+        return name in self._factories
+
+    def add(self, name, factory):
+        u"""
+        Registers a resource ``name``, created by calling ``factory`` without
+        arguments.
+        """
+        if name in self._factories:
+            raise exceptions.DuplicatedResource(name)
+
+        self._factories[name] = factory
+
+    def get(self, name):
+        u"""
+        Returns the resource ``name``, creating it if needed.
+        """
+        resource = self._resources.get(name)
+        if resource is None:
+            if name not in self._factories:
+                raise exceptions.ResourceNotFound(name)
+
+            with self._lock:
+                resource = self._resources.get(name)
+                if resource is None:
+                    resource = self._factories[name]()
+                    self._resources[name] = resource
+
+        return resource
+
+    def close(self):
+        u"""
+        Closes all created resources. Resources are created again if used
+        after this.
+        """
+        with self._lock:
+            resources = self._resources.values()
+            self._resources = {}
+
+        for resource in resources:
+            close = getattr(resource, 'close', None)
+            if close is not None:
+                close()
+
+def _make_factory(factory, options):
+    return lambda: factory(**options)
+
+class ConnectionPool(object):
+    u"""
+    A pool of at most ``size`` connections, created by ``connect`` when 
+    needed. Connections are used by one thread at a time::
+
+        with pool.connection() as connection:
+            connection.execute(...)
+    """
+
+    def __init__(self, connect, size=4):
+        self._connect = connect
+        self._idle = Queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._size = size
+        self._created = 0
+        self._closed = False
+
+    @contextlib.contextmanager
+    def connection(self):
+        u"""
+        Returns a connection of the pool, waiting for a free connection if 
+        ``size`` connections are in use.
+        """
+        if self._closed:
+            raise exceptions.ResourceClosed()
+
+        try:
+            connection = self._idle.get_nowait()
+        except Queue.Empty:
+            connection = None
+            with self._lock:
+                if self._created < self._size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+
+            if create:
+                try:
+                    connection = self._connect()
+                except:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                connection = self._idle.get()
+
+        try:
+            yield connection
+        finally:
+            if self._closed:
+                connection.close()
+            else:
+                self._idle.put(connection)
+
+    def close(self):
+        u"""
+        Closes the idle connections, connections in use are closed when 
+        released.
+        """
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Queue.Empty:
+                break
+
+class SQLite(ConnectionPool):
+    u"""
+    A pool of connections to a SQLite ``database``. Statements are prepared
+    once by connection (see ``sqlite3.connect``, ``cached_statements``).
+    """
+
+    def __init__(self, database, size=4, timeout=5.0):
+        connect = lambda: sqlite3.connect(database, timeout=timeout,
+                                          check_same_thread=False)
+        super(SQLite, self).__init__(connect, size)
+
+    def query(self, sql, params=()):
+        u"""
+        Returns all rows of a query.
+        """
+        with self.connection() as connection:
+            return connection.execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        u"""
+        Returns the first row of a query, or None.
+        """
+        with self.connection() as connection:
+            return connection.execute(sql, params).fetchone()
+
+    def lookup(self, sql):
+        u"""
+        Returns a function receiving the parameters of ``sql`` and returning
+        the first column of the first row, or None.
+        """
+        def lookup(*params):
+            row = self.query_one(sql, params)
+            return row[0] if row is not None else None
+        return lookup
+
+class Lines(frozenset):
+    u"""
+    The set of (stripped, not empty) lines of a text ``file``, for fast 
+    membership lookups.
+    """
+
+    def __new__(cls, file, encoding='utf-8', lower=False):
+        try:
+            lines = codecs.open(file, 'rb', encoding).read().splitlines()
+        except IOError:
+            raise exceptions.FileNotFound(file)
+
+        lines = [x.strip() for x in lines]
+        if lower:
+            lines = [x.lower() for x in lines]
+        return super(Lines, cls).__new__(cls, [x for x in lines if x])
+
+class Cache(object):
+    u"""
+    A thread safe dict keeping the ``size`` most recently used values.
+    """
+
+    def __init__(self, size=1024):
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._size = size
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            if len(self._data) > self._size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def close(self):
+        self.clear()
+
+register_resource_type('sqlite', SQLite)
+register_resource_type('lines', Lines)
+register_resource_type('cache', Cache)
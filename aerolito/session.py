@@ -0,0 +1,587 @@
+# -*- coding:utf-8 -*-
+# Copyright (c) 2011 Renato de Pontes Pereira, renato.ppontes at gmail dot com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+User sessions: the ``SessionMap`` container, the per-thread ``Environ`` and 
+binary snapshots of sessions.
+
+Snapshots are used by ``Kernel.export_session`` and ``Kernel.import_session`` to move users
+between processes or hosts. A snapshot keeps the active topics, the local
+variables, the stars and the last input, response and normalized response of
+each user (the only history entries read by patterns), and have the layout::
+
+    header      magic "AES" and format version
+    count       number of sessions, as a varint
+    sessions    values of each session, in the order of ``_fields``
+
+Values are encoded with a type tag byte, followed by varint integers or
+lengths and utf-8 text. Only None, booleans, integers, floats, strings,
+lists and dicts can be encoded.
+
+The history of a session is kept by a ``History``: responses are stored as 
+references to the pattern ``Literal``s they were rendered from, plus the 
+values of their variables, and the response strings are only rebuilt when 
+read.
+"""
+
+import re
+import struct
+import weakref
+import threading
+from aerolito import exceptions
+
+MAGIC = 'AES'
+VERSION = 1
+
+_header = struct.Struct('<3sB')
+_float = struct.Struct('<d')
+
+# Session values in a snapshot, the history lists only keep the last entry
+_fields = ('topics', 'locals', 'stars')
+_history = ('inputs', 'responses', 'responses-normalized')
+
+# Variables and recursions of literals, e.g. "<name>" or "(rec|hello)"
+_slots = re.compile(r'\<[\d|\s|\w]*\>|\(rec\|[^\)]*\)', re.I)
+
+# Regexes extracting the values of the slots of a literal, by literal. 
+# Entries are released with their literals (see ``pattern.make_literal``)
+_templates = weakref.WeakKeyDictionary()
+
+def compact_response(literal, output):
+    u"""
+    Returns a compact record of the ``output`` rendered from a ``literal``:
+    the literal itself if the output is its value, a tuple of the literal and
+    the values of its variables and recursions, or the output if it can not 
+    be rebuilt from the literal (see ``expand_response``).
+    """
+    template = literal._value
+    if output == template:
+        return literal
+
+    regex = _templates.get(literal)
+    if regex is None:
+        parts = _slots.split(template)
+        if len(parts) == 1:
+            regex = False
+        else:
+            regex = re.compile(u'(.*?)'.join(re.escape(x) for x in parts) +
+                               u'\\Z', re.S)
+        regex = _templates.setdefault(literal, regex)
+
+    m = regex and regex.match(output)
+    if m is None or m is False:
+        return output
+    return (literal, m.groups())
+
+def expand_response(record):
+    u"""
+    Returns the response string of a record of ``compact_response``.
+    """
+    if isinstance(record, tuple):
+        literal, values = record
+        parts = _slots.split(literal._value)
+        result = [parts[0]]
+        for value, part in zip(values, parts[1:]):
+            result.append(value)
+            result.append(part)
+        return u''.join(result)
+    elif isinstance(record, basestring):
+        return record
+    else:
+        return record._value
+
+class History(object):
+    u"""
+    The history of a session. ``inputs`` is the list of the user inputs, and
+    responses are kept as records of ``compact_response``. The session keys 
+    *responses* and *responses-normalized* are ``ResponseList`` views of the
+    records. The last normalized response, read by the **after** tag of 
+    patterns, is kept with its record.
+    """
+    __slots__ = ('inputs', 'records', 'last')
+
+    def __init__(self):
+        self.inputs = []
+        self.records = []
+        self.last = None
+
+    def add(self, record, normalized):
+        u"""
+        Appends a response ``record`` and its ``normalized`` string.
+        """
+        self.records.append(record)
+        self.last = (record, normalized)
+
+    def normalized(self, i, normalize=None):
+        u"""
+        Returns the normalized response ``i``, a non-negative index. Responses
+        other than the last are normalized by ``normalize``, if informed.
+        """
+        last = self.last
+        if last is not None and i == len(self.records) - 1 and \
+           last[0] is self.records[i]:
+            return last[1]
+
+        response = expand_response(self.records[i])
+        if normalize is None:
+            return response
+        return normalize(response)
+
+class ResponseList(object):
+    u"""
+    A read-only list of the responses of a ``History``, or of the normalized
+    responses if ``normalized`` is True, computed by the ``normalize`` 
+    function when read. Items can be deleted, removing the responses from 
+    the history.
+    """
+    __slots__ = ('_history', '_normalized', '_normalize')
+
+    def __init__(self, history, normalized=False, normalize=None):
+        self._history = history
+        self._normalized = normalized
+        self._normalize = normalize
+
+    def __len__(self):
+        return len(self._history.records)
+
+    def __get(self, i):
+        if self._normalized:
+            return self._history.normalized(i, self._normalize)
+        return expand_response(self._history.records[i])
+
+    def __getitem__(self, i):
+        size = len(self._history.records)
+        if isinstance(i, slice):
+            return [self.__get(x) for x in xrange(*i.indices(size))]
+        if i < 0:
+            i += size
+        if not 0 <= i < size:
+            raise IndexError('response index out of range')
+        return self.__get(i)
+
+    def __delitem__(self, i):
+        del self._history.records[i]
+
+    def __iter__(self):
+        for i in xrange(len(self._history.records)):
+            yield self.__get(i)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(list(self))
+
+def make_session(normalize=None):
+    u"""
+    Returns a new user session with an empty ``History``. ``normalize`` is 
+    the function normalizing the responses of *responses-normalized*; 
+    kernels pass a method reading their current normalizer, so sessions do 
+    not keep a knowledge base alive.
+    """
+    history = History()
+    return {
+        'history': history,
+        'inputs': history.inputs,
+        'responses': ResponseList(history),
+        'responses-normalized': ResponseList(history, True, normalize),
+        'stars': [],
+        'locals': {},
+        'topics': [],
+    }
+
+def copy_session(session):
+    u"""
+    Returns a copy of ``session`` whose local variables, topics and stars 
+    can be changed without changing ``session``. The history is shared.
+    """
+    copy = dict(session)
+    copy['locals'] = dict(session['locals'])
+    copy['topics'] = list(session['topics'])
+    copy['stars'] = list(session['stars'])
+    return copy
+
+class SessionMap(object):
+    u"""
+    A dict of user id to session, split in ``shards`` dicts with their own 
+    locks, so threads handling different users do not contend. Each user 
+    also have a lock (see ``lock``) held by ``Kernel.respond``, so requests 
+    of the same user are handled one at a time.
+    """
+
+    def __init__(self, shards=16):
+        self._shards = [({}, {}, threading.Lock()) for i in xrange(shards)]
+
+    def __shard(self, user_id):
+        return self._shards[hash(user_id) % len(self._shards)]
+
+    def __len__(self):
+        return sum(len(sessions) for sessions, locks, lock in self._shards)
+
+    def __contains__(self, user_id):
+        return user_id in self.__shard(user_id)[0]
+
+    def __getitem__(self, user_id):
+        return self.__shard(user_id)[0][user_id]
+
+    def __setitem__(self, user_id, session):
+        sessions, locks, lock = self.__shard(user_id)
+        with lock:
+            sessions[user_id] = session
+
+    def __delitem__(self, user_id):
+        sessions, locks, lock = self.__shard(user_id)
+        with lock:
+            del sessions[user_id]
+            locks.pop(user_id, None)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, user_id, default=None):
+        return self.__shard(user_id)[0].get(user_id, default)
+
+    def setdefault(self, user_id, session):
+        u"""
+        Returns the session of ``user_id``, setting it to ``session`` if the 
+        user is not in the map. Is atomic, so only one of concurrent calls 
+        for a new user sets its session.
+        """
+        sessions, locks, lock = self.__shard(user_id)
+        with lock:
+            return sessions.setdefault(user_id, session)
+
+    def keys(self):
+        result = []
+        for sessions, locks, lock in self._shards:
+            with lock:
+                result.extend(sessions.keys())
+        return result
+
+    def items(self):
+        result = []
+        for sessions, locks, lock in self._shards:
+            with lock:
+                result.extend(sessions.items())
+        return result
+
+    def values(self):
+        return [session for user_id, session in self.items()]
+
+    def lock(self, user_id):
+        u"""
+        Returns the reentrant lock of ``user_id``.
+        """
+        sessions, locks, lock = self.__shard(user_id)
+        result = locks.get(user_id)
+        if result is None:
+            with lock:
+                result = locks.setdefault(user_id, threading.RLock())
+        return result
+
+class SessionOverlay(object):
+    u"""
+    A view of a ``SessionMap`` where the session of ``user_id`` is replaced
+    by ``session``, used by ``Kernel.match_all`` to test patterns without 
+    changing the map. Other methods are those of the map.
+    """
+    __slots__ = ('_sessions', '_user_id', 'session')
+
+    def __init__(self, sessions, user_id, session):
+        self._sessions = sessions
+        self._user_id = user_id
+        self.session = session
+
+    def __getitem__(self, user_id):
+        if user_id == self._user_id:
+            return self.session
+        return self._sessions[user_id]
+
+    def __contains__(self, user_id):
+        return user_id == self._user_id or user_id in self._sessions
+
+    def get(self, user_id, default=None):
+        if user_id == self._user_id:
+            return self.session
+        return self._sessions.get(user_id, default)
+
+    def __getattr__(self, name):
+        return getattr(self._sessions, name)
+
+class Snapshot(object):
+    u"""
+    The knowledge base of a kernel and the values of the environment that 
+    depend on it. Kernels replace the whole snapshot at once (see 
+    ``Kernel.swap_knowledge``), so requests never mix two knowledge bases.
+    """
+    __slots__ = ('knowledge', 'globals', 'meanings', 'synonyms', 'normalize',
+                 'topics')
+
+    def __init__(self, knowledge, globals):
+        self.knowledge = knowledge
+        self.globals = globals
+        self.meanings = knowledge._meanings
+        self.synonyms = knowledge._synonyms
+        self.normalize = knowledge._normalize
+        self.topics = knowledge._topics
+
+class Environ(dict):
+    u"""
+    The kernel environment variable. The request keys, ``user_id``, 
+    ``request``, ``session`` and ``snapshot``, have a value per thread, so 
+    threads can respond different users with the same environment. Threads 
+    that did not set a request key read the shared value, set when the 
+    environment was created or by ``publish``.
+
+    If there is a ``snapshot`` key, the keys ``globals``, ``meanings``, 
+    ``synonyms``, ``normalize`` and ``topics`` are read from its 
+    ``Snapshot``.
+    """
+    _request_keys = frozenset(['user_id', 'request', 'session', 'snapshot'])
+    _snapshot_keys = frozenset(Snapshot.__slots__) - set(['knowledge'])
+
+    def __init__(self, *args, **kw):
+        dict.__init__(self, *args, **kw)
+        self._local = threading.local()
+
+    def __getitem__(self, key):
+        if key in self._snapshot_keys and dict.__contains__(self, 'snapshot'):
+            return getattr(self['snapshot'], key)
+        if key in self._request_keys:
+            values = self._local.__dict__
+            if key in values:
+                return values[key]
+        return dict.__getitem__(self, key)
+
+    def publish(self, key, value):
+        u"""
+        Sets the shared value of a request ``key``.
+        """
+        dict.__setitem__(self, key, value)
+
+    def reset(self, key):
+        u"""
+        Removes the value of a request ``key`` set by the current thread, 
+        which reads the shared value again.
+        """
+        self._local.__dict__.pop(key, None)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        if key in self._request_keys and key in self:
+            setattr(self._local, key, value)
+        else:
+            dict.__setitem__(self, key, value)
+
+    def bind(self, function, **values):
+        u"""
+        Returns a function calling ``function`` with the request keys of the
+        current thread, or the given ``values``, used to run directives in 
+        other threads.
+        """
+        values = [(key, values[key] if key in values else self[key]) 
+                  for key in self._request_keys if key in self]
+        local = self._local
+        def bound(*args, **kw):
+            previous = local.__dict__.copy()
+            for key, value in values:
+                setattr(local, key, value)
+            try:
+                return function(*args, **kw)
+            finally:
+                local.__dict__.clear()
+                local.__dict__.update(previous)
+        return bound
+
+def _write_varint(out, value):
+    while value > 0x7f:
+        out.append(chr(0x80 | (value & 0x7f)))
+        value >>= 7
+    out.append(chr(value))
+
+def _read_varint(data, position):
+    result = shift = 0
+    while True:
+        byte = ord(data[position])
+        position += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, position
+        shift += 7
+
+def _write_value(out, value):
+    if value is None:
+        out.append('N')
+    elif value is True:
+        out.append('T')
+    elif value is False:
+        out.append('F')
+    elif isinstance(value, (int, long)):
+        out.append('i')
+        _write_varint(out, (value << 1) if value >= 0 else ((-value << 1) - 1))
+    elif isinstance(value, float):
+        out.append('d')
+        out.append(_float.pack(value))
+    elif isinstance(value, unicode):
+        value = value.encode('utf-8')
+        out.append('u')
+        _write_varint(out, len(value))
+        out.append(value)
+    elif isinstance(value, str):
+        out.append('s')
+        _write_varint(out, len(value))
+        out.append(value)
+    elif isinstance(value, (list, tuple)):
+        out.append('l')
+        _write_varint(out, len(value))
+        for item in value:
+            _write_value(out, item)
+    elif isinstance(value, dict):
+        out.append('m')
+        _write_varint(out, len(value))
+        for key, item in value.iteritems():
+            _write_value(out, key)
+            _write_value(out, item)
+    else:
+        raise exceptions.InvalidSessionData(
+                u'values of type %s can not be exported'%type(value).__name__)
+
+def _read_value(data, position):
+    tag = data[position]
+    position += 1
+    if tag == 'N':
+        return None, position
+    elif tag == 'T':
+        return True, position
+    elif tag == 'F':
+        return False, position
+    elif tag == 'i':
+        value, position = _read_varint(data, position)
+        return (value >> 1) if not value & 1 else -((value + 1) >> 1), position
+    elif tag == 'd':
+        return _float.unpack_from(data, position)[0], position + _float.size
+    elif tag in ('u', 's'):
+        size, position = _read_varint(data, position)
+        value = data[position:position + size]
+        if len(value) != size:
+            raise IndexError(position)
+        if tag == 'u':
+            value = value.decode('utf-8')
+        return value, position + size
+    elif tag == 'l':
+        size, position = _read_varint(data, position)
+        value = []
+        for i in xrange(size):
+            item, position = _read_value(data, position)
+            value.append(item)
+        return value, position
+    elif tag == 'm':
+        size, position = _read_varint(data, position)
+        value = {}
+        for i in xrange(size):
+            key, position = _read_value(data, position)
+            value[key], position = _read_value(data, position)
+        return value, position
+
+    raise exceptions.InvalidSessionData(u'unknown type tag %r'%tag)
+
+def snapshot_session(session):
+    u"""
+    Returns a copy of the fields of ``session`` written by ``dump_sessions``,
+    with the last entry of the history lists. Called with the lock of the 
+    user, so the session can be written while it changes.
+    """
+    result = {}
+    for key in _fields:
+        value = session[key]
+        result[key] = dict(value) if isinstance(value, dict) else list(value)
+    for key in _history:
+        result[key] = [session[key][-1]] if session[key] else []
+    return result
+
+def dump_sessions(sessions):
+    u"""
+    Returns a snapshot of ``sessions``, a list of ``(user_id, session)``.
+    """
+    out = [_header.pack(MAGIC, VERSION)]
+    _write_varint(out, len(sessions))
+    for user_id, session in sessions:
+        _write_value(out, user_id)
+        for key in _fields:
+            _write_value(out, session[key])
+        for key in _history:
+            _write_value(out, session[key][-1] if session[key] else None)
+
+    return ''.join(out)
+
+def load_sessions(data):
+    u"""
+    Returns the ``(user_id, session)`` list of a snapshot written by
+    ``dump_sessions``. Raises ``InvalidSessionData`` if ``data`` is not a
+    valid snapshot.
+    """
+    if len(data) < _header.size or \
+       _header.unpack_from(data, 0) != (MAGIC, VERSION):
+        raise exceptions.InvalidSessionData(u'invalid header')
+
+    try:
+        count, position = _read_varint(data, _header.size)
+        result = []
+        for i in xrange(count):
+            user_id, position = _read_value(data, position)
+            session = {}
+            for key in _fields:
+                session[key], position = _read_value(data, position)
+            for key in _history:
+                value, position = _read_value(data, position)
+                session[key] = [] if value is None else [value]
+            result.append((user_id, session))
+    except (IndexError, struct.error, UnicodeDecodeError):
+        raise exceptions.InvalidSessionData(u'truncated data')
+
+    if position != len(data):
+        raise exceptions.InvalidSessionData(u'trailing data')
+
+    return result
+
+def dump_session(user_id, session):
+    u"""
+    Returns a snapshot of a single session.
+    """
+    return dump_sessions([(user_id, session)])
+
+def load_session(data):
+    u"""
+    Returns the ``(user_id, session)`` of a snapshot written by
+    ``dump_session``.
+    """
+    sessions = load_sessions(data)
+    if len(sessions) != 1:
+        raise exceptions.InvalidSessionData(u'expected a single session')
+
+    return sessions[0]
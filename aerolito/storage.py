@@ -0,0 +1,354 @@
+# -*- coding:utf-8 -*-
+# Copyright (c) 2011 Renato de Pontes Pereira, renato.ppontes at gmail dot com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+Compiled knowledge base files.
+
+``save`` writes the knowledge base of a configuration file in a binary file
+that ``load`` maps in memory. Processes loading the same file share a single
+physical copy of it, and start without parsing YAML or deserializing the
+patterns: a pattern is only read from the file (and compiled) when it is a
+candidate for an input. The file layout is::
+
+    header        magic, format version, marshal version, metadata position
+    patterns      per group, a table of (position, size) of pattern records
+    records       the tags of each pattern, serialized with marshal
+    strings       the index words, utf-8 encoded
+    keys          per group, tables of (word position, word size, postings
+                  position, postings size), sorted by word, for exact and
+                  prefix words
+    postings      per group, lists of pattern numbers
+    metadata      config, synonyms, meanings and groups, serialized with
+                  marshal
+
+A group is the set of patterns of the conversation files (named "") or of a
+topic. Files are tied to the Python version that wrote them.
+"""
+
+import mmap
+import heapq
+import struct
+import marshal
+from aerolito import exceptions
+from aerolito.index import first_token
+from aerolito.pattern import Pattern
+from aerolito.normalize import Pipeline
+from aerolito.knowledge import KnowledgeBase, load_yaml
+
+MAGIC = 'AEROLKB\0'
+VERSION = 1
+
+_header = struct.Struct('<8sIIQQ')
+_record = struct.Struct('<QI')
+_key = struct.Struct('<QIQI')
+_posting = struct.Struct('<I')
+
+def _write_group(f, patterns, strings):
+    u"""
+    Writes the patterns of a group and returns the group metadata. Index words
+    are appended to ``strings``, to be written later.
+    """
+    records = []
+    for pattern in patterns:
+        if pattern._raw is None:
+            raise exceptions.InvalidTagValue(
+                                u'Only lazy patterns can be saved.')
+        data = marshal.dumps(pattern._raw)
+        records.append((f.tell(), len(data)))
+        f.write(data)
+
+    table = f.tell()
+    for position, size in records:
+        f.write(_record.pack(position, size))
+
+    exact = {}
+    prefix = {}
+    others = []
+    for number, pattern in enumerate(patterns):
+        # Patterns with ignore are not grouped by ignore set in the file
+        if pattern._keys is None or pattern._ignore:
+            others.append(number)
+            continue
+
+        for word, is_exact in pattern._keys:
+            words = exact if is_exact else prefix
+            words.setdefault(word.encode('utf-8'), []).append(number)
+
+    def write_postings(numbers):
+        position = f.tell()
+        for number in numbers:
+            f.write(_posting.pack(number))
+        return position, len(numbers)
+
+    group = {
+        'patterns': (table, len(records)),
+        'others': write_postings(others),
+    }
+    for name, words in (('exact', exact), ('prefix', prefix)):
+        keys = []
+        for word in sorted(words):
+            strings.append(word)
+            keys.append((word, write_postings(words[word])))
+        group[name] = keys
+
+    return group
+
+def save(config_file, filename, encoding='utf-8', drop_shadowed=False):
+    u"""
+    Loads the knowledge base of ``config_file``, including all topics, and
+    writes it to ``filename``. If ``drop_shadowed`` is True, patterns that 
+    can never match are not written (see ``KnowledgeBase.analyze``).
+    """
+    knowledge = KnowledgeBase(config_file, encoding=encoding, lazy=True)
+    if drop_shadowed:
+        knowledge.analyze(drop=True)
+
+    groups = {'': knowledge._patterns}
+    for name in knowledge._topics:
+        groups[name] = knowledge.load_topic(name)['patterns']
+
+    f = open(filename, 'wb')
+    try:
+        f.write(_header.pack(MAGIC, VERSION, marshal.version, 0, 0))
+
+        strings = []
+        meta = {}
+        for name, patterns in groups.iteritems():
+            meta[name] = _write_group(f, patterns, strings)
+
+        positions = {}
+        for word in strings:
+            if word not in positions:
+                positions[word] = f.tell()
+                f.write(word)
+
+        for group in meta.values():
+            for name in ('exact', 'prefix'):
+                table = f.tell()
+                for word, (position, size) in group[name]:
+                    f.write(_key.pack(positions[word], len(word),
+                                      position, size))
+                group[name] = (table, len(group[name]))
+
+        metadata = marshal.dumps({
+            'config': knowledge._config,
+            'synonyms': knowledge._synonyms,
+            'meanings': knowledge._meanings,
+            'topics': dict((k, v['files'])
+                           for k, v in knowledge._topics.iteritems()),
+            'groups': meta,
+        })
+        position = f.tell()
+        f.write(metadata)
+
+        f.seek(0)
+        f.write(_header.pack(MAGIC, VERSION, marshal.version,
+                             position, len(metadata)))
+    finally:
+        f.close()
+
+def load(filename):
+    u"""
+    Maps a file written by ``save``, returning a ``MappedKnowledgeBase``.
+    """
+    return MappedKnowledgeBase(filename)
+
+class MappedPatterns(object):
+    u"""
+    The patterns of a group in a mapped file. Patterns are read and compiled
+    on first access, and kept by this object.
+    """
+
+    def __init__(self, knowledge, group):
+        self._knowledge = knowledge
+        self._table, self._size = group['patterns']
+        self._patterns = {}
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for number in xrange(self._size):
+            yield self[number]
+
+    def __getitem__(self, number):
+        pattern = self._patterns.get(number)
+        if pattern is None:
+            if not 0 <= number < self._size:
+                raise IndexError(number)
+
+            mm = self._knowledge._map
+            position, size = _record.unpack_from(mm, self._table +
+                                                     number*_record.size)
+            p = marshal.loads(mm[position:position + size])
+            pattern = Pattern(p, self._knowledge._environ)
+            pattern = self._patterns.setdefault(number, pattern)
+
+        return pattern
+
+class MappedIndex(object):
+    u"""
+    The index of a group in a mapped file, with the same behavior of
+    ``PatternIndex``. Words are searched directly in the mapped file.
+    """
+
+    def __init__(self, patterns, mm, group):
+        self._patterns = patterns
+        self._map = mm
+        self._exact = group['exact']
+        self._prefix = group['prefix']
+        self._others = group['others']
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def __postings(self, position, size):
+        return struct.unpack_from('<%dI'%size, self._map, position)
+
+    def __search(self, keys, word):
+        table, size = keys
+        mm = self._map
+        low, high = 0, size
+        while low < high:
+            middle = (low + high)//2
+            entry = _key.unpack_from(mm, table + middle*_key.size)
+            key = mm[entry[0]:entry[0] + entry[1]]
+            if key < word:
+                low = middle + 1
+            elif key > word:
+                high = middle
+            else:
+                return self.__postings(entry[2], entry[3])
+        return None
+
+    def candidates(self, value, cache=None):
+        u"""
+        Yields the patterns that can match the input ``value``, in order. 
+        Patterns with ``ignore`` are candidates for every input, so 
+        ``cache`` is not used.
+        """
+        word = first_token(value)
+        if isinstance(word, unicode):
+            word = word.encode('utf-8')
+
+        entries = [self.__postings(*self._others),
+                   self.__search(self._exact, word)]
+        for i in xrange(1, len(word) + 1):
+            entries.append(self.__search(self._prefix, word[:i]))
+
+        entries = [e for e in entries if e]
+        if len(entries) == 1:
+            merged = entries[0]
+        else:
+            merged = heapq.merge(*entries)
+
+        last = None
+        for number in merged:
+            if number != last:
+                last = number
+                yield self._patterns[number]
+
+class MappedKnowledgeBase(KnowledgeBase):
+    u"""
+    A frozen ``KnowledgeBase`` mapped from a file written by ``save``. Can be
+    used by kernels as any knowledge base::
+
+        kernel = Kernel(knowledge=storage.load('knowledge.bin'))
+    """
+
+    def __init__(self, filename):
+        f = open(filename, 'rb')
+        try:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        magic, version, marshal_version, position, size = \
+                                        _header.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION or \
+           marshal_version != marshal.version:
+            raise exceptions.InvalidKnowledgeFile(filename)
+
+        meta = marshal.loads(self._map[position:position + size])
+
+        self._filename = filename
+        self._config = meta['config']
+        self._synonyms = meta['synonyms']
+        self._meanings = meta['meanings']
+        self._normalize = Pipeline(self._config.get('normalize'), 
+                                   self._synonyms, load_yaml)
+        self._topics = {}
+        self._vocabularies = {}
+        self._encoding = 'utf-8'
+        self._lazy = False
+        self._environ = self._make_environ()
+
+        for name, group in meta['groups'].iteritems():
+            patterns = MappedPatterns(self, group)
+            index = MappedIndex(patterns, self._map, group)
+            if name:
+                self._topics[name] = {
+                    'files': meta['topics'][name],
+                    'patterns': patterns,
+                    'index': index,
+                }
+            else:
+                self._patterns = patterns
+                self._index = index
+
+        self._frozen = True
+
+    def load_topic(self, name):
+        u"""
+        Returns the topic ``name``, all topics are in the mapped file.
+        """
+        if name not in self._topics:
+            raise exceptions.TopicNotFound(name)
+
+        return self._topics[name]
+
+    def reload(self):
+        u"""
+        Returns a new knowledge base mapped from the same file.
+        """
+        return MappedKnowledgeBase(self._filename)
+
+    def files(self):
+        u"""
+        Returns the name of the mapped file.
+        """
+        return [self._filename]
+
+    def warmup(self):
+        u"""
+        Reads and compiles all patterns of the file.
+        """
+        for pattern in self._patterns:
+            pattern.compile()
+
+        for topic in self._topics.values():
+            for pattern in topic['patterns']:
+                pattern.compile()
+
+    def freeze(self):
+        u"""
+        Does nothing, a mapped knowledge base is always frozen and patterns
+        are read on demand by each process.
+        """
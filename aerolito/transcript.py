@@ -0,0 +1,219 @@
+# -*- coding:utf-8 -*-
+# Copyright (c) 2011 Renato de Pontes Pereira, renato.ppontes at gmail dot com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+Conversation transcripts.
+
+A ``TranscriptWriter`` appends the inputs and responses of kernels to a JSON
+lines file, compressed with gzip if the file name ends with ".gz"::
+
+    kernel = Kernel('config.yml', transcript='logs/transcript.jsonl.gz')
+
+Each line is ``{"time": ..., "user_id": ..., "input": ..., "response": ...}``.
+``Kernel.respond`` only puts the entry in a queue; a background thread 
+writes the entries queued meanwhile in a single write (group commit), 
+optionally followed by ``fsync``. When the queue is full, ``respond`` waits
+for the writer, or the entry is dropped if the writer does not ``block``.
+Writers are closed, writing the queued entries, by ``Kernel.close`` and at
+interpreter exit.
+"""
+
+import os
+import gzip
+import json
+import time
+import Queue
+import atexit
+import weakref
+import threading
+from aerolito import exceptions
+
+# Writers not closed yet, closed at interpreter exit
+_writers = weakref.WeakSet()
+
+_stop = object()
+
+class TranscriptWriter(threading.Thread):
+    u"""
+    A daemon thread appending transcript entries to ``filename``.
+
+    At most ``queue_size`` entries wait in the queue, and at most 
+    ``batch_size`` entries are written at once. If ``sync`` is True, the file
+    is synced to disk after each write. The numbers of entries ``written`` 
+    and ``dropped``, and of ``batches``, are kept; a write error is kept in 
+    ``error`` and the next entries are dropped. Entries that can not be 
+    serialized, like inputs that are not UTF-8, are dropped.
+    """
+
+    def __init__(self, filename, compress=None, queue_size=10000, 
+                 batch_size=512, block=True, sync=False):
+        super(TranscriptWriter, self).__init__()
+        self.daemon = True
+        self.filename = filename
+        self.compress = filename.endswith('.gz') if compress is None \
+                        else compress
+        self.batch_size = batch_size
+        self.block = block
+        self.sync = sync
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.error = None
+        self._queue = Queue.Queue(queue_size)
+        self._closed = False
+        self._lock = threading.Lock()
+
+        if self.compress:
+            self._file = gzip.open(filename, 'ab')
+        else:
+            self._file = open(filename, 'ab')
+        _writers.add(self)
+
+    def write(self, user_id, text, response):
+        u"""
+        Queues an entry. Raises ``TranscriptClosed`` after ``close``.
+        """
+        entry = (time.time(), user_id, text, response)
+        with self._lock:
+            if self._closed:
+                raise exceptions.TranscriptClosed(self.filename)
+            try:
+                self._queue.put(entry, self.block)
+            except Queue.Full:
+                self.dropped += 1
+
+    def flush(self):
+        u"""
+        Waits until the queued entries are written.
+        """
+        self._queue.join()
+
+    def close(self):
+        u"""
+        Writes the queued entries, stops the thread and closes the file.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+        if self.is_alive():
+            self._queue.put(_stop)
+            self.join()
+        else:
+            self.__drain()
+        self._file.close()
+        _writers.discard(self)
+
+    def run(self):
+        while True:
+            entries = [self._queue.get()]
+            while len(entries) < self.batch_size:
+                try:
+                    entries.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            stop = _stop in entries
+            try:
+                self.__write([e for e in entries if e is not _stop])
+            finally:
+                for i in xrange(len(entries)):
+                    self._queue.task_done()
+
+            if stop:
+                self.__drain()
+                return
+
+    def __drain(self):
+        entries = []
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            if entry is not _stop:
+                entries.append(entry)
+            self._queue.task_done()
+        self.__write(entries)
+
+    def __dumps(self, entry):
+        u"""
+        Returns the JSON line of ``entry``, or None if it can not be 
+        serialized, like inputs that are not UTF-8.
+        """
+        t, user_id, text, response = entry
+        try:
+            return json.dumps({'time': t, 'user_id': user_id, 'input': text, 
+                               'response': response}, default=unicode)
+        except (TypeError, ValueError):
+            return None
+
+    def __write(self, entries):
+        if not entries:
+            return
+        if self.error is not None:
+            self.dropped += len(entries)
+            return
+
+        lines = []
+        for entry in entries:
+            line = self.__dumps(entry)
+            if line is None:
+                self.dropped += 1
+            else:
+                lines.append(line)
+                lines.append('\n')
+        if not lines:
+            return
+
+        count = len(lines) // 2
+        try:
+            self._file.write(''.join(lines))
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+        except Exception, e:
+            self.error = e
+            self.dropped += count
+            return
+
+        self.written += count
+        self.batches += 1
+
+def read_transcript(filename):
+    u"""
+    Yields the entries of a transcript file, as dicts.
+    """
+    if filename.endswith('.gz'):
+        f = gzip.open(filename, 'rb')
+    else:
+        f = open(filename, 'rb')
+    try:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        f.close()
+
+@atexit.register
+def _close_writers():
+    for writer in list(_writers):
+        writer.close()
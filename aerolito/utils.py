@@ -23,6 +23,8 @@ Utilities functions
 """
 
 import re
+import sys
+import types
 import itertools
 from aerolito import exceptions
 
@@ -112,4 +114,75 @@ def normalize_input(text, synonyms=None):
     if synonyms:
         text = substitue_synonym(text, synonyms)
 
-    return text
\ No newline at end of file
+    return text
+
+# Translate tables of the ignore sets, by ignore key
+_ignore_tables = {}
+
+def ignore_key(ignore):
+    u"""
+    Returns the key of an ``ignore`` tag value, a list of values or a value
+    converted to a string, like numbers read from YAML: the sorted 
+    characters to ignore, as a string. Patterns with the same characters to
+    ignore have the same key.
+    """
+    if isinstance(ignore, (list, tuple)):
+        ignore = u''.join(unicode(x) for x in ignore)
+    return u''.join(sorted(set(unicode(ignore))))
+
+def strip_ignored(value, key, cache=None):
+    u"""
+    Removes the characters of the ignore ``key`` from ``value``. If a 
+    ``cache`` dict is informed (e.g. the request dict of a response), values
+    are stripped only once by key.
+    """
+    if cache is not None:
+        entry = ('ignore', key, value)
+        result = cache.get(entry)
+        if result is None:
+            result = cache[entry] = strip_ignored(value, key)
+        return result
+
+    table = _ignore_tables.get(key)
+    if table is None:
+        table = _ignore_tables.setdefault(key, 
+                                    dict.fromkeys(ord(c) for c in key))
+    if isinstance(value, str):
+        value = value.decode('utf-8')
+    return value.translate(table)
+
+def deep_sizeof(obj, seen=None):
+    u"""
+    Estimates the memory, in bytes, used by ``obj`` and the objects it 
+    references (containers and instance attributes, including ``__slots__``).
+    Objects already in ``seen`` (a set of ids) are not counted again, so 
+    shared objects are counted only once over several calls.
+    """
+    if seen is None:
+        seen = set()
+
+    skip = (type, types.ModuleType, types.FunctionType, 
+            types.BuiltinFunctionType, types.MethodType)
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, skip):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        else:
+            if hasattr(obj, '__dict__'):
+                stack.append(obj.__dict__)
+            for cls in type(obj).__mro__:
+                for name in cls.__dict__.get('__slots__', ()):
+                    if name != '__weakref__' and hasattr(obj, name):
+                        stack.append(getattr(obj, name))
+
+    return size
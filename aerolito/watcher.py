@@ -0,0 +1,87 @@
+# -*- coding:utf-8 -*-
+# Copyright (c) 2011 Renato de Pontes Pereira, renato.ppontes at gmail dot com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+"""
+Reloads kernel knowledge bases when their files change.
+"""
+
+import os
+import threading
+
+class Watcher(threading.Thread):
+    u"""
+    A daemon thread checking, every ``interval`` seconds, the modification 
+    time of the knowledge base files of a ``kernel`` (see 
+    ``KnowledgeBase.files``), and calling ``Kernel.reload`` when they change.
+
+    Invalid files do not stop the watcher: the kernel keeps its knowledge 
+    base, the exception is kept in ``error``, and the files are loaded again
+    on the next change. 
+    """
+
+    def __init__(self, kernel, interval=1.0):
+        super(Watcher, self).__init__()
+        self.daemon = True
+        self.kernel = kernel
+        self.interval = interval
+        self.error = None
+        self.reloads = 0
+        self._stop_event = threading.Event()
+        self._times = self.__times()
+
+    def __times(self):
+        result = {}
+        for filename in self.kernel._knowledge.files():
+            try:
+                result[filename] = os.stat(filename).st_mtime
+            except OSError:
+                result[filename] = None
+        return result
+
+    def check(self):
+        u"""
+        Reloads the knowledge base if a file changed since the last check. 
+        Returns True if the knowledge base was reloaded.
+        """
+        times = self.__times()
+        if times == self._times:
+            return False
+
+        try:
+            self.kernel.reload()
+        except Exception, e:
+            self.error = e
+            self._times = times
+            return False
+
+        self.error = None
+        self.reloads += 1
+        self._times = self.__times()
+        return True
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.check()
+
+    def stop(self):
+        u"""
+        Stops the watcher thread.
+        """
+        self._stop_event.set()
@@ -0,0 +1,78 @@
+# -*- coding:utf-8 -*-
+"""
+Memory benchmark. Generates a synthetic knowledge base and reports the load
+time, the time to first response and the memory used per pattern, for eager 
+and lazy kernels. Usage::
+
+    python benchmarks/memory.py [number of patterns]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from aerolito import Kernel
+from aerolito.utils import deep_sizeof
+
+MEANINGS = u'''
+greeting: [hello, hi, hey there, good morning, good evening]
+question: [what is, who is, tell me about, do you know]
+'''
+
+def generate(path, n):
+    u"""Writes a config file with ``n`` patterns in ``path``."""
+    meanings = os.path.join(path, 'meanings.yml')
+    open(meanings, 'w').write(MEANINGS)
+
+    conversation = os.path.join(path, 'conversation.yml')
+    f = open(conversation, 'w')
+    f.write('patterns:\n')
+    for i in xrange(n):
+        f.write('    - in: ["(mean|greeting) topic%d", '
+                '"(mean|question) topic%d *"]\n'%(i, i))
+        f.write('      out: ["Nice to hear about <star>!", "I see."]\n')
+    f.close()
+
+    config = os.path.join(path, 'config.yml')
+    open(config, 'w').write('conversations: [%s]\nmeanings: [%s]\n'%(
+                                conversation, meanings))
+    return config
+
+def report(config, n, lazy):
+    start = time.time()
+    kernel = Kernel(config, lazy=lazy)
+    loaded = time.time()
+    kernel.respond(u'tell me about topic%d rockets'%(n - 1))
+    responded = time.time()
+
+    patterns = kernel._knowledge._patterns
+    loaded_size = deep_sizeof(patterns)
+    kernel.warmup()
+    regexes = sum(len(p._in or ()) + len(p._after or ()) for p in patterns)
+    size = deep_sizeof(patterns)
+
+    print 'lazy:               %s'%lazy
+    print 'patterns:           %d'%len(patterns)
+    print 'regexes:            %d'%regexes
+    print 'load time:          %.3fs'%(loaded - start)
+    print 'first response:     %.3fs'%(responded - loaded)
+    print 'memory after load:  %.1f MB'%(loaded_size/1024.0/1024.0)
+    print 'memory:             %.1f MB'%(size/1024.0/1024.0)
+    print 'memory per pattern: %d bytes'%(size/len(patterns))
+    print
+
+def main(n=10000):
+    path = tempfile.mkdtemp()
+    try:
+        config = generate(path, n)
+        report(config, n, False)
+        report(config, n, True)
+    finally:
+        shutil.rmtree(path)
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
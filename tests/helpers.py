@@ -0,0 +1,66 @@
+# -*- coding:utf-8 -*-
+"""Fixtures shared by the test modules."""
+import os
+import shutil
+import tempfile
+import unittest
+
+CONVERSATION = u'''
+patterns:
+    - in: hello
+      out: hi!
+    - in: [my name is *, call me *]
+      out: nice to meet you, <star>
+    - after: hi!
+      in: how are you
+      out: fine
+    - in: let's talk about weather
+      out: ok
+      post: {activate: weather}
+    - in: who are you
+      out: I am <botname>
+    - in: '*'
+      out: what?
+'''
+
+WEATHER = u'''
+patterns:
+    - in: is it sunny
+      out: 'yes'
+    - in: stop
+      out: bye
+      post: {deactivate: weather}
+'''
+
+class TempDirTestCase(unittest.TestCase):
+    """A test case with a temporary directory, ``path``."""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write_file(self, name, content):
+        filename = os.path.join(self.path, name)
+        open(filename, 'w').write(content)
+        return filename
+
+    def write_config(self, conversation=CONVERSATION, weather=WEATHER, 
+                     prefix=''):
+        """Writes a configuration file and returns its name. The topic 
+        "weather" is only configured if ``weather`` is informed."""
+        config = 'botname: chapolin\nconversations:\n    - %s\n'%(
+                    self.write_file(prefix + 'conversation.yml', conversation))
+        if weather is not None:
+            config += 'topics:\n    weather: [%s]\n'%(
+                    self.write_file(prefix + 'weather.yml', weather))
+        return self.write_file(prefix + 'config.yml', config)
+
+class KernelTestCase(TempDirTestCase):
+    """A test case with the configuration file ``config`` of 
+    ``CONVERSATION`` and ``WEATHER``."""
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.config = self.write_config()
@@ -0,0 +1,134 @@
+# -*- coding:utf-8 -*-
+import os
+import unittest
+
+from helpers import TempDirTestCase
+
+CONVERSATION = u'''
+patterns:
+    - in: hello
+      out: hi!
+    - in: [hi, hello]
+      out: hey
+    - in: hello
+      out: hello again
+    - in: hello
+      when: {isdefined: name}
+      out: hi <name>
+    - in: bye
+      when: {isdefined: name}
+      out: bye <name>
+    - in: bye
+      when: {isdefined: name}
+      out: see you <name>
+    - in: bye
+      out: bye
+    - in: hello
+      ignore: '!'
+      out: hi!!
+    - in: good *
+      when: {define: [x, 1]}
+      out: good
+    - in: good *
+      out: good <star>
+    - after: hi!
+      in: how are you
+      out: fine
+    - after: [hi!, hey]
+      in: how are you
+      out: fine, thanks
+    - after: hi!
+      in: how are you
+      out: very well
+    - in: '*'
+      out: what?
+    - in: thanks
+      out: you are welcome
+    - after: fine
+      in: '*'
+      out: ok
+'''
+
+WEATHER = u'''
+patterns:
+    - in: '*'
+      out: sunny
+    - in: rain
+      out: nope
+'''
+
+class TestAnalyzer(TempDirTestCase):
+    """Tests ``analyzer`` module"""
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.config = self.write_config(CONVERSATION, WEATHER)
+
+    def get_knowledge(self, **kw):
+        from aerolito.knowledge import KnowledgeBase
+        return KnowledgeBase(self.config, **kw)
+
+    def test_shadowed(self):
+        from aerolito import analyzer
+        for lazy in (False, True):
+            knowledge = self.get_knowledge(lazy=lazy)
+            assert analyzer.shadowed(knowledge._patterns) == [
+                (2, 0, 'duplicate'),
+                (3, 0, 'shadowed'),
+                (5, 4, 'duplicate'),
+                (12, 10, 'duplicate'),
+                (14, 13, 'shadowed'),
+                (15, 13, 'shadowed'),
+            ]
+            if lazy:
+                assert all(p._raw is not None for p in knowledge._patterns)
+
+    def test_analyze(self):
+        from aerolito import analyzer
+        knowledge = self.get_knowledge()
+        findings = knowledge.analyze()
+        assert len(findings) == 7
+        assert len(knowledge._patterns) == 16
+
+        group, number, pattern, shadower, kind = findings[-1]
+        assert (group, number, kind) == ('weather', 1, 'shadowed')
+        assert pattern._out[0]._value == u'nope'
+
+        text = analyzer.report(findings)
+        assert u'conversations #2 pattern hello: duplicate of pattern ' \
+               u'hello' in text
+        assert u'topic weather #1 pattern rain: shadowed by pattern ' \
+               u'(.*)' in text
+
+    def test_drop(self):
+        from aerolito.kernel import Kernel
+        knowledge = self.get_knowledge()
+        knowledge.analyze(drop=True)
+        assert len(knowledge._patterns) == 10
+        assert len(knowledge._index) == 10
+        assert len(knowledge.load_topic('weather')['patterns']) == 1
+        assert knowledge.analyze() == []
+
+        kernel = Kernel(knowledge=knowledge)
+        assert kernel.respond(u'hello') == u'hi!'
+        assert kernel.respond(u'how are you') == u'fine'
+        assert kernel.respond(u'thanks') == u'what?'
+
+    def test_drop_frozen(self):
+        from aerolito import exceptions
+        knowledge = self.get_knowledge()
+        knowledge.freeze()
+        assert len(knowledge.analyze()) == 7
+        self.assertRaises(exceptions.KnowledgeBaseFrozen, knowledge.analyze,
+                          True)
+
+    def test_storage(self):
+        from aerolito import storage
+        filename = os.path.join(self.path, 'knowledge.bin')
+        storage.save(self.config, filename, drop_shadowed=True)
+        knowledge = storage.load(filename)
+        assert len(knowledge._patterns) == 10
+        assert knowledge.analyze() == []
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+# -*- coding:utf-8 -*-
+import json
+import unittest
+
+from helpers import TempDirTestCase
+
+CONVERSATION = u'''
+patterns:
+    - in: hello
+      out: hi!
+    - after: hi!
+      in: how are you
+      out: fine
+    - in: '*'
+      out: what?
+'''
+
+class TestBatch(TempDirTestCase):
+    """Tests ``batch`` module"""
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.config = self.write_config(CONVERSATION, None)
+
+    def get_lines(self):
+        return [
+            u'{"user_id": "a", "text": "hello"}\n',
+            u'b\thello\n',
+            u'\n',
+            u'{"user_id": "a", "text": "how are you"}\n',
+            u'b\tbla\n',
+            u'c\thow are you\n',
+        ]
+
+    def test_parse_line(self):
+        from aerolito.batch import parse_line
+        assert parse_line(u'{"user_id": 1, "text": "hi"}\n') == \
+                                                        (1, u'hi', 'jsonl')
+        assert parse_line(u'1\thi\tthere\r\n') == (u'1', u'hi\tthere', 'tsv')
+        assert parse_line(u'   \n') is None
+
+    def test_parse_line_badvalue(self):
+        from aerolito.batch import parse_line
+        from aerolito.exceptions import InvalidBatchLine
+        self.assertRaises(InvalidBatchLine, parse_line, u'no tab here')
+        self.assertRaises(InvalidBatchLine, parse_line, u'{"text": "hi"}')
+        self.assertRaises(InvalidBatchLine, parse_line, u'a\tb', 'jsonl')
+
+    def test_run_serial(self):
+        from aerolito import batch
+        results = list(batch.run(self.config, self.get_lines()))
+
+        assert len(results) == 5
+        assert json.loads(results[0])['response'] == u'hi!'
+        assert results[1] == u'b\thello\thi!'
+        assert json.loads(results[2])['response'] == u'fine'
+        assert results[3] == u'b\tbla\twhat?'
+        assert results[4] == u'c\thow are you\twhat?'
+
+    def test_run_parallel(self):
+        from aerolito import batch
+        lines = self.get_lines()*20
+        serial = list(batch.run(self.config, lines))
+        parallel = list(batch.run(self.config, lines, workers=3, window=4))
+
+        assert serial == parallel
+
+    def test_max_users(self):
+        from aerolito import batch
+        from aerolito.kernel import Kernel
+        kernel = Kernel(self.config)
+        users = batch.UserLimit(kernel, 2)
+        for user_id in (u'a', u'b', u'a', u'c', u'd'):
+            batch.respond(kernel, user_id, u'hello', users=users)
+
+        sessions = kernel._environ['session']
+        assert len(users) == 2
+        assert u'c' in sessions and u'd' in sessions
+        assert u'a' not in sessions and u'b' not in sessions
+
+        lines = [u'%d\thello\n'%i for i in xrange(10)] + [u'0\thow are you\n']
+        results = list(batch.run(self.config, lines, max_users=5))
+        assert results[-1] == u'0\thow are you\twhat?'
+        results = list(batch.run(self.config, lines, max_users=20))
+        assert results[-1] == u'0\thow are you\tfine'
+
+    def test_protect_shared_pages(self):
+        import gc
+        from aerolito.knowledge import protect_shared_pages
+        threshold = gc.get_threshold()
+        try:
+            protect_shared_pages()
+            assert gc.get_threshold()[:2] == threshold[:2]
+            assert gc.get_threshold()[2] > 1000000
+        finally:
+            gc.set_threshold(*threshold)
+
+    def test_worker_failed(self):
+        from aerolito import batch
+        from aerolito.exceptions import BatchWorkerFailed
+        def handle(state, user_id, text):
+            return 1/int(text)
+
+        records = [(u'a', u'1'), (u'b', u'0'), (u'c', u'2')]
+        try:
+            list(batch.parallel(lambda: None, handle, records, workers=2))
+        except BatchWorkerFailed, e:
+            assert 'ZeroDivisionError' in str(e)
+        else:
+            self.fail('BatchWorkerFailed not raised')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+# -*- coding:utf-8 -*-
+import random
+import unittest
+
+from helpers import KernelTestCase
+
+class TestDistance(unittest.TestCase):
+    def test_distance(self):
+        from aerolito.fuzzy import distance
+        assert distance(u'hello', u'hello') == 0
+        assert distance(u'helo', u'hello') == 1
+        assert distance(u'kitten', u'sitting') == 3
+        assert distance(u'sunyn', u'sunny') == 1
+        assert distance(u'ca', u'abc') == 2
+        assert distance(u'', u'abc') == 3
+        assert distance(u'kitten', u'sitting', 1) == 2
+        assert distance(u'a', u'abcdef', 2) == 3
+
+class TestBKTree(unittest.TestCase):
+    def test_search(self):
+        from aerolito.fuzzy import BKTree, distance
+        rand = random.Random(1)
+        words = set(u''.join(rand.choice(u'abcde') 
+                    for i in xrange(rand.randint(1, 6))) for j in xrange(300))
+        tree = BKTree(words)
+        assert len(tree) == len(words)
+
+        for word in (u'abc', u'eeee', u'abcdea', u'x'):
+            for limit in (0, 1, 2):
+                expected = sorted((distance(word, w), w) for w in words 
+                                  if distance(word, w) <= limit)
+                assert tree.search(word, limit) == expected
+
+class TestCorrect(unittest.TestCase):
+    def get_vocabulary(self, *texts):
+        from aerolito.pattern import Pattern
+        from aerolito.fuzzy import Vocabulary
+        environ = {'synonyms': {}, 'meanings': {}}
+        return Vocabulary([Pattern({'in': text, 'out': u'x'}, environ, lazy)
+                           for lazy in (False, True) for text in texts])
+
+    def test_vocabulary(self):
+        vocabulary = self.get_vocabulary(u'Hello there', u'my name is *')
+        assert len(vocabulary) == 5
+        assert u'hello' in vocabulary
+        assert u'*' not in vocabulary
+
+    def test_vocabulary_remove(self):
+        from aerolito.pattern import Pattern
+        from aerolito.fuzzy import Vocabulary
+        environ = {'synonyms': {}, 'meanings': {}}
+        hello, there, weather = [Pattern({'in': text, 'out': u'x'}, environ)
+                        for text in (u'hello', u'hello there', u'weather')]
+        vocabulary = Vocabulary([hello, there], removable=True)
+        vocabulary.add(weather)
+        assert vocabulary.search(u'wether', 1) == [(1, u'weather')]
+
+        vocabulary.remove(there)
+        assert u'there' not in vocabulary
+        assert vocabulary.search(u'helo', 1) == [(1, u'hello')]
+        vocabulary.remove(weather)
+        assert vocabulary.search(u'wether', 1) == []
+        vocabulary.remove(hello)
+        assert len(vocabulary) == 0
+        assert len(vocabulary._tree) == 0
+
+    def test_correct(self):
+        from aerolito.fuzzy import correct
+        vocabulary = self.get_vocabulary(u'hello there', u'is it sunny', 
+                                         u'weather')
+        assert correct(u'helo there', [vocabulary]) == u'hello there'
+        assert correct(u'hello there', [vocabulary]) is None
+        assert correct(u'is it sunyn?', [vocabulary]) == u'is it sunny?'
+        assert correct(u'wheater', [vocabulary]) == u'weather'
+        # short words are not corrected, long ones within one edit by 3 letters
+        assert correct(u'iz it sunny', [vocabulary]) is None
+        assert correct(u'hxlxo', [vocabulary]) is None
+        assert correct(u'wxathxr', [vocabulary]) == u'weather'
+        assert correct(u'wxathxr', [vocabulary], 1) is None
+
+class TestKernelFuzzy(KernelTestCase):
+    def get_kernel(self, *args, **kw):
+        from aerolito.kernel import Kernel
+        return Kernel(self.config, *args, **kw)
+
+    def test_disabled(self):
+        kernel = self.get_kernel()
+        assert kernel.respond(u'helo') == u'what?'
+
+    def test_respond(self):
+        kernel = self.get_kernel(fuzzy=True)
+        assert kernel.respond(u'helo') == u'hi!'
+        assert kernel.respond(u'my nmae is renato') == \
+                                            u'nice to meet you, renato'
+        assert kernel.respond(u'xyzzy') == u'what?'
+        assert kernel.respond(u'blah blah') == u'what?'
+        assert kernel._environ['session']['default']['stars'] == \
+                                            [u'blah blah']
+
+    def test_topics(self):
+        kernel = self.get_kernel(fuzzy=True)
+        assert kernel.respond(u'is it snuny') == u'what?'
+        kernel.respond(u"let's talk about weather")
+        assert kernel.respond(u'is it snuny') == u'yes'
+
+    def test_kernel_patterns(self):
+        kernel = self.get_kernel(fuzzy=True)
+        assert kernel.respond(u'goodbye') == u'what?'
+        first = kernel.add_pattern({'in': u'goodbye', 'out': u'bye!'}, 0)
+        assert kernel.respond(u'godbye') == u'bye!'
+
+        vocabulary = kernel._vocabulary
+        patterns = kernel._patterns
+        kernel.add_pattern({'in': u'farewell', 'out': u'bye!'}, 0)
+        assert kernel.respond(u'farewel') == u'bye!'
+        kernel.remove_pattern(first)
+        assert kernel.respond(u'godbye') == u'what?'
+        assert kernel._vocabulary is vocabulary
+        assert kernel._patterns is patterns
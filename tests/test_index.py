@@ -0,0 +1,120 @@
+# -*- coding:utf-8 -*-
+import unittest
+
+class TestIndexKey(unittest.TestCase):
+    """Tests ``index.index_key`` function"""
+
+    def get_target(self, *args, **kw):
+        from aerolito.index import index_key
+        return index_key(*args, **kw)
+
+    def test_exact(self):
+        assert self.get_target(u'Hello') == (u'hello', True)
+        assert self.get_target(u'hello there') == (u'hello', True)
+        assert self.get_target(u'hello there *') == (u'hello', True)
+        assert self.get_target(u'hello \\*') == (u'hello', True)
+
+    def test_prefix(self):
+        assert self.get_target(u'hello*') == (u'hello', False)
+        assert self.get_target(u'hello   *') == (u'hello', False)
+        assert self.get_target(u'hello * there') == (u'hello', False)
+
+    def test_not_indexed(self):
+        assert self.get_target(u'* hello') is None
+        assert self.get_target(u' hello') is None
+        assert self.get_target(u'\\* hello') is None
+        assert self.get_target(u'hello\\* there') is None
+        assert self.get_target(u'') is None
+
+    def test_index_keys(self):
+        from aerolito.index import index_keys
+        assert index_keys([u'hi', u'hello *', u'hi there']) == \
+                                            [(u'hello', False), (u'hi', True)]
+        assert index_keys([u'hi', u'* hello']) is None
+        assert index_keys(None) is None
+
+class TestPatternIndex(unittest.TestCase):
+    """Tests ``index.PatternIndex`` class"""
+
+    def get_target(self, *args, **kw):
+        from aerolito.index import PatternIndex
+        return PatternIndex(*args, **kw)
+
+    def get_stub_pattern(self, keys, ignore=None):
+        class Pattern: pass
+        pattern = Pattern()
+        pattern._keys = keys
+        pattern._ignore = ignore
+        return pattern
+
+    def test_candidates(self):
+        index = self.get_target()
+        patterns = [
+            self.get_stub_pattern([(u'hello', True)]),
+            self.get_stub_pattern(None),
+            self.get_stub_pattern([(u'hel', False), (u'hello', True)]),
+            self.get_stub_pattern([(u'bye', True)]),
+            self.get_stub_pattern([(u'hello', False)]),
+        ]
+        for pattern in patterns:
+            index.add(pattern)
+
+        assert len(index) == 5
+        result = list(index.candidates(u'Hello there'))
+        assert result == [patterns[0], patterns[1], patterns[2], patterns[4]]
+
+        result = list(index.candidates(u'helloworld'))
+        assert result == [patterns[1], patterns[2], patterns[4]]
+
+        result = list(index.candidates(u'bye'))
+        assert result == [patterns[1], patterns[3]]
+
+        result = list(index.candidates(u''))
+        assert result == [patterns[1]]
+
+    def test_insert_remove(self):
+        index = self.get_target()
+        first = self.get_stub_pattern([(u'hello', True)])
+        last = self.get_stub_pattern(None)
+        middle = self.get_stub_pattern([(u'hel', False), (u'hello', True)])
+
+        order1 = index.add(first)
+        order2 = index.add(last)
+        order3 = index.add(middle, (order1 + order2)//2)
+
+        candidates = index.candidates(u'hello')
+        assert candidates.next() is first
+        index.remove(first, order1)
+        assert list(candidates) == [middle, last]
+
+        assert len(index) == 2
+        assert list(index.candidates(u'hello')) == [middle, last]
+
+        index.remove(middle, order3)
+        assert list(index.candidates(u'hello')) == [last]
+        assert index._exact == {} and index._prefix == {}
+
+    def test_ignore_groups(self):
+        index = self.get_target()
+        patterns = [
+            self.get_stub_pattern([(u'hello', True)], u','),
+            self.get_stub_pattern([(u'hello', True)]),
+            self.get_stub_pattern([(u'hithere', True)], u' -'),
+            self.get_stub_pattern([(u'hel', False)], u','),
+        ]
+        for pattern in patterns:
+            index.add(pattern)
+
+        cache = {}
+        assert list(index.candidates(u'hel,lo there', cache)) == \
+                                            [patterns[0], patterns[3]]
+        assert list(index.candidates(u'hello', cache)) == \
+                                    [patterns[0], patterns[1], patterns[3]]
+        assert list(index.candidates(u'hi there', cache)) == [patterns[2]]
+        assert cache[('ignore', u',', u'hel,lo there')] == u'hello there'
+
+        index.remove(patterns[0], 0)
+        assert list(index.candidates(u'hel,lo')) == [patterns[3]]
+
+if __name__ == '__main__':
+    unittest.main()
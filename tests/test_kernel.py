@@ -1,14 +1,626 @@
 # -*- coding:utf-8 -*-
+import os
 import unittest
 
-class TestKernel(unittest.TestCase):
+from helpers import KernelTestCase, CONVERSATION, WEATHER
+
+class TestKernel(KernelTestCase):
     def getTarget(self, *args, **kw):
         from aerolito.kernel import Kernel
         return Kernel(*args, **kw)
 
     def test_init(self):
-        pass
+        kernel = self.getTarget(self.config)
+
+        assert len(kernel._knowledge._patterns) == 6
+        assert len(kernel._knowledge._index) == 6
+        assert 'default' in kernel._environ['session']
+
+    def test_respond(self):
+        kernel = self.getTarget(self.config)
+
+        assert kernel.respond(u'Hello') == u'hi!'
+        assert kernel.respond(u'how are you') == u'fine'
+        assert kernel.respond(u'how are you') == u'what?'
+        assert kernel.respond(u'call me Renato') == u'nice to meet you, Renato'
+
+    def test_respond_lazy(self):
+        kernel = self.getTarget(self.config, lazy=True)
+        assert all(p._raw is not None for p in kernel._knowledge._patterns)
+
+        assert kernel.respond(u'Hello') == u'hi!'
+        assert kernel._knowledge._patterns[0]._raw is None
+        assert kernel._knowledge._patterns[1]._raw is not None
+        assert kernel.respond(u'how are you') == u'fine'
+
+    def test_topics(self):
+        kernel = self.getTarget(self.config)
+        session = kernel._environ['session']['default']
+        assert kernel._knowledge._topics['weather']['patterns'] is None
+
+        assert kernel.respond(u'is it sunny') == u'what?'
+        assert kernel.respond(u"let's talk about weather") == u'ok'
+        assert session['topics'] == ['weather']
+        assert kernel.respond(u'is it sunny') == u'yes'
+        assert len(kernel._knowledge._topics['weather']['patterns']) == 2
+
+        assert kernel.respond(u'stop') == u'bye'
+        assert session['topics'] == []
+        assert kernel.respond(u'is it sunny') == u'what?'
+
+    def test_topic_not_found(self):
+        from aerolito.exceptions import TopicNotFound
+        kernel = self.getTarget(self.config)
+        self.assertRaises(TopicNotFound, kernel._knowledge.load_topic, 'sports')
+
+    def test_shared_knowledge(self):
+        from aerolito.knowledge import KnowledgeBase
+        knowledge = KnowledgeBase(self.config)
+        kernel1 = self.getTarget(knowledge=knowledge)
+        kernel2 = self.getTarget(knowledge=knowledge, 
+                                 globals={'botname': 'chaves'})
+
+        assert kernel1.respond(u'who are you') == u'I am chapolin'
+        assert kernel2.respond(u'who are you') == u'I am chaves'
+        assert knowledge._config['botname'] == 'chapolin'
+
+        assert kernel1.respond(u"let's talk about weather") == u'ok'
+        assert kernel1.respond(u'is it sunny') == u'yes'
+        assert kernel2.respond(u'is it sunny') == u'what?'
+
+    def test_load_conversation(self):
+        from aerolito.knowledge import KnowledgeBase
+        knowledge = KnowledgeBase(self.config)
+        kernel1 = self.getTarget(knowledge=knowledge)
+        kernel2 = self.getTarget(knowledge=knowledge)
+        kernel1.load_conversation(self.write_file('extra.yml', 
+                        'patterns:\n    - {in: bye, out: see you}\n'))
+
+        assert len(kernel1._patterns) == 1
+        assert len(kernel2._patterns) == 0
+        assert kernel1.respond(u'bye') == u'see you'
+        assert kernel1.respond(u'Hello') == u'hi!'
+        assert kernel2.respond(u'bye') == u'what?'
+
+    def test_locals(self):
+        kernel = self.getTarget(self.config)
+        kernel.load_conversation(self.write_file('locals.yml', 
+                        'patterns:\n'
+                        '    - {in: remember me, out: ok, '
+                        'post: {define: [known, "yes"]}}\n'
+                        '    - {in: do you know me, out: "yes", '
+                        'when: {isdefined: known}}\n'))
+
+        assert kernel._patterns[1]._requires
+        assert kernel.respond(u'do you know me') == u'what?'
+        assert kernel.respond(u'remember me') == u'ok'
+        assert kernel.respond(u'do you know me') == u'yes'
+
+    def test_conditions_order(self):
+        kernel = self.getTarget(self.config)
+        kernel.load_conversation(self.write_file('order.yml', 
+                        'patterns:\n'
+                        '    - {in: define x, out: defined, '
+                        'when: [{isnotdefined: y}, {define: [x, 1]}, '
+                        '{isdefined: x}]}\n'))
+
+        pattern = kernel._patterns[0]
+        assert len(pattern._requires) == 1
+        assert [a._name for a in pattern._when] == ['define', 'isdefined']
+        assert kernel.respond(u'define x') == u'defined'
+
+    def get_counter(self, kernel, **kw):
+        from aerolito.directives import Directive
+        calls = []
+        class Lookup(Directive):
+            def run(self, key):
+                calls.append(key)
+                return False
+
+        kernel.add_directive('lookup', Lookup, **kw)
+        kernel.load_conversation(self.write_file('lookup.yml', 
+                        'patterns:\n'
+                        '    - {in: check *, out: a, when: {lookup: x}}\n'
+                        '    - {in: check it, out: b, when: {lookup: x}}\n'
+                        '    - {in: check it, out: c, when: {lookup: y}}\n'))
+        return calls
+
+    def test_pure_directive(self):
+        kernel = self.getTarget(self.config)
+        calls = self.get_counter(kernel, pure=True)
+
+        assert kernel.respond(u'check it') == u'what?'
+        assert calls == ['x', 'y']
+        assert kernel.respond(u'check it') == u'what?'
+        assert calls == ['x', 'y', 'x', 'y']
+        assert kernel._environ['request'] is None
+
+    def test_ttl_directive(self):
+        kernel = self.getTarget(self.config)
+        calls = self.get_counter(kernel, ttl=60)
 
+        assert kernel.respond(u'check it') == u'what?'
+        assert kernel.respond(u'check it') == u'what?'
+        assert calls == ['x', 'y']
+
+    def test_ttl_eviction(self):
+        from aerolito import directives
+        kernel = self.getTarget(self.config)
+        calls = self.get_counter(kernel, ttl=60)
+        cache = kernel._environ['cache']
+        cache.update((('expired', i), (0, None)) for i in xrange(4))
+
+        size = directives._cache_size
+        directives._cache_size = 4
+        try:
+            assert kernel.respond(u'check it') == u'what?'
+        finally:
+            directives._cache_size = size
+        assert calls == ['x', 'y']
+        assert len(cache) == 2
+
+    def test_method_directive(self):
+        calls = []
+        class Lookup(object):
+            def __init__(self, environ):
+                self.environ = environ
+            def lookup(self, params):
+                calls.append(params[0])
+                return False
+
+        kernel = self.getTarget(self.config)
+        kernel.add_directive('lookup', lambda environ: Lookup(environ).lookup, 
+                             pure=True)
+        kernel.load_conversation(self.write_file('lookup.yml', 
+                        'patterns:\n'
+                        '    - {in: check *, out: a, when: {lookup: x}}\n'
+                        '    - {in: check it, out: b, when: {lookup: x}}\n'))
+
+        assert kernel.respond(u'check it') == u'what?'
+        assert calls == ['x']
+
+    def test_directive_timeout(self):
+        import threading
+        from aerolito.directives import Directive
+        release = threading.Event()
+        class Slow(Directive):
+            timeout = 0.05
+            def run(self, value):
+                release.wait(5)
+                return True
+
+        kernel = self.getTarget(self.config)
+        kernel.add_directive('slow', Slow)
+        kernel.add_directive('notify', Slow, on_timeout=True)
+        kernel.load_conversation(self.write_file('slow.yml', 
+                        'patterns:\n'
+                        '    - {in: check it, out: a, when: {slow: x}}\n'
+                        '    - {in: check it, out: b, post: {slow: x}}\n'
+                        '    - {in: check this, out: c, when: {notify: x}}\n'))
+
+        assert kernel.respond(u'check it') == u'b'
+        assert kernel.respond(u'check this') == u'c'
+        release.set()
+
+        stats = kernel.directive_stats()
+        assert stats['slow']['calls'] == 2
+        assert stats['slow']['timeouts'] == 2
+        assert stats['notify']['timeouts'] == 1
+        assert 0.05 <= stats['slow']['max'] < 1
+
+    def test_directive_timeout_saturated(self):
+        import threading
+        from multiprocessing.pool import ThreadPool
+        from aerolito.directives import Directive
+        release = threading.Event()
+        class Hang(Directive):
+            timeout = 0.05
+            def run(self, value):
+                release.wait(5)
+                return True
+
+        class Fast(Directive):
+            timeout = 0.05
+            def run(self, value):
+                return True
+
+        executor = ThreadPool(1)
+        kernel = self.getTarget(self.config, executor=executor)
+        kernel.add_directive('hang', Hang)
+        kernel.add_directive('fast', Fast)
+        kernel.load_conversation(self.write_file('hang.yml', 
+                        'patterns:\n'
+                        '    - {in: hang, out: a, when: {hang: x}}\n'
+                        '    - {in: fast, out: b, when: {fast: x}}\n'))
+
+        assert kernel.respond(u'hang') == u'what?'
+        assert kernel.directive_stats()['hang']['running'] == 1
+        # The only thread is held, so the fast directive times out
+        assert kernel.respond(u'fast') == u'what?'
+        assert kernel.directive_stats()['fast']['timeouts'] == 1
+
+        release.set()
+        executor.close()
+        executor.join()
+        stats = kernel.directive_stats()
+        assert stats['hang']['running'] == 0
+        assert stats['fast']['running'] == 0
+        assert 'aerolito_directive_running{directive="hang"} 0' in \
+               kernel.metrics_text()
+
+    def test_directive_timeout_session(self):
+        import threading
+        from aerolito.directives import Directive
+        release = threading.Event()
+        done = threading.Event()
+        class Remember(Directive):
+            timeout = 0.05
+            def run(self, name, wait):
+                if wait:
+                    release.wait(5)
+                self.session()['locals'][name] = u'yes'
+                done.set()
+                return True
+
+        kernel = self.getTarget(self.config)
+        kernel.add_directive('remember', Remember)
+        kernel.load_conversation(self.write_file('remember.yml', 
+                        'patterns:\n'
+                        '    - {in: slow, out: ok, '
+                        'post: {remember: [slow, 1]}}\n'
+                        '    - {in: fast, out: ok, '
+                        'post: {remember: [fast, ""]}}\n'))
+
+        assert kernel.respond(u'slow') == u'ok'
+        done.clear()
+        release.set()
+        done.wait(5)
+        assert done.is_set()
+        assert kernel.respond(u'fast') == u'ok'
+        session = kernel._environ['session']['default']
+        assert session['locals'] == {'fast': u'yes'}
+
+    def test_resources(self):
+        from aerolito.directives import Directive
+        class Known(Directive):
+            def run(self, name):
+                return name in self.resource('names')
+
+        self.write_file('names.txt', 'Renato\n')
+        config = self.write_file('resources.yml', open(self.config).read() + 
+                    'resources:\n    names: {type: lines, file: %s}\n'%
+                    os.path.join(self.path, 'names.txt'))
+
+        with self.getTarget(config) as kernel:
+            kernel.add_directive('known', Known)
+            kernel.load_conversation(self.write_file('known.yml', 
+                            'patterns:\n'
+                            '    - {in: i am *, out: hi, '
+                            'when: {known: <star>}}\n'))
+
+            assert kernel.respond(u'i am Renato') == u'hi'
+            assert kernel.respond(u'i am Bozo') == u'what?'
+            assert 'names' in kernel._resources._resources
+
+        assert kernel._resources._resources == {}
+
+    def test_add_pattern(self):
+        from aerolito.exceptions import PatternNotFound
+        kernel = self.getTarget(self.config)
+        ids = kernel.load_conversation(self.write_file('extra.yml', 
+                        'patterns:\n    - {in: bye, out: see you}\n'))
         
+        first = kernel.add_pattern({'in': 'bye', 'out': 'first'}, position=0)
+        last = kernel.add_pattern({'in': 'bye', 'out': 'last'})
+        assert kernel.respond(u'bye') == u'first'
+
+        kernel.remove_pattern(first)
+        assert kernel.respond(u'bye') == u'see you'
+        kernel.remove_pattern(ids[0])
+        assert kernel.respond(u'bye') == u'last'
+        kernel.remove_pattern(last)
+        assert kernel.respond(u'bye') == u'what?'
+        assert kernel._patterns == []
+
+        self.assertRaises(PatternNotFound, kernel.remove_pattern, last)
+
+    def test_add_pattern_reindex(self):
+        kernel = self.getTarget(self.config)
+        kernel.add_pattern({'in': 'bye', 'out': 'first'})
+        kernel.add_pattern({'in': 'bye', 'out': 'last'})
+        for i in xrange(40):
+            kernel.add_pattern({'in': 'bye %d'%i, 'out': str(i)}, position=1)
+
+        assert kernel._orders == sorted(kernel._orders)
+        assert [p._out[0]._value for p in kernel._patterns][:3] == \
+               [u'first', u'39', u'38']
+        assert kernel.respond(u'bye 0') == u'0'
+        assert kernel.respond(u'bye') == u'first'
+
+    def test_ignore(self):
+        kernel = self.getTarget(self.config)
+        kernel.add_pattern({'in': 'hey there', 'ignore': ',!', 'out': 'a'})
+        kernel.add_pattern({'in': 'hey, you', 'ignore': [',', '!'], 
+                            'out': 'b'})
+        assert len(kernel._index._groups) == 1
+        assert kernel.respond(u'hey, there!') == u'a'
+        assert kernel.respond(u'hey you!!') == u'b'
+        assert kernel.respond(u'hey') == u'what?'
+
+    def test_match_all(self):
+        kernel = self.getTarget(self.config)
+        kernel.add_pattern({'in': 'my *', 'out': 'a', 
+                            'when': {'define': ['name', '<star>']}})
+        kernel.add_pattern({'in': 'my *', 'out': 'b', 
+                            'when': {'isdefined': 'name'}})
+        kernel.respond(u'hello', 'renato')
+        session = kernel._environ['session']['renato']
+        stars = session['stars']
+
+        matches = kernel.match_all(u'my name is Renato', 'renato')
+        assert [(p._out[0]._value, s) for p, s in matches] == [
+            (u'a', [u'name is Renato']),
+            (u'nice to meet you, <star>', [u'Renato']),
+            (u'what?', [u'my name is Renato']),
+        ]
+        assert kernel.match_all(u'my name is Renato', 'renato', limit=1) == \
+               matches[:1]
+
+        assert session['locals'] == {}
+        assert session['stars'] is stars
+        assert session['inputs'] == [u'hello']
+        assert len(kernel._environ['session']) == 2
+        assert kernel._environ['user_id'] == 'renato'
+
+        assert len(kernel.match_all(u'hello', 'unknown')) == 2
+        assert 'unknown' not in kernel._environ['session']
+        assert all('unknown' not in locks 
+                   for x, locks, y in kernel._environ['session']._shards)
+
+    def test_match_all_sessions(self):
+        from aerolito.directives import Directive
+        kernel = self.getTarget(self.config)
+        seen = []
+        class Users(Directive):
+            def run(self, value):
+                seen.append((sorted(kernel._environ['session'].keys()),
+                             kernel.export_sessions()))
+                self.session()['locals']['x'] = value
+                return True
+
+        kernel.add_directive('users', Users)
+        kernel.add_pattern({'in': 'users', 'out': 'ok', 'when': {'users': 1}})
+        kernel.respond(u'hello', 'renato')
+        exported = kernel.export_sessions()
+
+        assert len(kernel.match_all(u'users', 'renato')) == 2
+        assert seen == [(['default', 'renato'], exported)]
+        assert kernel._environ['session']['renato']['locals'] == {}
+
+    def test_reload(self):
+        from aerolito.directives import Directive
+        kernel = self.getTarget(self.config, globals={'botname': 'chaves'})
+        class Reload(Directive):
+            def run(self, value):
+                kernel.reload()
+                return False
+
+        kernel.add_directive('reload', Reload)
+        kernel.add_pattern({'in': 'reload', 'out': 'ok', 
+                            'when': {'reload': 'x'}})
+        assert kernel.respond(u'Hello') == u'hi!'
+        old = kernel._knowledge
+
+        self.write_file('conversation.yml', 
+                        CONVERSATION.replace('what?', 'huh?'))
+        assert kernel.respond(u'reload') == u'what?'
+        assert kernel._knowledge is not old
+        assert kernel.respond(u'how are you') == u'huh?'
+        assert kernel.respond(u'who are you') == u'I am chaves'
+
+    def test_swap_snapshot(self):
+        from aerolito.directives import Directive
+        from aerolito.kernel import KnowledgeBase
+        kernel = self.getTarget(self.config)
+        other = KnowledgeBase(self.write_file('other.yml', 
+                    open(self.config).read().replace('chapolin', 'chaves')))
+        class Swap(Directive):
+            def run(self, value):
+                kernel.swap_knowledge(other)
+                return False
+
+        kernel.add_directive('swap', Swap)
+        kernel.add_pattern({'in': 'who are you', 'out': 'nope', 
+                            'when': {'swap': 'x'}})
+        assert kernel.respond(u'who are you') == u'I am chapolin'
+        assert kernel._knowledge is other
+        assert kernel.respond(u'Hello') == u'hi!'
+        assert kernel._environ['globals']['botname'] == 'chaves'
+
+    def test_reload_background(self):
+        kernel = self.getTarget(self.config)
+        assert kernel.respond(u'Hello') == u'hi!'
+        self.write_file('conversation.yml', 
+                        CONVERSATION.replace('fine', 'great'))
+
+        kernel.reload(background=True).join()
+        assert kernel.respond(u'how are you') == u'great'
+
+    def test_watch(self):
+        from aerolito.watcher import Watcher
+        kernel = self.getTarget(self.config)
+        watcher = Watcher(kernel)
+        assert not watcher.check()
+
+        filename = self.write_file('weather.yml', WEATHER.replace('bye', 'ok'))
+        os.utime(filename, (0, 0))
+        assert watcher.check()
+        assert watcher.reloads == 1
+
+        self.write_file('conversation.yml', 'patterns: [')
+        assert not watcher.check()
+        assert watcher.error is not None
+        assert kernel.respond(u'Hello') == u'hi!'
+
+        kernel.watch(interval=0.01).stop()
+
+    def test_threads(self):
+        import threading
+        kernel = self.getTarget(self.config)
+        kernel.load_conversation(self.write_file('locals.yml', 
+                        'patterns:\n'
+                        '    - {in: i am *, out: ok, '
+                        'post: {define: [name, <star>]}}\n'
+                        '    - {in: who am i, out: <name>, '
+                        'when: {isdefined: name}}\n'))
+
+        errors = []
+        def run(i):
+            for j in xrange(50):
+                user_id = 'user%d'%i
+                name = u'name%d'%(i*100 + j)
+                if kernel.respond(u'i am %s'%name, user_id) != u'ok' or \
+                   kernel.respond(u'Hello', user_id) != u'hi!' or \
+                   kernel.respond(u'how are you', user_id) != u'fine' or \
+                   kernel.respond(u'who am i', user_id) != name:
+                    errors.append(user_id)
+        threads = [threading.Thread(target=run, args=(i,)) for i in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert len(kernel._environ['session']) == 9
+        assert kernel._environ['user_id'] == 'default'
+
+    def test_freeze(self):
+        from aerolito.exceptions import KnowledgeBaseFrozen
+        kernel = self.getTarget(self.config, lazy=True)
+        kernel.freeze()
+
+        knowledge = kernel._knowledge
+        assert len(knowledge._topics['weather']['patterns']) == 2
+        assert sorted(knowledge._vocabularies) == ['', 'weather']
+        for pattern in knowledge._patterns:
+            assert pattern._raw is None
+            assert all(r._regex is not None for r in pattern._in)
+
+        self.assertRaises(KnowledgeBaseFrozen, kernel.load_conversation, 
+                          'extra.yml')
+        self.assertRaises(KnowledgeBaseFrozen, knowledge.load_conversation, 
+                          'extra.yml')
+
+        assert kernel.respond(u'call me Renato') == u'nice to meet you, Renato'
+        assert all(r._stars is None for r in knowledge._patterns[1]._in)
+
+    def test_warmup(self):
+        kernel = self.getTarget(self.config, lazy=True)
+        kernel.warmup(background=True).join()
+
+        assert all(p._raw is None for p in kernel._knowledge._patterns)
+
+    def test_export_session(self):
+        from aerolito.knowledge import KnowledgeBase
+        knowledge = KnowledgeBase(self.config)
+        kernel1 = self.getTarget(knowledge=knowledge)
+        kernel2 = self.getTarget(knowledge=knowledge)
+
+        assert kernel1.respond(u"let's talk about weather", 'default') == u'ok'
+        assert kernel1.respond(u'Hello') == u'hi!'
+        kernel1._environ['session']['default']['locals']['name'] = u'Renato'
+
+        assert kernel2.import_session(kernel1.export_session('default')) == \
+               'default'
+        session = kernel2._environ['session']['default']
+        assert session['topics'] == ['weather']
+        assert session['locals'] == {'name': u'Renato'}
+        assert session['inputs'] == [u'Hello']
+        assert kernel2.respond(u'how are you') == u'fine'
+        assert kernel2.respond(u'is it sunny') == u'yes'
+
+    def test_export_sessions(self):
+        from aerolito.exceptions import UserNotInSession
+        kernel1 = self.getTarget(self.config)
+        kernel2 = self.getTarget(self.config)
+        for user_id in xrange(100):
+            kernel1.add_user(user_id)
+            kernel1.respond(u'call me %d'%user_id, user_id)
+
+        user_ids = kernel2.import_sessions(kernel1.export_sessions())
+        assert sorted(user_ids) == range(100) + ['default']
+        assert kernel2._environ['session'][42]['stars'] == [u'42']
+
+        self.assertRaises(UserNotInSession, kernel1.export_session, 'nobody')
+
+    def test_export_concurrent(self):
+        import sys
+        import threading
+        from aerolito.directives import Directive
+        from aerolito.session import load_session
+        class Fill(Directive):
+            def run(self, value):
+                variables = self.session()['locals']
+                variables.clear()
+                for i in xrange(200):
+                    variables['v%d'%i] = value
+                return True
+
+        kernel = self.getTarget(self.config)
+        kernel.add_directive('fill', Fill)
+        kernel.add_pattern({'in': 'fill *', 'out': 'ok', 
+                            'post': {'fill': '<star>'}})
+
+        errors = []
+        done = threading.Event()
+        def export():
+            try:
+                while not done.is_set():
+                    user_id, session = load_session(
+                                            kernel.export_session('default'))
+                    assert len(set(session['locals'].values())) <= 1
+            except Exception, e:
+                errors.append(e)
+
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        thread = threading.Thread(target=export)
+        thread.start()
+        try:
+            for i in xrange(200):
+                kernel.respond(u'fill %d'%i)
+        finally:
+            done.set()
+            thread.join()
+            sys.setcheckinterval(interval)
+
+        assert errors == []
+
+    def test_import_session_topics(self):
+        from aerolito.exceptions import TopicNotFound
+        kernel = self.getTarget(self.config)
+        kernel._environ['session']['default']['topics'].append('sports')
+        data = kernel.export_session('default')
+
+        self.assertRaises(TopicNotFound, kernel.import_session, data)
+
+    def test_meanings_ascii(self):
+        meanings = self.write_file('meanings.yml', 'greeting: [hey, hi there]\n')
+        conversation = self.write_file('meanings-conversation.yml', 
+                'patterns:\n'
+                '    - in: (mean|greeting) (mean|bye)\n'
+                '      mean: {bye: [later, see you]}\n'
+                '      out: bye!\n'
+                '    - in: "*"\n'
+                '      out: what?\n')
+        config = self.write_file('meanings-config.yml', 
+                'conversations: [%s]\nmeanings: [%s]\n'%(conversation,
+                                                          meanings))
+        kernel = self.getTarget(config)
+
+        assert kernel.respond('hey later') == u'bye!'
+        assert kernel.respond(u'hi there see you') == u'bye!'
+        assert kernel.respond('hello') == u'what?'
+
 if __name__ == '__main__':
     unittest.main()
@@ -12,6 +12,13 @@ class TestLiteral(unittest.TestCase):
         literal = self.get_target(u'Hello <name>!')
         assert literal._value == u'Hello <name>!'
 
+    def test_make_literal(self):
+        from aerolito.pattern import make_literal
+        literal = make_literal(u'Hello <name>!')
+        assert literal is make_literal(u'Hello <name>!')
+        assert literal is not make_literal(u'Hello!')
+        assert make_literal(1) is not make_literal(True)
+        assert make_literal([1, 2])._value == [1, 2]
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,104 @@
+# -*- coding:utf-8 -*-
+import urllib2
+import unittest
+
+from helpers import TempDirTestCase, CONVERSATION
+
+class TestHistogram(unittest.TestCase):
+    def get_target(self, *args, **kw):
+        from aerolito.metrics import Histogram
+        return Histogram(*args, **kw)
+
+    def test_lines(self):
+        histogram = self.get_target((1, 5))
+        for value in (0, 1, 3, 10):
+            histogram.observe(value)
+
+        assert histogram.lines('test', 'a="b"') == [
+            'test_bucket{a="b",le="1.0"} 2',
+            'test_bucket{a="b",le="5.0"} 3',
+            'test_bucket{a="b",le="+Inf"} 4',
+            'test_sum{a="b"} 14.0',
+            'test_count{a="b"} 4',
+        ]
+
+class TestMetrics(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.config = self.write_config(CONVERSATION.replace(
+                "    - in: '*'", 
+                '    - {in: twice, out: "(rec|hello) (rec|hello)"}\n'
+                "    - in: '*'"))
+
+    def get_kernel(self):
+        from aerolito.kernel import Kernel
+        return Kernel(self.config, metrics=True)
+
+    def test_respond(self):
+        kernel = self.get_kernel()
+        assert kernel.respond(u'twice') == u'hi! hi!'
+        assert kernel.respond(u'Hello', 'renato') == u'hi!'
+
+        metrics = kernel._metrics
+        assert metrics.phases['total'].count == 2
+        assert metrics.phases['match'].count == 2
+        assert metrics.tested.sum == 4
+        assert metrics.depth.sum == 1
+
+        text = kernel.metrics_text()
+        assert 'aerolito_respond_seconds_count{phase="render"} 2\n' in text
+        assert 'aerolito_recursion_depth_bucket{le="1.0"} 2\n' in text
+        assert 'aerolito_sessions 2\n' in text
+        assert 'aerolito_session_memory_bytes 0\n' not in text
+
+    def test_session_memory(self):
+        from aerolito.metrics import session_memory
+        kernel = self.get_kernel()
+        kernel.respond(u'Hello')
+        kernel.respond(u'how are you')
+        sessions = kernel._environ['session']
+        size = session_memory(sessions)
+
+        # Sessions do not reference the knowledge base normalizer
+        synonyms = kernel._knowledge._synonyms
+        for i in xrange(3000):
+            synonyms[u'word%d'%i] = [u'synonym%d'%i]
+        assert session_memory(sessions) == size
+        assert sessions['default']['responses-normalized'] == [u'hi!', 
+                                                               u'fine']
+
+    def test_cache(self):
+        from aerolito.directives import Directive
+        class Lookup(Directive):
+            pure = True
+            def run(self, value):
+                return False
+
+        kernel = self.get_kernel()
+        kernel.add_directive('lookup', Lookup)
+        kernel.add_pattern({'in': 'check', 'out': 'a', 'when': {'lookup': 1}})
+        kernel.add_pattern({'in': 'check', 'out': 'b', 'when': {'lookup': 1}})
+        kernel.respond(u'check')
+
+        text = kernel.metrics_text()
+        assert 'aerolito_directive_cache_total{cache="request",result="hit"}'\
+               ' 1\n' in text
+        assert 'aerolito_directive_calls_total{directive="lookup"} 1\n' in text
+
+    def test_serve(self):
+        from aerolito import metrics
+        kernel = self.get_kernel()
+        kernel.respond(u'Hello')
+
+        server = metrics.serve(kernel, port=0)
+        try:
+            url = 'http://127.0.0.1:%d/metrics'%server.server_address[1]
+            text = urllib2.urlopen(url).read()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert text == kernel.metrics_text()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+# -*- coding:utf-8 -*-
+import unittest
+
+from helpers import TempDirTestCase, CONVERSATION, WEATHER
+
+class TestPipeline(unittest.TestCase):
+    def get_target(self, *args, **kw):
+        from aerolito.normalize import Pipeline
+        return Pipeline(*args, **kw)
+
+    def names(self, pipeline):
+        return [name for name, step in pipeline.stages()]
+
+    def test_default(self):
+        from aerolito.utils import normalize_input
+        synonyms = {u'hello': [u'hi', u'hey there'], u'you': [u'u']}
+        pipeline = self.get_target(None, synonyms)
+        assert self.names(pipeline) == ['accents', 'synonyms']
+
+        for text in (u'Olá, HI', u'hey there, how are u?', u'Coração'):
+            assert pipeline(text) == normalize_input(text, synonyms)
+        assert pipeline(u'hi hi') == u'hello hello'
+        assert self.get_target()(u'Olá') == u'Ola'
+
+    def test_fused(self):
+        pipeline = self.get_target(['accents', 'lower', 'punctuation', 
+                                    {'chars': {u'ß': u'ss'}}])
+        assert self.names(pipeline) == ['accents+lower+punctuation+chars']
+        assert pipeline(u'Olá, MUNDO! Straße *(x|y)') == \
+                                        u'ola mundo strasse *(x|y)'
+
+        pipeline = self.get_target([{'chars': {u'A': u'x'}}, 'lower'])
+        assert self.names(pipeline) == ['chars', 'lower']
+        assert pipeline(u'Aa') == u'xa'
+
+    def test_words(self):
+        pipeline = self.get_target(['lower', {'punctuation': u'?'}, 
+                {'contractions': {u"don't": u'do not', u"I'm": u'I am'}},
+                {'replace': [[u'\\bvc\\b', u'voce']]}])
+        assert self.names(pipeline) == ['lower+punctuation', 'contractions',
+                                        'replace']
+        assert pipeline(u"I'm sure vc DON'T?") == u'I am sure voce do not'
+        assert pipeline(u"dont") == u'dont'
+
+    def test_synonyms_reset(self):
+        synonyms = {}
+        pipeline = self.get_target(None, synonyms)
+        assert pipeline(u'Hi') == u'Hi'
+        synonyms[u'hello'] = [u'hi']
+        pipeline.reset()
+        assert pipeline(u'Hi') == u'hello'
+
+    def test_stats(self):
+        import threading
+        from aerolito.normalize import StageStats
+        pipeline = self.get_target(['accents', 'lower', 'synonyms'])
+        stats = StageStats()
+        pipeline(u'a', stats)
+        pipeline(u'b')
+        thread = threading.Thread(target=pipeline, args=(u'c', stats))
+        thread.start()
+        thread.join()
+
+        result = stats.stats()
+        assert sorted(result) == ['accents+lower', 'synonyms']
+        assert result['synonyms']['calls'] == 2
+        assert result['accents+lower']['total'] >= 0
+
+    def test_invalid(self):
+        from aerolito.exceptions import InvalidTagValue
+        self.assertRaises(InvalidTagValue, self.get_target, ['unknown'])
+        self.assertRaises(InvalidTagValue, self.get_target, 'accents')
+        self.assertRaises(InvalidTagValue, self.get_target, 
+                          [{'contractions': [1, 2]}])
+
+class TestKernelNormalize(TempDirTestCase):
+    def test_respond(self):
+        from aerolito.kernel import Kernel
+        contractions = self.write_file('contractions.yml', 
+                                       "\"who're\": who are\n")
+        config = self.write_file('config.yml', 
+                'botname: chapolin\nconversations:\n    - %s\n'
+                'topics:\n    weather: [%s]\n'
+                'normalize:\n    - accents\n    - lower\n'
+                '    - {contractions: %s}\n    - punctuation\n'%(
+                self.write_file('conversation.yml', CONVERSATION),
+                self.write_file('weather.yml', WEATHER), contractions))
+        assert Kernel(config).normalize_stats() == {}
+        kernel = Kernel(config, metrics=True)
+
+        assert kernel.respond(u"Who're you?") == u'I am chapolin'
+        assert kernel.respond(u'Héllo!!') == u'hi!'
+        assert kernel._environ['session']['default']['inputs'] == \
+                                            [u'who are you', u'hello']
+
+        stats = kernel.normalize_stats()
+        assert sorted(stats) == ['accents+lower', 'contractions', 
+                                 'punctuation']
+        assert stats['punctuation']['calls'] == 4
+        assert 'aerolito_normalize_calls_total{stage="punctuation"}' in \
+               kernel.metrics_text()
@@ -282,12 +282,48 @@ class TestPattern(unittest.TestCase):
         print pattern._when
         assert pattern.match('hello', environ)
     
+    def test_match_conditions(self):
+        from aerolito.directives import load_directives
+        environ = self.get_stub_environ()
+        environ['topics'] = {}
+        environ['directives'] = load_directives(environ)
+        environ['directives']['add'] = lambda v: v[0]+v[1]
+        p = {'in': 'hello *', 
+             'when': [{'equal': ['<name>', 'Renato']}, {'isdefined': 'name'},
+                      {'equal': ['<star>', 'there']}, {'add': [1, -1]}]}
+        pattern = self.get_target(p, environ)
+
+        assert [c._test for c in pattern._requires] == \
+               [environ['directives']['isdefined'].test,
+                environ['directives']['equal'].test]
+        assert len(pattern._when) == 2
+
+        assert not pattern.match('hello there', environ)
+        assert environ['session'][1]['stars'] == []
+
+        environ['session'][1]['locals']['name'] = 'Renato'
+        assert not pattern.match('hello you', environ)
+        assert not pattern.match('hello there', environ)
+
+        pattern = self.get_target(dict(p, when=p['when'][:3]), environ)
+        assert pattern.match('hello there', environ)
+
     def test_match_with_ignore(self):
         p = {'ignore':',!', 'in':'hello,,,,,!!! there'}
         environ = self.get_stub_environ()
         pattern = self.get_target(p, environ)
 
         assert pattern.match('hello, there', environ)
+
+    def test_match_with_ignore_number(self):
+        environ = self.get_stub_environ()
+        pattern = self.get_target({'ignore': 1, 'in': 'hello1 there'}, 
+                                  environ)
+        assert pattern.match('hello there', environ)
+
+        pattern = self.get_target({'ignore': [1, '!'], 'in': 'hello'}, 
+                                  environ)
+        assert pattern.match('hello1!', environ)
     
     def test_choice_output(self):
         environ = self.get_stub_environ()
@@ -302,6 +338,69 @@ class TestPattern(unittest.TestCase):
         environ['globals']['name'] = 'renato'
         assert pattern.choice_output(environ) == u'olá renato'
 
+    def test_lazy(self):
+        environ = self.get_stub_environ()
+        p = {'in': 'Knock knock *', 'out': 'who?'}
+        pattern = self.get_target(p, environ, lazy=True)
+
+        assert pattern._in is None
+        assert pattern._out is None
+        assert pattern._keys == [(u'knock', True)]
+
+        assert pattern.match('Knock KNOCK block', environ)
+        assert pattern._raw is None
+        assert len(pattern._in) == 1
+        assert environ['session'][1]['stars'] == ['block']
+        assert pattern.choice_output(environ) == 'who?'
+
+    def test_lazy_concurrent(self):
+        import sys
+        import threading
+        environ = self.get_stub_environ()
+        errors = []
+
+        def compile(patterns):
+            try:
+                for pattern in patterns:
+                    pattern.compile()
+            except Exception:
+                errors.append(sys.exc_info()[1])
+
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            for run in xrange(5):
+                patterns = [self.get_target({'in': 'hello %d *'%i, 
+                                             'out': 'hi'}, environ, lazy=True)
+                            for i in xrange(3000)]
+                threads = [threading.Thread(target=compile, args=(patterns,))
+                           for i in xrange(4)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+                assert all(p._raw is None and len(p._in) == 1 
+                           for p in patterns)
+        finally:
+            sys.setcheckinterval(interval)
+
+        assert errors == []
+
+    def test_lazy_badvalue(self):
+        from aerolito.exceptions import InvalidTagValue
+        from aerolito.exceptions import InvalidMeaningKey
+        environ = self.get_stub_environ()
+
+        self.assertRaises(InvalidTagValue, self.get_target, 
+                          {'in': None}, environ, lazy=True)
+        self.assertRaises(InvalidTagValue, self.get_target, 
+                          {'in': 'hi', 'when': {'nodirective': 1}}, 
+                          environ, lazy=True)
+        self.assertRaises(InvalidMeaningKey, self.get_target, 
+                          {'in': 'hi', 'out': '(mean|nomeaning)'}, 
+                          environ, lazy=True)
+
     def test_execute_post(self):
         environ = self.get_stub_environ()
         pattern = self.get_target({'post':[{'define':['abc', 'hehe']}]}, environ)
@@ -0,0 +1,51 @@
+# -*- coding:utf-8 -*-
+import sys
+
+from helpers import KernelTestCase
+
+class TestProfiler(KernelTestCase):
+    def get_kernel(self, *args, **kw):
+        from aerolito.kernel import Kernel
+        return Kernel(self.config, *args, **kw)
+
+    def test_disabled(self):
+        kernel = self.get_kernel()
+        assert kernel.respond(u'hello') == u'hi!'
+        assert kernel._profiler is None
+        assert kernel.profile_stacks() is None
+        assert kernel.profile_stats() == {'patterns': [], 'directives': []}
+
+    def test_sample(self):
+        profiles = []
+        kernel = self.get_kernel(profile_sample_rate=1, 
+                                 profile_sink=profiles.append)
+        assert kernel.respond(u"let's talk about weather") == u'ok'
+        assert kernel.respond(u'hello') == u'hi!'
+        assert sys.getprofile() is None
+
+        profiler = kernel._profiler
+        assert profiler.samples == 2
+        assert len(profiles) == 2
+        assert u'pattern hello' in profiles[1].patterns
+        assert u'directive activate' in profiles[0].directives
+        assert u'directive activate' not in profiles[1].directives
+
+        stats = kernel.profile_stats()
+        assert [x[0] for x in stats['directives']] == [u'directive activate']
+        labels = [x[0] for x in stats['patterns']]
+        assert u'pattern hello' in labels
+        assert u"pattern let's talk about weather" in labels
+
+        lines = kernel.profile_stacks().splitlines()
+        assert lines
+        for line in lines:
+            stack, microseconds = line.rsplit(' ', 1)
+            assert int(microseconds) >= 0
+            assert stack.startswith('kernel.py:__respond')
+        assert any(';pattern hello' in line for line in lines)
+
+    def test_rate(self):
+        kernel = self.get_kernel(profile_sample_rate=0.5)
+        kernel._profiler.sample = lambda: False
+        kernel.respond(u'hello')
+        assert kernel._profiler.samples == 0
@@ -65,5 +65,32 @@ class TestRegex(unittest.TestCase):
         star3 = regex._stars[2]
         assert star3 == ''
 
+    def test_shared_expression(self):
+        regex1 = self.get_target(u'Hello *')
+        regex2 = self.get_target(u'Hello *')
+        assert regex1.match(u'Hello there')
+        assert regex2.match(u'Hello you')
+
+        assert regex1._regex is regex2._regex
+        assert regex1._expression is regex2._expression
+        assert regex2._stars == ['you']
+
+    def test_shared_expression_not_compiled(self):
+        regex1 = self.get_target(u'Good bye *')
+        regex2 = self.get_target(u'Good bye *')
+        assert regex1._regex is None
+        assert regex1._expression is regex2._expression
+        assert regex1._expression == u'^Good\\ bye(.*)$'
+
+    def test_search(self):
+        regex = self.get_target(u'Hello *')
+        assert regex.search(u'Hello Renato') == ['Renato']
+        assert regex.search(u'Bye') is None
+        assert regex._stars is None
+
+    def test_slots(self):
+        regex = self.get_target(u'Hello')
+        assert not hasattr(regex, '__dict__')
+
 if __name__ == '__main__':
     unittest.main()
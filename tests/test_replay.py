@@ -0,0 +1,113 @@
+# -*- coding:utf-8 -*-
+import os
+import unittest
+
+from helpers import TempDirTestCase
+
+OLD = u'''
+patterns:
+    - in: hello
+      out: hi!
+    - after: hi!
+      in: how are you
+      out: fine
+    - in: '*'
+      out: what?
+'''
+
+NEW = u'''
+patterns:
+    - in: hello
+      out: hi!
+    - after: hi!
+      in: how are you
+      out: very well
+    - in: bye
+      out: [bye!, see you!, later!]
+    - in: '*'
+      out: what?
+'''
+
+class TestReplay(TempDirTestCase):
+    """Tests ``replay`` module"""
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.old = self.write_config(OLD, None, 'old-')
+        self.new = self.write_config(NEW, None, 'new-')
+
+    def get_records(self):
+        return [(u'a', u'hello'), (u'b', u'how are you'), 
+                (u'a', u'how are you'), (u'b', u'bye')]
+
+    def test_run(self):
+        from aerolito import replay
+        report = replay.run(self.old, self.new, self.get_records())
+
+        assert report.inputs == 4
+        assert report.changed == [(u'a', u'how are you', u'fine', 
+                                   u'very well'),
+                                  (u'b', u'bye', u'what?', 
+                                   report.changed[1][3])]
+        assert report.hit_changes() == [
+                    (u'pattern (.*) (new-conversation.yml:4)', 2, 1),
+                    (u'pattern bye (new-conversation.yml:3)', 0, 1)]
+        assert sorted(report.hits.values()) == [[0, 1], [1, 1], [1, 1], 
+                                                [2, 1]]
+        assert report.throughput() > 0
+
+        text = report.text(limit=1)
+        assert u'4 inputs' in text
+        assert u'2 responses changed' in text
+        assert u'  + very well' in text
+        assert u'... 1 more' in text
+        assert u'  -1\t2 -> 1\tpattern (.*) (new-conversation.yml:4)' in text
+
+    def test_when_variants(self):
+        from aerolito import replay
+        old = self.write_config(u'''
+patterns:
+    - {in: hello, out: hi!, when: {isdefined: name}}
+    - {in: hello, out: hello!}
+''', None, 'when-')
+        new = self.write_config(u'''
+patterns:
+    - {in: hello, out: hi!, when: {isnotdefined: name}}
+    - {in: hello, out: hello!}
+''', None, 'other-')
+        report = replay.run(old, new, [(u'a', u'hello')])
+        assert report.hit_changes() == [
+                    (u'pattern hello (other-conversation.yml:1)', 0, 1),
+                    (u'pattern hello (when-conversation.yml:2)', 1, 0)]
+
+    def test_same_config(self):
+        from aerolito import replay
+        report = replay.run(self.new, self.new, self.get_records()*10)
+        assert report.inputs == 40
+        assert report.changed == []
+        assert report.hit_changes() == []
+
+    def test_run_parallel(self):
+        from aerolito import replay
+        records = [(unicode(i % 7), text) 
+                   for i, (u, text) in enumerate(self.get_records()*10)]
+        serial = replay.run(self.old, self.new, records)
+        parallel = replay.run(self.old, self.new, records, workers=3, 
+                              window=4)
+
+        assert serial.changed == parallel.changed
+        assert serial.hits == parallel.hits
+
+    def test_transcript(self):
+        from aerolito import replay
+        from aerolito.kernel import Kernel
+        filename = os.path.join(self.path, 'transcript.jsonl')
+        with Kernel(self.old, transcript=filename) as kernel:
+            for user_id, text in self.get_records():
+                kernel.respond(text, user_id)
+
+        records = list(replay.read_records([filename]))
+        assert records == self.get_records()
+
+if __name__ == '__main__':
+    unittest.main()
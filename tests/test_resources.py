@@ -0,0 +1,91 @@
+# -*- coding:utf-8 -*-
+import os
+import sqlite3
+import threading
+import unittest
+
+from helpers import TempDirTestCase
+
+class TestResources(TempDirTestCase):
+    def get_target(self, *args, **kw):
+        from aerolito.resources import Resources
+        return Resources(*args, **kw)
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.database = os.path.join(self.path, 'bot.db')
+        connection = sqlite3.connect(self.database)
+        connection.execute('CREATE TABLE users (name TEXT, age INTEGER)')
+        connection.execute("INSERT INTO users VALUES ('renato', 27)")
+        connection.commit()
+        connection.close()
+
+        self.names = os.path.join(self.path, 'names.txt')
+        open(self.names, 'w').write('Renato\n\n  Bozo \n')
+
+    def test_config(self):
+        resources = self.get_target({
+            'db': {'type': 'sqlite', 'database': self.database, 'size': 2},
+            'names': {'type': 'lines', 'file': self.names, 'lower': True},
+            'memo': {'type': 'cache', 'size': 2},
+        })
+
+        assert 'db' in resources
+        assert resources._resources == {}
+        assert resources.get('db') is resources.get('db')
+        assert resources.get('names') == frozenset([u'renato', u'bozo'])
+        assert resources.get('db').query_one(
+                    'SELECT age FROM users WHERE name = ?', ('renato',)) == (27,)
+
+        resources.close()
+        assert resources._resources == {}
+
+    def test_invalid_config(self):
+        from aerolito.exceptions import InvalidTagValue, MissingTag
+        from aerolito.exceptions import ResourceNotFound, DuplicatedResource
+        self.assertRaises(InvalidTagValue, self.get_target, 
+                          {'db': {'type': 'mysql'}})
+        self.assertRaises(MissingTag, self.get_target, {'db': 'sqlite'})
+
+        resources = self.get_target()
+        resources.add('one', lambda: 1)
+        self.assertRaises(DuplicatedResource, resources.add, 'one', list)
+        self.assertRaises(ResourceNotFound, resources.get, 'two')
+
+    def test_sqlite_pool(self):
+        from aerolito.resources import SQLite
+        from aerolito.exceptions import ResourceClosed
+        pool = SQLite(self.database, size=2)
+        lookup = pool.lookup('SELECT age FROM users WHERE name = ?')
+
+        results = []
+        def run():
+            for i in xrange(20):
+                results.append(lookup('renato'))
+        threads = [threading.Thread(target=run) for i in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert results == [27]*80
+        assert pool._created <= 2
+        assert lookup('bozo') is None
+
+        pool.close()
+        self.assertRaises(ResourceClosed, pool.query, 'SELECT 1')
+
+    def test_cache(self):
+        from aerolito.resources import Cache
+        cache = Cache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        assert cache.get('a') == 1
+        cache.set('c', 3)
+
+        assert 'b' not in cache
+        assert cache.get('a') == 1 and cache.get('c') == 3
+        assert cache.get('b', 0) == 0
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+# -*- coding:utf-8 -*-
+import unittest
+
+class TestSession(unittest.TestCase):
+    def get_session(self):
+        return {
+            'inputs': [u'hello', u'how are you'],
+            'responses': [u'hi!', u'Fine'],
+            'responses-normalized': [u'hi', u'fine'],
+            'stars': [u'renato'],
+            'locals': {u'name': u'José', 'age': 27, 'height': 1.8, 
+                       'debt': -10**20, 'tags': [None, True, False, 'raw']},
+            'topics': ['weather'],
+        }
+
+    def test_dump_session(self):
+        from aerolito.session import dump_session, load_session
+        user_id, session = load_session(dump_session(7, self.get_session()))
+
+        expected = self.get_session()
+        for key in ('inputs', 'responses', 'responses-normalized'):
+            expected[key] = expected[key][-1:]
+
+        assert user_id == 7
+        assert session == expected
+
+    def test_dump_sessions(self):
+        from aerolito.session import dump_sessions, load_sessions
+        sessions = [(i, self.get_session()) for i in xrange(10)]
+        result = load_sessions(dump_sessions(sessions))
+
+        assert [user_id for user_id, session in result] == range(10)
+        assert result[3][1]['locals'] == self.get_session()['locals']
+
+    def test_invalid_data(self):
+        from aerolito.exceptions import InvalidSessionData
+        from aerolito.session import dump_session, load_session
+        data = dump_session('default', self.get_session())
+
+        self.assertRaises(InvalidSessionData, load_session, 'XYZ' + data[3:])
+        self.assertRaises(InvalidSessionData, load_session, data[:-1])
+        self.assertRaises(InvalidSessionData, load_session, data + 'N')
+
+        session = self.get_session()
+        session['locals']['file'] = object()
+        self.assertRaises(InvalidSessionData, dump_session, 'default', session)
+
+class TestSessionMap(unittest.TestCase):
+    def get_target(self, *args, **kw):
+        from aerolito.session import SessionMap
+        return SessionMap(*args, **kw)
+
+    def test_map(self):
+        sessions = self.get_target(4)
+        for i in xrange(10):
+            sessions[i] = {'user': i}
+
+        assert len(sessions) == 10
+        assert 3 in sessions and 10 not in sessions
+        assert sessions[3] == {'user': 3}
+        assert sessions.get(10) is None
+        assert sorted(sessions.keys()) == range(10)
+        assert sorted(sessions) == range(10)
+
+        del sessions[3]
+        assert 3 not in sessions and len(sessions) == 9
+        self.assertRaises(KeyError, sessions.__getitem__, 3)
+
+    def test_setdefault(self):
+        import threading
+        sessions = self.get_target()
+        created = []
+        def run(i):
+            session = {'thread': i}
+            if sessions.setdefault('user', session) is session:
+                created.append(i)
+        threads = [threading.Thread(target=run, args=(i,)) for i in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(created) == 1
+        assert sessions['user'] == {'thread': created[0]}
+
+    def test_lock(self):
+        sessions = self.get_target()
+        assert sessions.lock('a') is sessions.lock('a')
+        assert sessions.lock('a') is not sessions.lock('b')
+
+class TestEnviron(unittest.TestCase):
+    def test_request_keys(self):
+        import threading
+        from aerolito.session import Environ
+        environ = Environ({'user_id': None, 'request': None, 'globals': {}})
+        environ['user_id'] = 'main'
+        environ['globals'] = {'a': 1}
+
+        values = []
+        def run():
+            values.append((environ['user_id'], environ['globals']))
+            environ['user_id'] = 'thread'
+            values.append(environ.get('user_id'))
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+
+        assert values == [(None, {'a': 1}), 'thread']
+        assert environ['user_id'] == 'main'
+        assert environ.bind(lambda: environ['user_id'])() == 'main'
+
+class TestHistory(unittest.TestCase):
+    def test_compact_response(self):
+        from aerolito.pattern import make_literal
+        from aerolito.session import compact_response, expand_response
+        literal = make_literal(u'hi <name>, (rec|how are you)!')
+        plain = make_literal(u'hello')
+
+        assert compact_response(plain, u'hello') is plain
+        assert compact_response(plain, u'other') == u'other'
+        assert compact_response(literal, u'hi a, b!') == \
+                                            (literal, (u'a', u'b'))
+
+        for output in (u'hi , !', u'hi <x>, y\n!', u'hi a!, b!!', u'x'):
+            record = compact_response(literal, output)
+            assert expand_response(record) == output
+
+    def test_templates_released(self):
+        import gc
+        from aerolito.pattern import make_literal
+        from aerolito.session import compact_response, _templates
+        literal = make_literal(u'bye <name>, see you')
+        assert compact_response(literal, u'bye a, see you') == \
+                                            (literal, (u'a',))
+        assert literal in _templates
+
+        size = len(_templates)
+        del literal
+        gc.collect()
+        assert len(_templates) == size - 1
+
+    def test_session(self):
+        from aerolito.pattern import make_literal
+        from aerolito.session import make_session, compact_response
+        session = make_session(lambda x: x.lower())
+        history = session['history']
+        literal = make_literal(u'Hi <name>')
+        for name in (u'A', u'B', u'C'):
+            history.add(compact_response(literal, u'Hi %s'%name), u'last')
+
+        assert session['responses'] == [u'Hi A', u'Hi B', u'Hi C']
+        assert session['responses'][-2] == u'Hi B'
+        assert session['responses'][1:] == [u'Hi B', u'Hi C']
+        assert session['responses-normalized'] == [u'hi a', u'hi b', u'last']
+        self.assertRaises(IndexError, lambda: session['responses'][3])
+
+        del session['responses'][:-1]
+        assert len(session['responses-normalized']) == 1
+        assert session['responses-normalized'][-1] == u'last'
+        del session['responses'][-1]
+        assert not session['responses']
+
+    def test_memory(self):
+        from aerolito.utils import deep_sizeof
+        from aerolito.pattern import make_literal
+        from aerolito.session import make_session, compact_response
+        literals = [make_literal(u'Sorry, I did not understand. Can you '
+                                 u'say it again? %d'%i) for i in xrange(3)]
+        session = make_session()
+        plain = {'responses': [], 'responses-normalized': []}
+        for i in xrange(1000):
+            literal = literals[i%3]
+            output = u''.join(literal._value)
+            session['history'].add(compact_response(literal, output), output)
+            plain['responses'].append(output)
+            plain['responses-normalized'].append(output.lower())
+
+        seen = set(id(x) for x in literals)
+        assert deep_sizeof(session, set(seen))*10 < deep_sizeof(plain, seen)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+# -*- coding:utf-8 -*-
+import os
+
+from helpers import KernelTestCase
+
+class TestStorage(KernelTestCase):
+    def setUp(self):
+        KernelTestCase.setUp(self)
+        self.filename = os.path.join(self.path, 'knowledge.bin')
+
+    def get_kernel(self):
+        from aerolito import storage
+        from aerolito.kernel import Kernel
+        storage.save(self.config, self.filename)
+        return Kernel(knowledge=storage.load(self.filename))
+
+    def test_load(self):
+        kernel = self.get_kernel()
+        knowledge = kernel._knowledge
+
+        assert knowledge._frozen
+        assert len(knowledge._patterns) == 6
+        assert knowledge._patterns._patterns == {}
+        assert knowledge._config['botname'] == 'chapolin'
+        assert len(knowledge.load_topic('weather')['patterns']) == 2
+
+    def test_respond(self):
+        kernel = self.get_kernel()
+
+        assert kernel.respond(u'Hello') == u'hi!'
+        assert kernel.respond(u'how are you') == u'fine'
+        assert kernel.respond(u'how are you') == u'what?'
+        assert kernel.respond(u'call me Renato') == u'nice to meet you, Renato'
+        assert kernel.respond(u'who are you') == u'I am chapolin'
+        assert sorted(kernel._knowledge._patterns._patterns) == [0, 1, 2, 4, 5]
+
+    def test_topics(self):
+        kernel = self.get_kernel()
+
+        assert kernel.respond(u'is it sunny') == u'what?'
+        assert kernel.respond(u"let's talk about weather") == u'ok'
+        assert kernel.respond(u'is it sunny') == u'yes'
+        assert kernel.respond(u'stop') == u'bye'
+        assert kernel.respond(u'is it sunny') == u'what?'
+
+    def test_invalid_file(self):
+        from aerolito import storage
+        from aerolito.exceptions import InvalidKnowledgeFile
+        filename = self.write_file('invalid.bin', '\0'*64)
+        self.assertRaises(InvalidKnowledgeFile, storage.load, filename)
@@ -0,0 +1,91 @@
+# -*- coding:utf-8 -*-
+import os
+import unittest
+
+from helpers import KernelTestCase
+
+class TestTranscript(KernelTestCase):
+    def read(self, filename):
+        from aerolito.transcript import read_transcript
+        return [(e['user_id'], e['input'], e['response'])
+                for e in read_transcript(filename)]
+
+    def test_kernel(self):
+        from aerolito.kernel import Kernel
+        filename = os.path.join(self.path, 'transcript.jsonl')
+        with Kernel(self.config, transcript=filename) as kernel:
+            assert kernel.respond(u'hello') == u'hi!'
+            kernel.respond(u'hello', user_id=u'chaves', registry=False)
+            kernel.respond(u'hello', user_id=u'chaves')
+
+        assert self.read(filename) == [(u'default', u'hello', u'hi!'),
+                                       (u'chaves', u'hello', u'hi!')]
+        assert kernel._transcript.written == 2
+        assert not kernel._transcript.is_alive()
+
+    def test_compressed(self):
+        from aerolito.transcript import TranscriptWriter
+        filename = os.path.join(self.path, 'transcript.jsonl.gz')
+        for text in (u'olá', u'hello'):
+            writer = TranscriptWriter(filename)
+            writer.start()
+            writer.write('default', text, u'hi!')
+            writer.close()
+
+        assert writer.compress
+        assert self.read(filename) == [('default', u'olá', u'hi!'),
+                                       ('default', u'hello', u'hi!')]
+
+    def test_batches(self):
+        from aerolito.transcript import TranscriptWriter
+        filename = os.path.join(self.path, 'transcript.jsonl')
+        writer = TranscriptWriter(filename, batch_size=10)
+        for i in xrange(25):
+            writer.write('default', unicode(i), u'hi!')
+        writer.start()
+        writer.flush()
+
+        assert writer.written == 25
+        assert writer.batches == 3
+        assert len(self.read(filename)) == 25
+        writer.close()
+
+    def test_backpressure(self):
+        from aerolito.transcript import TranscriptWriter
+        filename = os.path.join(self.path, 'transcript.jsonl')
+        writer = TranscriptWriter(filename, queue_size=2, block=False)
+        for i in xrange(5):
+            writer.write('default', unicode(i), u'hi!')
+        writer.close()
+
+        assert writer.dropped == 3
+        assert [e[1] for e in self.read(filename)] == [u'0', u'1']
+
+    def test_invalid_input(self):
+        from aerolito.transcript import TranscriptWriter
+        filename = os.path.join(self.path, 'transcript.jsonl')
+        writer = TranscriptWriter(filename)
+        writer.start()
+        writer.write('default', '\xff\xfe', u'hi!')
+        writer.write('default', u'hello', u'hi!')
+        writer.flush()
+
+        assert writer.is_alive()
+        assert writer.error is None
+        assert writer.dropped == 1
+        assert writer.written == 1
+        writer.close()
+        assert self.read(filename) == [('default', u'hello', u'hi!')]
+
+    def test_closed(self):
+        from aerolito import exceptions
+        from aerolito.transcript import TranscriptWriter
+        writer = TranscriptWriter(os.path.join(self.path, 'transcript.jsonl'))
+        writer.start()
+        writer.close()
+        writer.close()
+        self.assertRaises(exceptions.TranscriptClosed, writer.write, 
+                          'default', u'hello', u'hi!')
+
+if __name__ == '__main__':
+    unittest.main()